@@ -1,34 +1,30 @@
 import dash
-from dash import dcc, html, Input, Output, State
+from dash import dcc, html, Input, Output, State, Patch
 import dash_bootstrap_components as dbc
 from dash import dash_table
 from dash.dependencies import ALL
-import pandas as pd
 import numpy as np
 import json
 import base64
-import sys, os, csv, json
+import sys, os, csv, json, uuid
 
 
-from stage_calc import calculate_power_function, get_all_powers
+from stage_calc import calculate_power_function, get_all_powers, ThermalModel, power_total, NUMERIC_FIELDS, numeric_value
+from model_store import ModelStore
 
 
 abspath = os.path.abspath(__file__)
 file_path = os.path.dirname(abspath)
 sys.path.insert(0, f"{file_path}{os.sep}..{os.sep}..{os.sep}")
+import thermal_conductivity.tc_tools as tc_tools
 
 # Initialize the Dash app
 app = dash.Dash(__name__, external_stylesheets=[dbc.themes.BOOTSTRAP])
+server = app.server # for WSGI servers, e.g. gunicorn --workers 4 --threads 4 dashGUI:server
 
-path_to_tcFiles = f"{file_path}{os.sep}..{os.sep}..{os.sep}"
-all_files = os.listdir(path_to_tcFiles)
-exist_files = [file for file in all_files if file.startswith("tc_fullrepo")]
-tc_file_date = exist_files[0][-12:-4]
-
-TCdata = np.loadtxt(f"{path_to_tcFiles}{os.sep}tc_fullrepo_{tc_file_date}.csv", dtype=str, delimiter=',') # imports compilation file csv
-
-
-mat_list = list(TCdata[1:, 0])
+# Material names of the most recent compilation, from its binary catalog (see tc_tools.set_catalog) -
+# the compilation csv is not parsed
+mat_list = tc_tools.get_registry().names()
 
 # Cryogenic stages
 stages = ["PTC 1", "PTC 2", "4K - LHe", "1K", "300mK", "100mK"]
@@ -78,7 +74,7 @@ cooling_table = dash_table.DataTable(
 )
 
 # Layout of the app
-app.layout = html.Div([
+main_layout = html.Div([
     html.Div(
             [
                 html.Div(
@@ -553,7 +549,9 @@ app.layout = html.Div([
                 html.Hr(),
                 dbc.Row([
                     html.H2("Components by Cryogenic Stage"),
-                    html.Div(id="table-container")
+                    # One division per stage, so a callback only sends the tables of the stages that changed
+                    html.Div(id="table-container",
+                             children=[html.Div(id={"type": "stage-tables", "index": stage}) for stage in stages])
                 ]),
                 dbc.Row(dbc.Col(dbc.Button("Clear Cache", id="clear-cache", className="clearcachebutton mr-2"))),
                 dbc.Row(
@@ -576,28 +574,55 @@ app.layout = html.Div([
         dcc.Tab(
             label = 'Results',
             children=[
-                html.Div(id="temperature-table", children = [temperature_table], className="results-table"),
-                html.Div(id="cooling-table", children = [cooling_table], className="results-table")
+                html.Div(id="temperature-table-div", children = [temperature_table], className="results-table"),
+                html.Div(id="cooling-table-div", children = [cooling_table], className="results-table")
             ])
     ])
     
 ])
 
-# Initial empty components dictionary
-components = {stage: {} for stage in stages}
+def new_model():
+    # Initial empty model - the components of each stage, the stage temperatures and the stage total powers
+    model = ThermalModel({stage: {} for stage in stages}, stage_details)
+    model.pop_changed() # the layout starts with the empty tables of every stage
+    return model
+
+# The model of each session is kept server-side, shared by every worker process and thread
+model_store = ModelStore(new_model)
+
+def serve_layout():
+    # Every page load gets a new session id, which the browser tab keeps for its session (a reload keeps its model)
+    model_store.expire()
+    return html.Div([dcc.Store(id="session-id", data=str(uuid.uuid4()), storage_type="session"), main_layout])
+
+app.layout = serve_layout
 
 @app.callback(
-    Output("table-container", "children"), #, Output("stage-details-table-container", "children")
-    [Input("add", "n_clicks"), Input("upload-json", "contents"), Input("calculate-power", "n_clicks"), Input({"type": "editable-table", "index": dash.ALL}, "data")],
+    [Output({"type": "stage-tables", "index": ALL}, "children"), Output("temperature-table", "data")],
+    Input("session-id", "data")
+)
+def load_session(session_id):
+    # Draws every table of the session's model when the page is loaded. Only read: the stored model has no
+    # pending changes (every callback changing it renders them), and a new session is only written once changed
+    model = model_store.read(session_id)
+    temperature_data = [{"Stage": stage,
+                         "Temperature (K)": model.stage_details[stage]["lowT"],
+                         "Total Power (W)": f"{model.totals[stage]:.2e}"}
+                        for stage in stages]
+    return [generate_stage_tables(model, stage) for stage in stages], temperature_data
+
+@app.callback(
+    [Output({"type": "stage-tables", "index": ALL}, "children", allow_duplicate=True),
+     Output("temperature-table", "data", allow_duplicate=True)],
+    [Input("add", "n_clicks"), Input("upload-json", "contents"), Input("calculate-power", "n_clicks")],
     [State("cryogenic-stage", "value"), State("type", "value"), State("component", "value"), State("material", "value"), State("od", "value"), 
      State("id", "value"), State("length", "value"), State("power", "value"), State("number", "value"), State("case-mat", "value"), 
      State("insulator-mat", "value"), State("core-mat", "value"), State("case-od", "value"), 
-     State("insulator-od", "value"), State("core-od", "value"), State("A_L", "value"), State("table-container", "children")],
+     State("insulator-od", "value"), State("core-od", "value"), State("A_L", "value"), State("session-id", "data")],
     prevent_initial_call=True
 )
-def add_component(n_clicks, json_contents, calc_clicks, updated_data, stage, entry_type, component, 
-                  material, od, id_val, length, power, number, case_mat, insulator_mat, core_mat, case_od, insulator_od, core_od, A_L, current_table):
-    global components, stage_details
+def add_component(n_clicks, json_contents, calc_clicks, stage, entry_type, component, 
+                  material, od, id_val, length, power, number, case_mat, insulator_mat, core_mat, case_od, insulator_od, core_od, A_L, session_id):
     ctx = dash.callback_context
 
     if not ctx.triggered:
@@ -605,111 +630,98 @@ def add_component(n_clicks, json_contents, calc_clicks, updated_data, stage, ent
 
     trigger = ctx.triggered[0]['prop_id'].split('.')[0]
 
-    if trigger == 'add':
-        if stage and number and component:
-            if stage not in components:
-                components[stage] = {}
-            
-            # Ensure the component name is a unique key within the stage
-            if component not in components[stage]:
-                components[stage][component] = {}
-
-            if entry_type == "Component": 
-                components[stage][component] = {
-                    "Name": component,
-                    "Type": "Component",
-                    "material": material,
-                    "OD": od, 
-                    "ID": id_val, 
-                    "length": length,
-                    "number": number,
-                    "Power per Part (W)": 0,
-                    "Power Total (W)": 0,
-                }
-            elif entry_type == "Coax":
-                components[stage][component] = {
-                    "Name": component,
-                    "Type": "Coax",
-                    "mat_C": case_mat,
-                    "mat_I": insulator_mat,
-                    "material": core_mat,
-                    "OD" : case_od,
-                    "OD_I": insulator_od,
-                    "OD_c": core_od,
-                    "length": length,
-                    "number": number,
-                    "Power per Part (W)": 0,
-                    "Power Total (W)": 0,
-                }
-            elif entry_type == "A/L":
-                components[stage][component] = {
-                    "Name": component,
-                    "Type": "A/L",
-                    "material": material,
-                    "A/L" : A_L,
-                    "number": number,
-                    "Power per Part (W)": 0,
-                    "Power Total (W)": 0,
-                }
-            elif entry_type == "Other" and power:
-                components[stage][component] = {
-                    "Name": component,
-                    "Type": "Other",
-                    "number": number,
-                    "Power per Part (W)": power,
-                    "Power Total (W)": power * number,  # Direct calculation for Other type
-                }
-            print("\n")
-            for stage in components:
-                print(f"\n{stage}")
-                print(f"Components after addition: {components[stage].keys()}")
-    elif trigger == 'upload-json' and json_contents:
-        content_type, content_string = json_contents.split(',')
-        decoded = base64.b64decode(content_string).decode('utf-8')
-        json_data = json.loads(decoded)
-
-        # Update the global components dictionary with the nested structure
-        new_components = json_data.get("components", {})
-        for stage, components_dict in new_components.items():
-            if stage not in components:
-                components[stage] = {}
-            for component_name, details in components_dict.items():
-                components[stage][component_name] = details
-
-        # Update the global stage_details dictionary
-        stage_details = json_data.get("stage_details", stage_details)
-
-    elif trigger == 'calculate-power':
-        components = get_all_powers(components, stage_details)
-    elif trigger == "new-process-button":
-        components, stage_details = optimize_tm(components, stage_details)
-    elif trigger == '{"type":"editable-table","index":ALL}':
-        for stage, comps in components.items():
-            updated_stage_data = next(item for item in updated_data if item['index'] == stage)
-            df = pd.DataFrame(updated_stage_data['data'])
-            df.set_index("Name", inplace=True)
-            components[stage] = df.to_dict(orient="index")
-
-    # print("\n")
-    # for stage in components:
-    #     print(f"\n{stage}")
-    #     print(f"Components after addition: {components[stage]}")
-    # make_results()
-    return generate_table()
+    with model_store.session(session_id) as model:
+        if trigger == 'add':
+            if stage and number and component:
+                # The component name is a unique key within the stage
+                details = None
+                if entry_type == "Component": 
+                    details = {
+                        "Name": component,
+                        "Type": "Component",
+                        "material": material,
+                        "OD": od, 
+                        "ID": id_val, 
+                        "length": length,
+                        "number": number,
+                        "Power per Part (W)": 0,
+                        "Power Total (W)": 0,
+                    }
+                elif entry_type == "Coax":
+                    details = {
+                        "Name": component,
+                        "Type": "Coax",
+                        "mat_C": case_mat,
+                        "mat_I": insulator_mat,
+                        "material": core_mat,
+                        "OD" : case_od,
+                        "OD_I": insulator_od,
+                        "OD_c": core_od,
+                        "length": length,
+                        "number": number,
+                        "Power per Part (W)": 0,
+                        "Power Total (W)": 0,
+                    }
+                elif entry_type == "A/L":
+                    details = {
+                        "Name": component,
+                        "Type": "A/L",
+                        "material": material,
+                        "A/L" : A_L,
+                        "number": number,
+                        "Power per Part (W)": 0,
+                        "Power Total (W)": 0,
+                    }
+                elif entry_type == "Other" and power:
+                    details = {
+                        "Name": component,
+                        "Type": "Other",
+                        "number": number,
+                        "Power per Part (W)": power,
+                        "Power Total (W)": power * number,  # Direct calculation for Other type
+                    }
+                if details is not None:
+                    model.set_component(stage, component, details)
+        elif trigger == 'upload-json' and json_contents:
+            content_type, content_string = json_contents.split(',')
+            decoded = base64.b64decode(content_string).decode('utf-8')
+            json_data = json.loads(decoded)
+
+            # Update the model with the nested structure - only new or changed components are marked dirty,
+            # as are the components of stages whose temperatures changed
+            model.set_stage_details(json_data.get("stage_details", {}))
+            new_components = json_data.get("components", {})
+            for stage, components_dict in new_components.items():
+                for component_name, details in components_dict.items():
+                    model.set_component(stage, component_name, details)
+
+        elif trigger == 'calculate-power':
+            model.calculate() # only the dirty components are recomputed
+        elif trigger == "new-process-button":
+            components, stage_details = optimize_tm(model.components, model.stage_details)
+            model.set_stage_details(stage_details)
+            for stage, comps in components.items():
+                for comp, details in comps.items():
+                    model.set_component(stage, comp, details)
+
+        # make_results()
+        return render_changes(model)
 
 @app.callback(
     Output("download-json", "data"),
     Input("save-json", "n_clicks"),
+    State("session-id", "data"),
     prevent_initial_call=True
 )
 # def save_to_json(n_clicks):
 #     return dict(content=json.dumps(components, indent=4), filename="components.json")
-def save_to_json(n_clicks):
+def save_to_json(n_clicks, session_id):
+    model = model_store.read(session_id)
     # Include stage details and total power in the JSON data
     output_data = {
-        "components": components,
-        "stage_details": stage_details,
-        "total_power": {stage: sum(details["Power Total (W)"] for details in comps.values()) for stage, comps in components.items()}
+        "components": model.components,
+        "stage_details": model.stage_details,
+        "total_power": model.total_powers()
     }
     return dict(content=json.dumps(output_data, indent=4), filename="components.json")
 
@@ -730,151 +742,140 @@ def toggle_fields(entry_type):
         return {"display": "block"}, {"display": "none"}, {"display": "none"}, {"display": "none"}, {"display": "none"}, {"display": "block"}, {"display": "none"}, {"display": "none"}, {"display": "none"}
     return {"display": "none"}, {"display": "none"}, {"display": "none"}, {"display": "none"}, {"display": "none"}, {"display": "none"}, {"display": "none"}, {"display": "none"}, {"display": "none"}
 
+def table_details(row):
+    """
+    Function: converts a row of an editable table back to the details of its component.
+
+    Returns: name, details
+    """
+    details = dict(row)
+    for key in NUMERIC_FIELDS:
+        if key in details:
+            details[key] = numeric_value(details[key])
+    return row["Name"], details
+
 @app.callback(
-    Output("table-container", "children", allow_duplicate=True),
-    Input({"type": "editable-table", "index": dash.ALL}, "data"),
+    [Output({"type": "stage-tables", "index": ALL}, "children", allow_duplicate=True),
+     Output("temperature-table", "data", allow_duplicate=True)],
+    Input({"type": "editable-table", "index": ALL, "entry": ALL}, "data"),
+    State("session-id", "data"),
     prevent_initial_call=True
 )
-def update_table_data(data):
-    global components
-
+def update_table_data(data, session_id):
     ctx = dash.callback_context
     if not ctx.triggered:
         raise dash.exceptions.PreventUpdate
 
-    # print("\n UPDATE TABLE DATA")
-    # for stage in components:
-    #     print(f"\n{stage}")
-    #     print(f"Components after addition: {components[stage].keys()}")
+    # Only the tables that were edited are read back, and only the rows that changed are marked dirty
+    edited = [json.loads(trigger["prop_id"].rsplit(".", 1)[0]) for trigger in ctx.triggered]
+    with model_store.session(session_id) as model:
+        for item in ctx.inputs_list[0]:
+            if item["id"] not in edited:
+                continue
+            # Merge with existing data to prevent overwriting other categories
+            for row in item["value"]:
+                name, details = table_details(row)
+                model.set_component(item["id"]["index"], name, details)
 
-    for item in ctx.inputs_list[0]:
-        stage = item["id"]["index"]
-        updated_data = pd.DataFrame(item["value"]).set_index("Name").to_dict(orient="index")
-        
-        # Debug print
-        # print(f"\nUpdated data for stage {stage}: {updated_data}")
+        return render_changes(model)
 
-        # Convert columns to appropriate data types
-        for comp, details in updated_data.items():
-            for key, value in details.items():
-                if key in ["OD", "ID", "length", "number", "Power per Part (W)", "Power Total (W)"]:
-                    try:
-                        updated_data[comp][key] = float(value)
-                    except ValueError:
-                        updated_data[comp][key] = 0.0
 
-        # Debug print
-        # print(f"\nUpdated data after type conversion for stage {stage}: {updated_data}")
 
-        # Merge with existing data to prevent overwriting other categories
-        if stage in components:
-            components[stage].update(updated_data)
-        else:
-            components[stage] = updated_data
 
-    # print("\n UPDATE TABLE DATA -- 2")
-    # for stage in components:
-    #     print(f"\n{stage}")
-    #     print(f"Components after addition: {components[stage]}")
+def generate_stage_tables(model, stage):
+    """
+    Function: draws the tables of the components of a stage, one per entry type.
 
-    return generate_table()
-
-
-
-
-def generate_table():
-    global components
+    Returns: list of the children of the stage division
+    """
+    comps = model.components.get(stage, {})
     tables = []
-    # print("\n GENERATE TABLE")
-    # for stage in components:
-    #     print(f"\n{stage}")
-    #     print(f"Components after addition: {components[stage]}")
-
-    for stage, comps in components.items():
-        if comps:
-            stage_total_power = sum(details["Power Total (W)"] for details in comps.values())
-            tables.append(html.H3(f"{stage} - High Temp: {stage_details[stage]['highT']:.2e} K, Low Temp: {stage_details[stage]['lowT']:.2e} K",
-                                  style={
-                                      "color": "#1e3799",
-                                      "fontSize": "24px",
-                                      "marginTop": "20px",
-                                      "fontWeight": "bold",
-                                      "textAlign": "center",
-                                      "backgroundColor": "#AEC6CF",
-                                      "padding": "8px",
-                                      "borderRadius": "5px"
-                                  }))
-            tables.append(html.H4(f"Total Power: {stage_total_power:.2e} W",
+    if not comps:
+        return tables
+
+    tables.append(html.H3(f"{stage} - High Temp: {model.stage_details[stage]['highT']:.2e} K, Low Temp: {model.stage_details[stage]['lowT']:.2e} K",
+                          style={
+                              "color": "#1e3799",
+                              "fontSize": "24px",
+                              "marginTop": "20px",
+                              "fontWeight": "bold",
+                              "textAlign": "center",
+                              "backgroundColor": "#AEC6CF",
+                              "padding": "8px",
+                              "borderRadius": "5px"
+                          }))
+    tables.append(html.H4(f"Total Power: {model.totals[stage]:.2e} W",
+                          style={"color": "#1e3799", "fontSize": "20px", "textAlign": "left"}))
+
+    entry_types = {'Component': [], 'Coax': [], 'A/L': [], 'Other': []}
+
+    for comp, details in comps.items():
+        entry_type = details.get("Type", "Component")
+        entry_types[entry_type].append({**details, "Name": comp})
+
+    for entry_type, items in entry_types.items():
+        if items:
+            # "Name" is the first column, then every other field of the components, in order
+            columns = ["Name"] + [col for col in dict.fromkeys(key for item in items for key in item) if col != "Name"]
+
+            total_power = sum(power_total(item) for item in items)
+            tables.append(html.H4(f"{entry_type} Components (Total Power: {total_power:.2e} W)",
                                   style={"color": "#1e3799", "fontSize": "20px", "textAlign": "left"}))
-
-            entry_types = {'Component': [], 'Coax': [], 'A/L': [], 'Other': []}
-
-            for comp, details in comps.items():
-                entry_type = details.get("Type", "Component")
-                entry_types[entry_type].append({"Name": comp, **details})
-
-            # print(entry_types)
-            for entry_type, items in entry_types.items():
-                if items:
-                    # Convert items to a DataFrame ensuring that index is reset and component names are included
-                    df = pd.DataFrame(items)
-
-                    # Ensure "Name" is the first column
-                    columns = ["Name"] + [col for col in df.columns if col != "Name"]
-
-                    total_power = df["Power Total (W)"].sum()
-                    tables.append(html.H4(f"{entry_type} Components (Total Power: {total_power:.2e} W)",
-                                          style={"color": "#1e3799", "fontSize": "20px", "textAlign": "left"}))
-                    tables.append(dash_table.DataTable(
-                        id={"type": "editable-table", "index": stage},
-                        columns=[{"name": col, "id": col, "editable": True} for col in columns],
-                        data=df.to_dict('records'),
-                        editable=True
-                    ))
-        
-    # print("\n GENERATE TABLE -- 2")
-    # for stage in components:
-    #     print(f"\n{stage}")
-    #     print(f"Components after addition: {components[stage]}")
-
+            tables.append(dash_table.DataTable(
+                id={"type": "editable-table", "index": stage, "entry": entry_type},
+                columns=[{"name": col, "id": col, "editable": True} for col in columns],
+                data=items,
+                editable=True
+            ))
     return tables
 
+def render_changes(model):
+    """
+    Function: redraws the tables of the stages of a model changed since the last render, and patches their rows
+    of the temperature table - the tables of the other stages are not sent again.
+
+    Returns: children of each stage division (no_update if unchanged), Patch of the temperature table data
+    (no_update if no stage changed)
+    """
+    changed = model.pop_changed()
+    if not changed:
+        return [dash.no_update for stage in stages], dash.no_update
+    temperature_patch = Patch()
+    for i, stage in enumerate(stages):
+        if stage in changed:
+            temperature_patch[i]["Temperature (K)"] = model.stage_details[stage]["lowT"]
+            temperature_patch[i]["Total Power (W)"] = f"{model.totals[stage]:.2e}"
+    return [generate_stage_tables(model, stage) if stage in changed else dash.no_update for stage in stages], temperature_patch
+
 
 @app.callback(
-    Output("table-container", "children", allow_duplicate=True),
+    [Output({"type": "stage-tables", "index": ALL}, "children", allow_duplicate=True),
+     Output("temperature-table", "data", allow_duplicate=True)],
     [Input("clear-cache", "n_clicks")],
+    State("session-id", "data"),
     prevent_initial_call=True
 )
-def clear_cache(n_clicks):
-    global components, stage_details
-
+def clear_cache(n_clicks, session_id):
     if n_clicks:
-        # Reset global state variables
-        components = {stage: {} for stage in stages}
-        stage_details = {stage: {"lowT": lowT, "highT": highT} for stage, (lowT, highT) in stage_details.items()}
+        # Reset the components of the session, keeping the stage temperatures
+        with model_store.session(session_id) as model:
+            model.clear()
 
-        # Return an empty table or a placeholder
-        return generate_table()  # This will re-render the table with empty data
+            # Only the stages that had components are redrawn (empty)
+            return render_changes(model)
 
     raise dash.exceptions.PreventUpdate
 
 
 @app.callback(
-    [Output('temperature-table', 'data'), Output('cooling-table', 'data')],
+    Output('cooling-table', 'data'),
     [Input('add', 'n_clicks'),
      Input("calculate-power", "n_clicks"),
      Input('clear-cache', 'n_clicks')],
     prevent_initial_call=True
 )
-def update_temperature_table(n_clicks_add, n_clicks_calc, n_clicks_clear):
-    # Re-generate the temperature data based on the current state of stage_details
-    updated_temperature_data = [
-        {"Stage": stage, 
-        "Temperature (K)": stage_details[stage]["lowT"],
-        "Total Power (W)": f"{sum(components[stage][comp]['Power Total (W)'] for comp in components[stage]):.2e}"
-        }
-        for stage in stage_details
-    ]
+def update_cooling_table(n_clicks_add, n_clicks_calc, n_clicks_clear):
+    # The temperature table is patched by the callbacks changing the model, see render_changes
 
     # output_data = {
     #     "components": components,
@@ -890,9 +891,7 @@ def update_temperature_table(n_clicks_add, n_clicks_calc, n_clicks_clear):
         }
     ]
 
-    print(updated_cooling_data)
-
-    return updated_temperature_data, updated_cooling_data
+    return updated_cooling_data
 
 
 if __name__ == "__main__":
@@ -0,0 +1,90 @@
+## Server-side storage of the thermal model of each session of dashGUI
+## Author: Henry Nachman
+## Description: Keeps the ThermalModel of every browser session in a SQLite database on disk instead of in
+## module globals, so every worker process and thread of the app sees the same state and concurrent users
+## do not overwrite each other. A session's model is read, changed and written back within one write
+## transaction, which SQLite serializes across threads and processes.
+
+import sqlite3
+import os, pickle, time, threading
+from contextlib import contextmanager
+
+abspath = os.path.abspath(__file__)
+store_path = f"{os.path.dirname(abspath)}{os.sep}.sessions{os.sep}sessions.sqlite"
+
+BUSY_TIMEOUT = 30 # seconds a transaction waits for the lock held by another one
+SESSION_MAX_AGE = 7*24*3600 # seconds, sessions unused for longer are deleted by expire
+EXPIRE_INTERVAL = 3600 # seconds between two expiries by the same process
+
+
+class ModelStore:
+    """
+    Description : SQLite store of the model of each session, safe to use from several threads and processes.
+
+    Each thread has its own connection. Changes go through session(), which takes the write lock of the
+    database (BEGIN IMMEDIATE) before reading the model, so the read-change-write of one callback is never
+    interleaved with another's.
+
+    Arguments :
+    - new_model - function returning the model of a new session
+    - path      - default=store_path - the database file, created if needed
+    """
+    def __init__(self, new_model, path=store_path):
+        self.new_model = new_model
+        self.path = path
+        self.local = threading.local()
+        self.expired = 0.0 # time of the last expiry
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with self.transaction() as connection:
+            connection.execute("CREATE TABLE IF NOT EXISTS sessions (id TEXT PRIMARY KEY, model BLOB, updated REAL)")
+
+    def connection(self):
+        if not hasattr(self.local, "connection"):
+            # autocommit mode, transactions are opened explicitly
+            self.local.connection = sqlite3.connect(self.path, timeout=BUSY_TIMEOUT, isolation_level=None)
+            self.local.connection.execute("PRAGMA journal_mode=WAL") # readers do not wait for the writer
+            self.local.connection.execute("PRAGMA synchronous=NORMAL") # no fsync per commit, safe with WAL
+        return self.local.connection
+
+    @contextmanager
+    def transaction(self):
+        connection = self.connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            yield connection
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        connection.execute("COMMIT")
+
+    def read(self, session_id):
+        """
+        Returns: the model of a session (a new model if the session has none), without locking it
+        """
+        row = self.connection().execute("SELECT model FROM sessions WHERE id = ?", (session_id,)).fetchone()
+        return pickle.loads(row[0]) if row else self.new_model()
+
+    @contextmanager
+    def session(self, session_id):
+        """
+        Function: locks the model of a session for changes, and writes it back once the block exits without error.
+
+        Usage : with store.session(session_id) as model: ...
+        """
+        with self.transaction() as connection:
+            row = connection.execute("SELECT model FROM sessions WHERE id = ?", (session_id,)).fetchone()
+            model = pickle.loads(row[0]) if row else self.new_model()
+            yield model
+            connection.execute("INSERT OR REPLACE INTO sessions (id, model, updated) VALUES (?, ?, ?)",
+                               (session_id, pickle.dumps(model, pickle.HIGHEST_PROTOCOL), time.time()))
+
+    def expire(self, max_age=SESSION_MAX_AGE, interval=EXPIRE_INTERVAL):
+        """
+        Function: deletes the sessions not changed for max_age seconds, at most once per interval seconds
+        (it takes the write lock).
+        """
+        if time.time() - self.expired < interval:
+            return
+        self.expired = time.time()
+        with self.transaction() as connection:
+            connection.execute("DELETE FROM sessions WHERE updated < ?", (time.time()-max_age,))
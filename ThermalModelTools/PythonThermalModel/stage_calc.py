@@ -33,25 +33,241 @@ def calculate_power_function(details, stage_temps, A_L = False):
 
     return ppu
 
+def tube_A_L(OD, ID, length):
+    area = np.pi*(0.5*(float(OD)))**2 - np.pi*(0.5*(float(ID)))**2
+    return area/float(length)
+
+def is_conductive(details):
+    """
+    Returns: True if the power per part of a component is conducted through its parts (a coax, an A/L entry
+    or anything with an OD), False if it is a fixed power per part
+    """
+    return details.get("Type") in ("Coax", "A/L") or "OD" in details
+
+def conduction_terms(details):
+    """
+    Function: lists the conductive parts of a component as (A/L, material) pairs -
+    one for a tube or an A/L entry, three (case, insulator, core) for a coax.
+
+    Returns: list of (A_L_val, material), or None if the component has a fixed power per part
+    """
+    if not is_conductive(details):
+        return None
+    if details.get("Type") == "Coax":
+        return [(tube_A_L(details["OD"], details["OD_I"], details["length"]), details["mat_C"]),
+                (tube_A_L(details["OD_I"], details["OD_c"], details["length"]), details["mat_I"]),
+                (tube_A_L(details["OD_c"], 0, details["length"]), details["material"])]
+    elif details.get("Type") == "A/L":
+        return [(float(details["A/L"]), details["material"])]
+    return [(tube_A_L(details["OD"], details["ID"], details["length"]), details["material"])]
+
+def powers_per_part(entries, stage_details):
+    """
+    Function: computes the conductive power per part of components, with every conductivity integral they
+    need in one batch (duplicates once, grouped by material).
+
+    Arguments:
+    - entries: iterable of (stage, comp, details)
+    - stage_details: dictionary of the lowT and highT of each stage
+
+    Returns: dictionary of the power per part of each (stage, comp) with conductive parts
+    """
+    terms, materials, lowTs, highTs = [], [], [], []
+    for stage, comp, details in entries:
+        comp_terms = conduction_terms(details)
+        if comp_terms is None:
+            continue
+        for A_L_val, mat in comp_terms:
+            terms.append((stage, comp, A_L_val))
+            materials.append(mat)
+            lowTs.append(stage_details[stage]["lowT"])
+            highTs.append(stage_details[stage]["highT"])
+    ConInts = get_conductivity_integrals(lowTs, highTs, materials, verbose=False) if terms else []
+
+    power_per_part = dict()
+    for (stage, comp, A_L_val), ConIntQuad in zip(terms, ConInts):
+        power_per_part[(stage, comp)] = power_per_part.get((stage, comp), 0) + A_L_val*ConIntQuad
+    return power_per_part
+
 def get_all_powers(components, stage_details):
+    # Gather every conductivity integral the model needs, so they are computed in one batch
+    # and then scattered back to the components
+    power_per_part = powers_per_part(((stage, comp, details) for stage, comps in components.items()
+                                      for comp, details in comps.items()), stage_details)
+
     for stage, comps in components.items(): 
         for comp, details in comps.items():
             num = float(details["number"])
-            if details.get("Type") == "Coax":
-                power_per_part = calculate_coax_power(details, stage_details[stage])
-                details["Power per Part (W)"] = power_per_part
-            elif details.get("Type") == "A/L":
-                power_per_part = calculate_power_function(details, stage_details[stage], A_L=True)
-                details["Power per Part (W)"] = power_per_part
-            elif "OD" in details:
-                power_per_part = calculate_power_function(details, stage_details[stage])
-                details["Power per Part (W)"] = power_per_part
-            else:
-                power_per_part = float(details["Power per Part (W)"])
-            details["Power Total (W)"] = power_per_part * num
+            if (stage, comp) in power_per_part:
+                details["Power per Part (W)"] = power_per_part[(stage, comp)]
+            power_per_part_val = float(details["Power per Part (W)"])
+            details["Power Total (W)"] = power_per_part_val * num
     
     return components
 
+NUMERIC_FIELDS = ("OD", "ID", "OD_I", "OD_c", "A/L", "length", "number", "Power per Part (W)", "Power Total (W)")
+LABEL_FIELDS = ("Name", "Power Total (W)") # shown in the tables but not part of a component's inputs
+
+def numeric_value(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return 0.0
+
+def comparable_details(details):
+    """
+    Returns: the inputs of a component with its numbers as floats, without the table labels and empty
+    fields - details loaded from a file and the table row drawn from them compare equal unless edited
+    """
+    return {key: numeric_value(value) if key in NUMERIC_FIELDS else value
+            for key, value in details.items() if key not in LABEL_FIELDS and value is not None}
+
+CONDUCTION_FIELDS = ("Type", "material", "mat_C", "mat_I", "OD", "ID", "OD_I", "OD_c", "length", "A/L")
+
+def conduction_key(details, stage_temps):
+    """
+    Returns: key of everything the power per part of a component depends on - its type, materials,
+    geometry and stage temperatures - or None if it has a fixed power per part
+    """
+    if not is_conductive(details):
+        return None
+    return (tuple(repr(details.get(field)) for field in CONDUCTION_FIELDS),
+            float(stage_temps["lowT"]), float(stage_temps["highT"]))
+
+
+class ThermalModel:
+    """
+    Description : The components and stage temperatures of a thermal model, with their powers kept up to
+    date incrementally.
+
+    Every component that is added or edited, or whose stage temperatures change, is marked dirty, and
+    calculate only recomputes the dirty components: the conductivity integrals are only evaluated for those
+    whose materials, geometry or stage temperatures changed (a changed number only rescales the power per
+    part). The total power of each stage is updated by the change of each component rather than summed again,
+    and the stages whose components changed are collected until pop_changed, so only their tables are redrawn.
+
+    Arguments :
+    - components    - default=None - dictionary of the components (details by name) of each stage
+    - stage_details - default=None - dictionary of the lowT and highT of each stage
+    """
+    def __init__(self, components=None, stage_details=None):
+        self.components = dict()
+        self.stage_details = dict()
+        self.totals = dict()       # stage -> sum of the "Power Total (W)" of its components
+        self.dirty = set()         # (stage, comp) whose power must be recomputed
+        self.computed = dict()     # (stage, comp) -> (conduction_key, power per part) of the last calculation
+        self.changed = set()       # stages changed since the last pop_changed
+        self.set_stage_details(stage_details or dict())
+        for stage, comps in (components or dict()).items():
+            self.add_stage(stage)
+            for comp, details in comps.items():
+                self.set_component(stage, comp, details)
+
+    def add_stage(self, stage):
+        if stage not in self.components:
+            self.components[stage] = dict()
+            self.totals[stage] = 0.0
+
+    def set_stage_details(self, stage_details):
+        """
+        Function: sets the temperatures of stages, marking dirty the components of those whose temperatures changed.
+        """
+        for stage, temps in stage_details.items():
+            temps = {"lowT": float(temps["lowT"]), "highT": float(temps["highT"])}
+            if self.stage_details.get(stage) == temps:
+                continue
+            self.stage_details[stage] = temps
+            self.add_stage(stage)
+            self.dirty.update((stage, comp) for comp in self.components[stage])
+            self.changed.add(stage)
+
+    def set_component(self, stage, comp, details):
+        """
+        Function: adds or replaces a component, marking it dirty if its details changed.
+
+        Returns: True if the component changed
+        """
+        self.add_stage(stage)
+        old = self.components[stage].get(comp)
+        if old is not None and comparable_details(old) == comparable_details(details):
+            return False
+        self.components[stage][comp] = details
+        self.add_to_total(stage, power_total(old) if old is not None else 0.0, power_total(details))
+        self.dirty.add((stage, comp))
+        self.changed.add(stage)
+        return True
+
+    def remove_component(self, stage, comp):
+        details = self.components[stage].pop(comp)
+        self.add_to_total(stage, power_total(details), 0.0)
+        self.dirty.discard((stage, comp))
+        self.computed.pop((stage, comp), None)
+        self.changed.add(stage)
+
+    def clear(self):
+        for stage in self.components:
+            if self.components[stage]:
+                self.changed.add(stage)
+            self.components[stage] = dict()
+            self.totals[stage] = 0.0
+        self.dirty.clear()
+        self.computed.clear()
+
+    def calculate(self):
+        """
+        Function: recomputes the power per part and total power of the dirty components, evaluating the
+        conductivity integrals (in one batch) only for those whose conduction_key changed.
+
+        Returns: set of the stages whose components changed
+        """
+        keys, stale = dict(), []
+        for stage, comp in self.dirty:
+            details = self.components[stage][comp]
+            keys[(stage, comp)] = conduction_key(details, self.stage_details[stage])
+            cached = self.computed.get((stage, comp))
+            if keys[(stage, comp)] is not None and (cached is None or cached[0] != keys[(stage, comp)]):
+                stale.append((stage, comp, details))
+        power_per_part = powers_per_part(stale, self.stage_details)
+
+        for stage, comp in self.dirty:
+            details = self.components[stage][comp]
+            key = keys[(stage, comp)]
+            if key is not None:
+                ppp = power_per_part[(stage, comp)] if (stage, comp) in power_per_part else self.computed[(stage, comp)][1]
+                self.computed[(stage, comp)] = (key, ppp)
+                details["Power per Part (W)"] = ppp
+            old_total = power_total(details)
+            details["Power Total (W)"] = float(details["Power per Part (W)"]) * float(details["number"])
+            self.add_to_total(stage, old_total, details["Power Total (W)"])
+        changed = {stage for stage, comp in self.dirty}
+        self.changed.update(changed)
+        self.dirty.clear()
+        return changed
+
+    def pop_changed(self):
+        """
+        Returns: set of the stages changed since the last call, whose tables need to be redrawn
+        """
+        changed, self.changed = self.changed, set()
+        return changed
+
+    def add_to_total(self, stage, old_total, new_total):
+        # an infinite or nan power cannot be subtracted back out, so the stage is summed again instead
+        if np.isfinite(old_total) and np.isfinite(new_total) and np.isfinite(self.totals[stage]):
+            self.totals[stage] += new_total - old_total
+        else:
+            self.totals[stage] = float(np.sum([power_total(details) for details in self.components[stage].values()]))
+
+    def total_powers(self):
+        return dict(self.totals)
+
+
+def power_total(details):
+    try:
+        return float(details.get("Power Total (W)", 0))
+    except (TypeError, ValueError):
+        return 0.0
+
 
 def calculate_coax_power(details, stage_temp):
     # Implement the power calculation logic for Coax components here
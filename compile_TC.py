@@ -3,7 +3,7 @@
 ## which it then compiles and outputs - creating easy to use, human-readable, files
 ## containing the thermal conductivity fits for the entire library.
 
-import os, sys
+import os, sys, json, hashlib
 from datetime import datetime
 
 abspath = os.path.abspath(__file__)
@@ -12,77 +12,96 @@ sys.path.insert(0, f"{file_path}")
 
 from thermal_conductivity.fit_types import *
 from thermal_conductivity.tc_utils import *
+from thermal_conductivity.tc_registry import MaterialRegistry, file_hash
+from thermal_conductivity.tc_integrals import CumulativeTables
+
+# Files written for each output, formatted with the compilation date
+OUTPUT_FILES = {"tc_generic":      ["tc_generic_{}.csv", "tc_generic_{}.txt"],
+                "tc_fullrepo":     ["tc_fullrepo_{}.csv", "tc_fullrepo_{}.txt", "tc_catalog_{}.npy", "tc_catalog_{}.json", "tc_cumint_{}.npz"],
+                "tc_other_fits":   ["tc_other_fits_{}.csv", "tc_other_fits_{}.txt"],
+                "tc_rawdata_fits": ["tc_rawdata_fits_{}.csv", "tc_rawdata_fits_{}.txt"]}
+COMPILE_MANIFEST = "compile_manifest.json" # digest of the rows of each output at the last compilation
+COMPILE_CODE = ["thermal_conductivity/tc_utils.py", "thermal_conductivity/tc_registry.py",
+                "thermal_conductivity/tc_integrals.py", "thermal_conductivity/fit_types.py"] # code the outputs depend on
+
+
+def scan_library(path_to_lib):
+    """
+    Function: lists the library once.
+
+    Returns: dictionary of the subfolders (e.g. RAW, fits, OTHERFITS, NIST) of each material
+    """
+    library = dict()
+    for mat in os.listdir(path_to_lib):
+        if mat.endswith(".md"):
+            continue
+        mat_str = f"{path_to_lib}{os.sep}{mat}"
+        library[mat] = set(os.listdir(mat_str)) if os.path.isdir(mat_str) else set()
+    return library
+
+def make_pathtofit(path_to_lib, library, subset=None, fits_to_parse="ALL"):
+    """
+    Function: picks the fit folder of each material of the library.
+
+    Arguments:
+    - path_to_lib: str. Path of the material library
+    - library: dictionary from scan_library
+    - subset: (optional) list of the materials to include
+    - fits_to_parse: str. "ALL" (fits of the RAW data, then other fits, then NIST fits), "OTHER" (other fits, then NIST fits)
+                     or "RAW" (fits of the RAW data)
+
+    Returns: dictionary of the fit folder of each material, in library order
+    """
+    path_to_fit_dict = dict()
+    for mat, folders in library.items():
+        if subset != None and mat not in subset:
+            continue
+        mat_str = f"{path_to_lib}{os.sep}{mat}"
+        if fits_to_parse=="ALL":
+            order = ["fits", "OTHERFITS", "NIST"] # Prioritize RAW fits, then other fits, lastly NIST Fits
+        elif fits_to_parse=="OTHER":
+            order = ["OTHERFITS", "NIST"]
+        else:
+            order = ["fits"] if "RAW" in folders else []
+        for folder in order:
+            if folder in folders:
+                path_to_fit_dict[mat] = f"{mat_str}{os.sep}{folder}"
+                break
+    return path_to_fit_dict
+
+def rows_digest(rows, code_hash):
+    """
+    Returns: sha1 hex digest of the rows of an output (their membership, order and values) and of the code writing it
+    """
+    return hashlib.sha1((code_hash + json.dumps([dict(row) for row in rows])).encode()).hexdigest()
+
+def write_output(name, rows, date):
+    """
+    Function: writes the files of an output (see OUTPUT_FILES) for the given date.
+    """
+    csv_file, txt_file = [f"{file_path}{os.sep}{file.format(date)}" for file in OUTPUT_FILES[name][:2]]
+    create_data_table(rows, txt_file)
+    create_tc_csv(rows, csv_file)
+    if name == "tc_fullrepo":
+        fullrepo_registry = MaterialRegistry.from_csv(csv_file)
+        # Memory-mappable binary catalog (tc_catalog_<date>.npy + .json index), used by tc_tools
+        fullrepo_registry.save_binary(f"{file_path}{os.sep}tc_catalog_{date}.npy", source_hash=file_hash(csv_file))
+        # Cumulative integral tables of the full repo, used by tc_tools.get_conductivity_integral
+        tables = CumulativeTables.build(fullrepo_registry, source_hash=file_hash(csv_file))
+        tables.save(f"{file_path}{os.sep}tc_cumint_{date}.npz")
 
 def main():
 
     path_to_lib = f"{file_path}{os.sep}thermal_conductivity{os.sep}lib"
-    mat_directories = [folder for folder in os.listdir(path_to_lib) if not folder.endswith(".md")]
-
-    everything_bagel = dict()
-    simple_bagel = dict()
-    path_to_otherfits = dict()
-    path_to_rawData = dict()
-
-    def make_pathtofit(mat_direct, subset=None, fits_to_parse="ALL"):
-        path_to_fit_dict = dict()
-        if subset!=None:
-            subset_array = []
-            for mat in mat_direct:
-                if mat in subset:
-                    subset_array = np.append(subset_array, mat)
-            mat_direct = subset_array
-        for mat in mat_direct:
-            mat_str = f"{path_to_lib}{os.sep}{mat}"
-            fit_str = f"{mat_str}{os.sep}fits"
-            other_str = f"{mat_str}{os.sep}OTHERFITS"
-            nist_str = f"{mat_str}{os.sep}NIST"
-            raw_str = f"{mat_str}{os.sep}RAW"
-            
-            if fits_to_parse=="ALL":
-                if os.path.exists(fit_str): # Prioritize RAW fits
-                    path_to_fit_dict[mat] = fit_str
-                    path_to_rawData[mat] = fit_str
-                elif os.path.exists(other_str): # Then other fits
-                    path_to_fit_dict[mat] = other_str
-                elif os.path.exists(nist_str): # Lastly NIST Fits
-                    path_to_fit_dict[mat] = nist_str
-
-            if fits_to_parse=="OTHER":
-                if os.path.exists(other_str): # Then other fits
-                    path_to_fit_dict[mat] = other_str
-                elif os.path.exists(nist_str): # Lastly NIST Fits
-                    path_to_fit_dict[mat] = nist_str
-
-            if fits_to_parse=="RAW":
-                if os.path.exists(raw_str): # Prioritize RAW fits
-                    path_to_fit_dict[mat] = fit_str
-        
-        return path_to_fit_dict
-
-    # # This code block deletes the old files
-    try:
-        all_files = os.listdir(f"{file_path}")
-        exist_files = [file for file in all_files if file.startswith("tc_fullrepo")]
-        old_date = exist_files[0][-12:-4]
-        old_csvs = [file for file in all_files if file.endswith(f"{old_date}.csv")]
-        old_txts = [file for file in all_files if file.endswith(f"{old_date}.txt")]
-
-        old_files = np.hstack((old_csvs, old_txts))
-        # print(old_files)
-        for file in old_files:
-            os.remove(f"{file_path}{os.sep}{file}")
-        print(f"Removing files from date: {old_date}")
-        os.chdir(f"{os.getcwd()}{os.sep}thermal_conductivity")
-    except IndexError:
-        pass
-
-    # This code block finds all the files with data.
+    library = scan_library(path_to_lib) # the only listing of the library
+    fit_rows = dict() # fits read so far, shared by every output so that each fit file is read once
 
     current_date = datetime.now().date()
-    print(f"Replacing with files from date: {current_date}")
+    print(f"Compiling files for date: {current_date}")
     current_date = current_date.strftime('%Y%m%d')
 
     # Want to create 4 output files
+    outputs = dict()
     # 1. Plain Bagel : Simple file that has only 1 fit per material and ignores weird materials
     simple_mat_direct = ["Aluminum_1100", "Beryllium_Copper","CFRP","Cu_OFHC_RRR50",
                         "G10_FR4","Glass_FabricPolyester_He_warp","Graphite","Inconel_718","Invar_Fe36Ni",
@@ -91,11 +110,11 @@ def main():
                         "Phosbronze","Platinum","Polystyrene_2.0_lbft3","Polyurethane_2.0_lbft3_CO2",
                         "PVC_1.25_lbft3_air","Stainless_Steel","Teflon","Ti6Al4V","Titanium_15333",
                         "Torlon","Tungsten","VESPEL"]
-    simple_bagel = make_pathtofit(mat_directories, subset=simple_mat_direct)
-    output_array = compile_csv(simple_bagel)
+    simple_bagel = make_pathtofit(path_to_lib, library, subset=simple_mat_direct)
+    output_array = compile_csv(simple_bagel, fit_rows)
     bad_fit_mats = ["Brass", "Constantan","Cu_OFHC","Stainless_Steel_310","Stainless_Steel_316"]
-    bad_simple_bagel = make_pathtofit(mat_directories, subset=bad_fit_mats)
-    bad_fit_output_array = compile_csv(bad_simple_bagel)
+    bad_simple_bagel = make_pathtofit(path_to_lib, library, subset=bad_fit_mats)
+    bad_fit_output_array = compile_csv(bad_simple_bagel, fit_rows)
 
     # Add a flag for bad materials
     filler_arr = {}
@@ -108,30 +127,53 @@ def main():
     output_array = np.append(output_array, [filler_arr2])
     output_array = np.append(output_array, [filler_arr])
     output_array = np.append(output_array, bad_fit_output_array)
-    
-    #
-    create_data_table(output_array, f"{file_path}{os.sep}tc_generic_{current_date}.txt")
-    create_tc_csv(output_array, f"{file_path}{os.sep}tc_generic_{current_date}.csv")
-
+    outputs["tc_generic"] = output_array
 
     # 2. Everything Bagel : File that contains every single material and alloy
-    everything_bagel = make_pathtofit(mat_directories, fits_to_parse="ALL")
-    output_array = compile_csv(everything_bagel)
-    create_data_table(output_array, f"{file_path}{os.sep}tc_fullrepo_{current_date}.txt")
-    create_tc_csv(output_array, f"{file_path}{os.sep}tc_fullrepo_{current_date}.csv")
+    everything_bagel = make_pathtofit(path_to_lib, library, fits_to_parse="ALL")
+    outputs["tc_fullrepo"] = compile_csv(everything_bagel, fit_rows)
 
     # 3. Other fits + NIST
-    other_fits = make_pathtofit(mat_directories, fits_to_parse="OTHER")
-    output_array = compile_csv(other_fits)
-    create_data_table(output_array, f"{file_path}{os.sep}tc_other_fits_{current_date}.txt")
-    create_tc_csv(output_array, f"{file_path}{os.sep}tc_other_fits_{current_date}.csv")
+    other_fits = make_pathtofit(path_to_lib, library, fits_to_parse="OTHER")
+    outputs["tc_other_fits"] = compile_csv(other_fits, fit_rows)
 
     # 4. RAW / from data fits
-    raw_fits = make_pathtofit(mat_directories, fits_to_parse="RAW")
-    output_array = compile_csv(raw_fits)
-    create_data_table(output_array, f"{file_path}{os.sep}tc_rawdata_fits_{current_date}.txt")
-    create_tc_csv(output_array, f"{file_path}{os.sep}tc_rawdata_fits_{current_date}.csv")
+    raw_fits = make_pathtofit(path_to_lib, library, fits_to_parse="RAW")
+    outputs["tc_rawdata_fits"] = compile_csv(raw_fits, fit_rows)
+
+    # Outputs whose rows are unchanged since the last compilation are only renamed to the new date,
+    # the others are rewritten (and their old files removed)
+    all_files = os.listdir(f"{file_path}")
+    # the most recent compilation, as in tc_tools.find_catalog
+    exist_files = sorted([file for file in all_files if file.startswith("tc_fullrepo") and file.endswith(".csv")])
+    old_date = exist_files[-1][-12:-4] if exist_files else None
+    manifest_path = f"{file_path}{os.sep}{COMPILE_MANIFEST}"
+    try:
+        with open(manifest_path, "r") as file:
+            manifest = json.load(file)
+    except (OSError, ValueError):
+        manifest = dict()
+    code_hash = "".join(file_hash(f"{file_path}{os.sep}{file}") for file in COMPILE_CODE)
+
+    for name, rows in outputs.items():
+        digest = rows_digest(rows, code_hash)
+        old_files = [f"{file_path}{os.sep}{file.format(old_date)}" for file in OUTPUT_FILES[name]] if old_date else []
+        new_files = [f"{file_path}{os.sep}{file.format(current_date)}" for file in OUTPUT_FILES[name]]
+        if old_files and manifest.get(name) == digest and all(os.path.exists(file) for file in old_files):
+            for old_file, new_file in zip(old_files, new_files):
+                os.replace(old_file, new_file)
+            print(f"{name} : unchanged")
+        else:
+            for old_file in old_files:
+                if os.path.exists(old_file):
+                    os.remove(old_file)
+            write_output(name, rows, current_date)
+            print(f"{name} : written")
+        manifest[name] = digest
+
+    with open(manifest_path, "w") as file:
+        json.dump(manifest, file, indent=4)
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -3,633 +3,154 @@
 ## Authors: Oorie Desai, Henry Nachman
 ## Last Edited: 21 June 2024
 
-import requests
 from bs4 import BeautifulSoup
 import numpy as np
+import argparse
 
 from tc_utils import *
-
-def main():
-    ## Scraping functions
-
-    ############################################################
-    ## Function 1
-    ############################################################
-
-    def func1(x):
-        response = requests.get(x)
-        soup = BeautifulSoup(response.content,'html.parser')
-        results = soup.find(id = 'content') 
-        s = results.find('h1')
-        tds = []
-        b = []
-        c = []
-        d = []
-        e = []
-        fourth = []
-        g = []
-        y = []
-        x = []
-        divs = soup.findAll('table', {'class':'properties'})
-        for div in divs:
-            rows = div.findAll('tr')
-            for row in rows:
-                tds.append(row.text)
-
-        for i in tds:
-            w = i.find('curve fit')
-            if tds.index(i)<16:
-                if w!=-1:
-                    r = tds.index(i)
-                    x.append(r)
-                else:
-                    pass
-
-        for i in range(1,14):
-                a = str.split(tds[i], sep='\n')
-                b.append(a[1])
-                c.append(a[2])
-                d.append(a[3])
-                if len(a)>4:
-                    e.append(a[4])
-                if len(a)>5:
-                    fourth.append(a[5])
-
-        tuples = [(key, value) for i, (key, value) in enumerate(zip(b, c))]
-        res = dict(tuples)
-        key = list(res.keys())
-        val = list(res.values())
-        t = key.index('data range')
-        keys1 = []
-        vals1 = []
-        for i in range(1,t):
-                keys1.append(key[i])
-                vals1.append(float(val[i]))
-
-        keys2 = []
-        vals2 = []
-        for i in range(t,t+2):
-                keys2.append(key[i])
-                f = str.split(val[i], sep='-')
-                h = (float(f[0]),float(f[1]))
-                vals2.append(h)
-
-        keys3 = []
-        vals3 = []
-        for i in range(t+2,len(res)):
-                keys3.append(key[i])
-                vals3.append(float(val[i]))
-
-        return [str.split(s.text, ":")[1][1:]], vals1, vals2[0], vals3
-
-
-    ############################################################
-    # Function 2
-    ############################################################
-
-    def func2(x):
-        response = requests.get(x)
-        soup = BeautifulSoup(response.content,'html.parser')
-        results = soup.find(id = 'content') 
-        s = results.find('h1')
-        tds = []
-        b = []
-        c = []
-        d = []
-        e = []
-        fourth = []
-        g = []
-        y = []
-        x = []
-        divs = soup.findAll('table', {'class':'properties'})
-        for div in divs:
-            rows = div.findAll('tr')
-            for row in rows:
-                tds.append(row.text)
-
-        for i in tds:
-            w = i.find('curve fit')
-            if tds.index(i)<16:
-                if w!=-1:
-                    r = tds.index(i)
-                    x.append(r)
-                else:
-                    pass
-
-        for i in range(1,11):
-                a = str.split(tds[i], sep='\n')
-                b.append(a[1])
-                c.append(a[2])
-                d.append(a[3])
-                if len(a)>4:
-                    e.append(a[4])
-                if len(a)>5:
-                    fourth.append(a[5])
-
-        tuples = [(key, value) for i, (key, value) in enumerate(zip(b, c))]
-        res = dict(tuples)
-        key = list(res.keys())
-        val = list(res.values())
-        t = key.index('data range')
-        keys1 = []
-        vals1 = []
-        for i in range(1,t):
-                keys1.append(key[i])
-                vals1.append(float(val[i]))
-
-        keys2 = []
-        vals2 = []
-        for i in range(t,t+2):
-                keys2.append(key[i])
-                f = str.split(val[i], sep='-')
-                h = (float(f[0]),float(f[1]))
-                vals2.append(h)
-
-        keys3 = []
-        vals3 = []
-        for i in range(t+2,len(res)):
-                keys3.append(key[i])
-                vals3.append(val[i])
-
-        return [str.split(s.text, ":")[1][1:]], vals1, vals2[0], d[9]
-
-
-
-    ############################################################
-    # Function 3
-    ############################################################
-
-    def func3(x):
-        response = requests.get(x)
-        soup = BeautifulSoup(response.content,'html.parser')
-        results = soup.find(id = 'content') 
-        s = results.find('h1')
-        tds = []
-        b = []
-        c = []
-        d = []
-        e = []
-        fourth = []
-        g = []
-        y = []
-        x = []
-        n = []
-        p3 = []
-        r3 = []
-        e3 = []
-        divs = soup.findAll('table', {'class':'properties'})
-        for div in divs:
-            rows = div.findAll('tr')
-            for row in rows:
-                tds.append(row.text)
-
-        for i in tds:
-            w = i.find('curve fit')
-            if tds.index(i)<16:
-                if w!=-1:
-                    r = tds.index(i)
-                    x.append(r)
-                else:
-                    pass
-
-        for i in range(1,14):
-                a = str.split(tds[i], sep='\n')
-                b.append(a[1])
-                c.append(a[2])
-                d.append(a[3])
-                if len(a)>4:
-                    e.append(a[4])
-                if len(a)>5:
-                    fourth.append(a[5])
-
-        n.append(str.split(s.text, ":" )[1][1:])
-        tuples = [(key, value) for i, (key, value) in enumerate(zip(b, c))]
-        res = dict(tuples)
-        key = list(res.keys())
-        val = list(res.values())
-        t = key.index('data range')
-        keys1 = []
-        vals11 = []
-        for i in range(1,t):
-                keys1.append(key[i])
-                vals11.append(float(val[i]))
-
-        keys2 = []
-        vals21 = []
-        for i in range(t,t+2):
-                keys2.append(key[i])
-                f = str.split(val[i], sep='-')
-                h = (float(f[0]),float(f[1]))
-                vals21.append(h)
-
-        keys3 = []
-        vals31 = []
-        for i in range(t+2,len(res)):
-                keys3.append(key[i])
-                vals31.append(float(val[i]))
-
-        p3.append(vals11)
-        r3.append(vals21[0])
-        e3.append(vals31)
-
-        #second column of thermal conductivity
-        n.append(str.split(s.text, ":" )[1][1:])
-        tuples = [(key, value) for i, (key, value) in enumerate(zip(b, d))]
-        res = dict(tuples)
-        key = list(res.keys())
-        val = list(res.values())
-        t = key.index('data range')
-        keys1 = []
-        vals12 = []
-        for i in range(1,t):
-                keys1.append(key[i])
-                vals12.append(float(val[i]))
-
-        keys2 = []
-        vals22 = []
-        for i in range(t,t+2):
-                keys2.append(key[i])
-                f = str.split(val[i], sep='-')
-                h = (float(f[0]),float(f[1]))
-                vals22.append(h)
-
-        keys3 = []
-        vals32 = []
-        for i in range(t+2,len(res)):
-                keys3.append(key[i])
-                vals32.append(float(val[i]))
-
-        p3.append(vals12)
-        r3.append(vals22[0])
-        e3.append(vals32)
-
-        #third column(if exits)
-        if e[0]!='':
-            n.append(str.split(s.text, ":" )[1][1:])
-            tuples = [(key, value) for i, (key, value) in enumerate(zip(b, e))]
-            res = dict(tuples)
-            key = list(res.keys())
-            val = list(res.values())
-            t = key.index('data range')
-            keys1 = []
-            vals13 = []
-            for i in range(1,t):
-                    keys1.append(key[i])
-                    vals13.append(float(val[i]))
-
-            keys2 = []
-            vals23 = []
-            for i in range(t,t+2):
-                    keys2.append(key[i])
-                    f = str.split(val[i], sep='-')
-                    h = (float(f[0]),float(f[1]))
-                    vals23.append(h)
-
-            keys3 = []
-            vals33 = []
-            for i in range(t+2,len(res)):
-                    keys3.append(key[i])
-                    vals33.append(float(val[i]))
-
-            p3.append(vals13)
-            r3.append(vals23[0])
-            e3.append(vals33)
-
-        #4th column, if it exists
-        if fourth[0]!='':
-            n.append(str.split(s.text, ":" )[1][1:])
-            tuples = [(key, value) for i, (key, value) in enumerate(zip(b, fourth))]
-            res = dict(tuples)
-            key = list(res.keys())
-            val = list(res.values())
-            t = key.index('data range')
-            keys1 = []
-            vals14 = []
-            for i in range(1,t):
-                    keys1.append(key[i])
-                    vals14.append(float(val[i]))
-
-            keys2 = []
-            vals24 = []
-            for i in range(t,t+2):
-                    keys2.append(key[i])
-                    f = str.split(val[i], sep='-')
-                    h = (float(f[0]),float(f[1]))
-                    vals24.append(h)
-
-            keys3 = []
-            vals34 = []
-            for i in range(t+2,len(res)):
-                    keys3.append(key[i])
-                    vals34.append(float(val[i]))
-
-            p3.append(vals14)
-            r3.append(vals24[0])
-            e3.append(vals34)
-        return n, p3, r3, e3
+from nist_fetch import fetch_pages
+
+# Faster HTML backend where available
+try:
+    import lxml.html
+except ImportError:
+    lxml = None
+
+
+############################################################
+# Defining the material names and urls
+############################################################
+
+name_arr = ['Aluminum 1100', 'Aluminum 3003-F', 'Aluminum 5083-O', 'Aluminum 6061-T6', 'Aluminum 6063-T5', 'Balsa',
+        'Beechwood phenolic', 'Beryllium Copper', 'Brass', 'Copper (OFHC)', 'Fiberglass Epoxy G-10', 
+        'Glass Fabric/Polyester', 'Inconel 718', 'Invar (Fe-36Ni)', 'Kevlar-49 Fiber (Aramid)', 
+        'Kevlar-49 Composite (Aramid)', 'Lead', 'Molybdenum', 'Nickel Steel Fe 2.25 Ni', 'Nickel Steel Fe 3.25 Ni', 
+        'Nickel Steel Fe 5.0 Ni', 'Nickel Steel Fe 9.0 Ni', 'Platinum', 'Nylon', 'Mylar/PET', 'Kapton', 
+        'Polystyrene', 'Polyurethane', 'PVC', 'Stainless Steel 304', 'Stainless Steel 304L', 'Stainless Steel 310',
+        'Stainless Steel 316', 'Teflon', 'Ti-6Al-4V', 'Titanium 15-3-3-3']
+
+Urls = ['https://trc.nist.gov/cryogenics/materials/1100%20Aluminum/1100%20Aluminum_rev.htm',
+        'https://trc.nist.gov/cryogenics/materials/3003F%20Aluminum/3003FAluminum_rev.htm', 
+        'https://trc.nist.gov/cryogenics/materials/5083%20Aluminum/5083Aluminum_rev.htm',
+        'https://trc.nist.gov/cryogenics/materials/6061%20Aluminum/6061_T6Aluminum_rev.htm',
+        'https://trc.nist.gov/cryogenics/materials/6063_T5%20Alulminum/6063-T5Aluminum_rev.htm',
+        'https://trc.nist.gov/cryogenics/materials/Balsa/Balsa_rev.htm',
+        'https://trc.nist.gov/cryogenics/materials/Beechwood_Phenolic/beechwood_rev.htm',
+        'https://trc.nist.gov/cryogenics/materials/Beryllium%20Copper/BerylliumCopper_rev.htm', 
+        'https://trc.nist.gov/cryogenics/materials/Brass/Brass_rev.htm',
+        'https://trc.nist.gov/cryogenics/materials/OFHC%20Copper/OFHC_Copper_rev1.htm',
+        'https://trc.nist.gov/cryogenics/materials/G-10%20CR%20Fiberglass%20Epoxy/G10CRFiberglassEpoxy_rev.htm', 
+        'https://trc.nist.gov/cryogenics/materials/Glass%20Fabric%20-%20Polyester/GlassFabric_Polyester_rev.htm',
+        'https://trc.nist.gov/cryogenics/materials/Iconel%20718/Inconel718_rev.htm',
+        'https://trc.nist.gov/cryogenics/materials/Invar(Fe-36Ni)/Invar_rev.htm',
+        'https://trc.nist.gov/cryogenics/materials/Kevlar49/kevlarfiber.htm',
+        'https://trc.nist.gov/cryogenics/materials/Kevlar49/kevlarcomposite.htm',
+        'https://trc.nist.gov/cryogenics/materials/Lead/Lead_rev.htm',
+        'https://trc.nist.gov/cryogenics/materials/Molybdenum/Molybdenum_rev.htm',
+        'https://trc.nist.gov/cryogenics/materials/NickelSteel/NickelSteel_Fe2.25Ni)_rev.htm',
+        'https://trc.nist.gov/cryogenics/materials/NickelSteel/NickelSteel_Fe3.25Ni)_rev.htm',
+        'https://trc.nist.gov/cryogenics/materials/NickelSteel/NickelSteel_Fe5.0Ni)_rev.htm',
+        'https://trc.nist.gov/cryogenics/materials/NickelSteel/NickelSteel_Fe9.0Ni)_rev.htm',
+        'https://trc.nist.gov/cryogenics/materials/Platinum/Platinum_rev.htm', 
+        'https://trc.nist.gov/cryogenics/materials/Polyamide%20(Nylon)/PolyamideNylon_rev.htm',
+        'https://trc.nist.gov/cryogenics/materials/PET/PET_rev.htm',
+        'https://trc.nist.gov/cryogenics/materials/Polyimide%20Kapton/PolyimideKapton_rev.htm',
+        'https://trc.nist.gov/cryogenics/materials/Polystyrene/polystyrenerev.html',
+        'https://trc.nist.gov/cryogenics/materials/Polyurethane/polyurethanerev.html',
+        'https://trc.nist.gov/cryogenics/materials/PVC/PVCrev.htm',
+        'https://trc.nist.gov/cryogenics/materials/304Stainless/304Stainless_rev.htm',
+        'https://trc.nist.gov/cryogenics/materials/304LStainless/304LStainless_rev.htm',
+        'https://trc.nist.gov/cryogenics/materials/310%20Stainless/310Stainless_rev.htm',
+        'https://trc.nist.gov/cryogenics/materials/316Stainless/316Stainless_rev.htm',
+        'https://trc.nist.gov/cryogenics/materials/Teflon/Teflon_rev.htm',
+        'https://trc.nist.gov/cryogenics/materials/Ti6Al4V/Ti6Al4V_rev.htm',
+        'https://trc.nist.gov/cryogenics/materials/Titanium/Titanium.htm']
+# Types: Determines the function to use to scrape from the NIST website
+Types = [1,1,1,1,1,4,4,1,1,5,4,3,1,1,2,2,1,1,1,1,1,1,1,1,1,1,3,3,4,1,1,1,1,1,1,1] 
+# eq_types: Determines the fit equation type that will be included in the output file
+eq_types = [1,1,1,1,1,1,1,1,1,2,1,1,1,1,3,3,1,1,1,1,1,1,1,1,1,1,1,1,1,1,1,1,1,1,1,1]
+
+# Layout of the properties table of each page type (Types above):
+# - rows    : number of rows read after the table header
+# - columns : most fit columns read - past the first two, a column is read only if its first cell is not empty
+# - range   : label of the "low-high" data range row (followed by the equation range and the error rows),
+#             or the positions of the low and high rows (values with a unit, e.g. "4K"), followed by the error row
+# - error   : (optional) position and column of a single error cell, kept as text
+NIST_LAYOUTS = {1: {"rows": 13, "columns": 1, "range": "data range"},
+                2: {"rows": 10, "columns": 1, "range": "data range", "error": (9, 1)},
+                3: {"rows": 13, "columns": 4, "range": "data range"},
+                4: {"rows": 13, "columns": 2, "range": "data range"},
+                5: {"rows": 13, "columns": 5, "range": (10, 11)}}
+
+def page_rows(content):
+    """
+    Function: parses a NIST page once, with lxml if it is installed.
+
+    Returns: title, rows - the h1 of the page content and the text of every row of its properties tables
+    """
+    if lxml is not None:
+        tree = lxml.html.fromstring(content)
+        title = tree.xpath('//*[@id="content"]//h1')[0].text_content()
+        tables = tree.xpath('//table[contains(concat(" ", normalize-space(@class), " "), " properties ")]')
+        return title, [row.text_content() for table in tables for row in table.iter("tr")]
+    soup = BeautifulSoup(content, 'html.parser')
+    title = soup.find(id='content').find('h1').text
+    return title, [row.text for table in soup.find_all('table', {'class':'properties'}) for row in table.find_all('tr')]
+
+def parse_nist_page(content, page_type):
+    """
+    Function: reads the thermal conductivity fits of a NIST page, whatever its column layout (see NIST_LAYOUTS).
+
+    Arguments:
+    - content: str or bytes. The page
+    - page_type: int. Key of NIST_LAYOUTS
+
+    Returns: list of (name, parameters, fit_range, perc_err) of each fit column, parameters in page order (a, b, c...)
+    """
+    layout = NIST_LAYOUTS[page_type]
+    title, rows = page_rows(content)
+    name = str.split(title, ":")[1][1:]
+
+    table = dict() # cells of each row by label, in page order
+    for row in rows[1:layout["rows"]+1]:
+        cells = str.split(row, sep='\n')
+        table[cells[1]] = cells[2:]
+    labels, cells = list(table), list(table.values())
+    def cell(position, column):
+        return cells[position][column] if column < len(cells[position]) else ''
+
+    if isinstance(layout["range"], str):
+        t = labels.index(layout["range"])
+        def fit_range(column):
+            low_high = str.split(cell(t, column), sep='-')
+            return (float(low_high[0]), float(low_high[1]))
+        error_row = t+2
+    else:
+        t, t_high = layout["range"]
+        def fit_range(column):
+            return (float(cell(t, column)[:-1]), float(cell(t_high, column)[:-1]))
+        error_row = t_high+1
+
+    fits = []
+    for column in range(layout["columns"]):
+        if column >= 2 and cell(0, column) == '':
+            continue
+        parameters = [float(cell(i, column)) for i in range(1, t)]
+        if "error" in layout:
+            perc_err = cell(*layout["error"])
+        else:
+            perc_err = float(cell(error_row, column))
+        fits.append((name, parameters, fit_range(column), perc_err))
+    return fits
 
 
-    ############################################################
-    # Function 4
-    ############################################################
-
-    def func4(x):
-        response = requests.get(x)
-        soup = BeautifulSoup(response.content,'html.parser')
-        results = soup.find(id = 'content') 
-        s = results.find('h1')
-        tds = []
-        b = []
-        c = []
-        d = []
-        e = []
-        fourth = []
-        g = []
-        y = []
-        x = []
-        n = []
-        p4 = []
-        r4 = []
-        e4 = []
-        divs = soup.findAll('table', {'class':'properties'})
-        for div in divs:
-            rows = div.findAll('tr')
-            for row in rows:
-                tds.append(row.text)
-
-        for i in tds:
-            w = i.find('curve fit')
-            if tds.index(i)<16:
-                if w!=-1:
-                    r = tds.index(i)
-                    x.append(r)
-                else:
-                    pass
-
-        for i in range(1,14):
-                a = str.split(tds[i], sep='\n')
-                b.append(a[1])
-                c.append(a[2])
-                d.append(a[3])
-                if len(a)>4:
-                    e.append(a[4])
-                if len(a)>5:
-                    fourth.append(a[5])
-
-        n.append(str.split(s.text, ":" )[1][1:])
-
-        tuples = [(key, value) for i, (key, value) in enumerate(zip(b, c))]
-        res = dict(tuples)
-        key = list(res.keys())
-        val = list(res.values())
-        t = key.index('data range')
-        keys1 = []
-        vals11 = []
-        for i in range(1,t):
-                keys1.append(key[i])
-                vals11.append(float(val[i]))
-
-        keys2 = []
-        vals21 = []
-        for i in range(t,t+2):
-                keys2.append(key[i])
-                f = str.split(val[i], sep='-')
-                h = (float(f[0]),float(f[1]))
-                vals21.append(h)
-
-        keys3 = []
-        vals31 = []
-        for i in range(t+2,len(res)):
-                keys3.append(key[i])
-                vals31.append(float(val[i]))
-
-        p4.append(vals11)
-        r4.append(vals21[0])
-        e4.append(vals31)
-
-        #second column of thermal conductivity
-        n.append(str.split(s.text, ":" )[1][1:])
-        
-        tuples = [(key, value) for i, (key, value) in enumerate(zip(b, d))]
-        res = dict(tuples)
-        key = list(res.keys())
-        val = list(res.values())
-        t = key.index('data range')
-        keys1 = []
-        vals12 = []
-        for i in range(1,t):
-                keys1.append(key[i])
-                vals12.append(float(val[i]))
-
-        keys2 = []
-        vals22 = []
-        for i in range(t,t+2):
-                keys2.append(key[i])
-                f = str.split(val[i], sep='-')
-                h = (float(f[0]),float(f[1]))
-                vals22.append(h)
-
-        keys3 = []
-        vals32 = []
-        for i in range(t+2,len(res)):
-                keys3.append(key[i])
-                vals32.append(float(val[i]))
-
-        p4.append(vals12)
-        r4.append(vals22[0])
-        e4.append(vals32)
-        return n, p4, r4, e4
-
-    ############################################################
-    # Function 5
-    ############################################################
-
-    def func5(x):
-        response = requests.get(x)
-        soup = BeautifulSoup(response.content,'html.parser')
-        results = soup.find(id = 'content') 
-        s = results.find('h1')
-        tds = []
-        b = []
-        c = []
-        d = []
-        e = []
-        fourth = []
-        g = []
-        y = []
-        x = []
-        n = []
-        p5 = []
-        r5 = []
-        e5 = []
-        divs = soup.findAll('table', {'class':'properties'})
-        for div in divs:
-            rows = div.findAll('tr')
-            for row in rows:
-                tds.append(row.text)
-
-        for i in tds:
-            w = i.find('curve fit')
-            if tds.index(i)<16:
-                if w!=-1:
-                    r = tds.index(i)
-                    x.append(r)
-                else:
-                    pass
-
-        for i in range(1,14):
-                a = str.split(tds[i], sep='\n')
-                b.append(a[1])
-                c.append(a[2])
-                d.append(a[3])
-                if len(a)>4:
-                    e.append(a[4])
-                if len(a)>5:
-                    fourth.append(a[5])
-                if len(a)>6:
-                    g.append(a[6])
-
-        n.append(str.split(s.text, ":" )[1][1:])
-        tuples = [(key, value) for i, (key, value) in enumerate(zip(b, c))]
-        res = dict(tuples)
-        key = list(res.keys())
-        val1 = list(res.values())
-
-        vals10 = float(val1[10][:-1])
-        vals11 = float(val1[11][:-1])
-        vals1=[]
-        for i in range(1,10):
-            vals1.append(float(val1[i]))
-        t1 = (vals10,vals11)
-        p5.append(vals1)
-        r5.append(t1)
-        e5.append(float(val1[12]))
-
-        #second column of thermal conductivity
-        n.append(str.split(s.text, ":")[1][1:])
-        tup = [(key, value) for i, (key, value) in enumerate(zip(b, d))]
-        res = dict(tup)
-        key = list(res.keys())
-        val2 = list(res.values())
-
-        vals20 = float(val2[10][:-1])
-        vals21 = float(val2[11][:-1])
-        vals2=[]
-        for i in range(1,10):
-            vals2.append(float(val2[i]))
-        t2 = (vals20,vals21)
-        p5.append(vals2)
-        r5.append(t2)
-        e5.append(float(val2[12]))
-
-        #third column(if exits)
-        if e[0]!='':
-            n.append(str.split(s.text, ":" )[1][1:])
-            tuples = [(key, value) for i, (key, value) in enumerate(zip(b, e))]
-            res = dict(tuples)
-            key = list(res.keys())
-            val3 = list(res.values())
-
-            vals30 = float(val3[10][:-1])
-            vals31 = float(val3[11][:-1])
-            vals3=[]
-            for i in range(1,10):
-                vals3.append(float(val3[i]))
-            t3 = (vals30,vals31)
-            p5.append(vals3)
-            r5.append(t3)
-            e5.append(float(val3[12]))
-
-        #4th column, if it exists
-        if fourth[0]!='':
-            n.append(str.split(s.text, ":" )[1][1:])
-            tuples = [(key, value) for i, (key, value) in enumerate(zip(b, fourth))]
-            res = dict(tuples)
-            key = list(res.keys())
-            val4 = list(res.values())
-
-            vals40 = float(val4[10][:-1])
-            vals41 = float(val4[11][:-1])
-            vals4=[]
-            for i in range(1,10):
-                vals4.append(float(val4[i]))
-            t4 = (vals40,vals41)
-            p5.append(vals4)
-            r5.append(t4)
-            e5.append(float(val4[12]))
-
-        #5th column, if exists
-        if g[0]!='':
-            n.append(str.split(s.text, ":" )[1][1:])
-            tuples = [(key, value) for i, (key, value) in enumerate(zip(b, g))]
-            res = dict(tuples)
-            key = list(res.keys())
-            val5 = list(res.values())
-
-            vals50 = float(val5[10][:-1])
-            vals51 = float(val5[11][:-1])
-            vals5=[]
-            for i in range(1,10):
-                vals5.append(float(val5[i]))
-            t5 = (vals50,vals51)
-            p5.append(vals5)
-            r5.append(t5)
-            e5.append(float(val5[12]))
-        return n, p5, r5, e5
-
-
-    ############################################################
-    # Defining the material names and urls
-    ############################################################
-
-    name_arr = ['Aluminum 1100', 'Aluminum 3003-F', 'Aluminum 5083-O', 'Aluminum 6061-T6', 'Aluminum 6063-T5', 'Balsa',
-            'Beechwood phenolic', 'Beryllium Copper', 'Brass', 'Copper (OFHC)', 'Fiberglass Epoxy G-10', 
-            'Glass Fabric/Polyester', 'Inconel 718', 'Invar (Fe-36Ni)', 'Kevlar-49 Fiber (Aramid)', 
-            'Kevlar-49 Composite (Aramid)', 'Lead', 'Molybdenum', 'Nickel Steel Fe 2.25 Ni', 'Nickel Steel Fe 3.25 Ni', 
-            'Nickel Steel Fe 5.0 Ni', 'Nickel Steel Fe 9.0 Ni', 'Platinum', 'Nylon', 'Mylar/PET', 'Kapton', 
-            'Polystyrene', 'Polyurethane', 'PVC', 'Stainless Steel 304', 'Stainless Steel 304L', 'Stainless Steel 310',
-            'Stainless Steel 316', 'Teflon', 'Ti-6Al-4V', 'Titanium 15-3-3-3']
-
-    Urls = ['https://trc.nist.gov/cryogenics/materials/1100%20Aluminum/1100%20Aluminum_rev.htm',
-            'https://trc.nist.gov/cryogenics/materials/3003F%20Aluminum/3003FAluminum_rev.htm', 
-            'https://trc.nist.gov/cryogenics/materials/5083%20Aluminum/5083Aluminum_rev.htm',
-            'https://trc.nist.gov/cryogenics/materials/6061%20Aluminum/6061_T6Aluminum_rev.htm',
-            'https://trc.nist.gov/cryogenics/materials/6063_T5%20Alulminum/6063-T5Aluminum_rev.htm',
-            'https://trc.nist.gov/cryogenics/materials/Balsa/Balsa_rev.htm',
-            'https://trc.nist.gov/cryogenics/materials/Beechwood_Phenolic/beechwood_rev.htm',
-            'https://trc.nist.gov/cryogenics/materials/Beryllium%20Copper/BerylliumCopper_rev.htm', 
-            'https://trc.nist.gov/cryogenics/materials/Brass/Brass_rev.htm',
-            'https://trc.nist.gov/cryogenics/materials/OFHC%20Copper/OFHC_Copper_rev1.htm',
-            'https://trc.nist.gov/cryogenics/materials/G-10%20CR%20Fiberglass%20Epoxy/G10CRFiberglassEpoxy_rev.htm', 
-            'https://trc.nist.gov/cryogenics/materials/Glass%20Fabric%20-%20Polyester/GlassFabric_Polyester_rev.htm',
-            'https://trc.nist.gov/cryogenics/materials/Iconel%20718/Inconel718_rev.htm',
-            'https://trc.nist.gov/cryogenics/materials/Invar(Fe-36Ni)/Invar_rev.htm',
-            'https://trc.nist.gov/cryogenics/materials/Kevlar49/kevlarfiber.htm',
-            'https://trc.nist.gov/cryogenics/materials/Kevlar49/kevlarcomposite.htm',
-            'https://trc.nist.gov/cryogenics/materials/Lead/Lead_rev.htm',
-            'https://trc.nist.gov/cryogenics/materials/Molybdenum/Molybdenum_rev.htm',
-            'https://trc.nist.gov/cryogenics/materials/NickelSteel/NickelSteel_Fe2.25Ni)_rev.htm',
-            'https://trc.nist.gov/cryogenics/materials/NickelSteel/NickelSteel_Fe3.25Ni)_rev.htm',
-            'https://trc.nist.gov/cryogenics/materials/NickelSteel/NickelSteel_Fe5.0Ni)_rev.htm',
-            'https://trc.nist.gov/cryogenics/materials/NickelSteel/NickelSteel_Fe9.0Ni)_rev.htm',
-            'https://trc.nist.gov/cryogenics/materials/Platinum/Platinum_rev.htm', 
-            'https://trc.nist.gov/cryogenics/materials/Polyamide%20(Nylon)/PolyamideNylon_rev.htm',
-            'https://trc.nist.gov/cryogenics/materials/PET/PET_rev.htm',
-            'https://trc.nist.gov/cryogenics/materials/Polyimide%20Kapton/PolyimideKapton_rev.htm',
-            'https://trc.nist.gov/cryogenics/materials/Polystyrene/polystyrenerev.html',
-            'https://trc.nist.gov/cryogenics/materials/Polyurethane/polyurethanerev.html',
-            'https://trc.nist.gov/cryogenics/materials/PVC/PVCrev.htm',
-            'https://trc.nist.gov/cryogenics/materials/304Stainless/304Stainless_rev.htm',
-            'https://trc.nist.gov/cryogenics/materials/304LStainless/304LStainless_rev.htm',
-            'https://trc.nist.gov/cryogenics/materials/310%20Stainless/310Stainless_rev.htm',
-            'https://trc.nist.gov/cryogenics/materials/316Stainless/316Stainless_rev.htm',
-            'https://trc.nist.gov/cryogenics/materials/Teflon/Teflon_rev.htm',
-            'https://trc.nist.gov/cryogenics/materials/Ti6Al4V/Ti6Al4V_rev.htm',
-            'https://trc.nist.gov/cryogenics/materials/Titanium/Titanium.htm']
-    # Types: Determines the function to use to scrape from the NIST website
-    Types = [1,1,1,1,1,4,4,1,1,5,4,3,1,1,2,2,1,1,1,1,1,1,1,1,1,1,3,3,4,1,1,1,1,1,1,1] 
-    # eq_types: Determines the fit equation type that will be included in the output file
-    eq_types = [1,1,1,1,1,1,1,1,1,2,1,1,1,1,3,3,1,1,1,1,1,1,1,1,1,1,1,1,1,1,1,1,1,1,1,1] 
+def main():
+    # Define the Arg Parser
+    parser = argparse.ArgumentParser(description="Scrape the NIST thermal conductivity fits into the library.")
+    parser.add_argument('--offline', help="Parse the cached pages without any network access (see nist_fetch)", action="store_true")
+    parser.add_argument('--jobs', help="Number of pages fetched at once", type=int, default=8)
+    parser.add_argument('--max-age', help="Use cached pages fetched less than this many seconds ago without revalidating them", type=float, default=0)
+    args = parser.parse_args()
 
     Materials = {}
 
@@ -651,6 +172,9 @@ def main():
     # The scraping
     ############################################################
 
+    # Every page is fetched (or revalidated) at once, then parsed from the cache
+    pages = fetch_pages(Urls, offline=args.offline, jobs=args.jobs, max_age=args.max_age)
+
     name = []
     para = []
     data_range = []
@@ -659,27 +183,16 @@ def main():
     for i in range(len(Materials)):
         keys = list(Materials.keys())
         key = keys[i]
-        if Materials[key]['Type']==1:
-            n1, p1,r1,e1 = func1(Materials[key]['Url'])
-        if Materials[key]['Type']==2:
-            n1, p1,r1,e1 = func2(Materials[key]['Url'])
-        if Materials[key]['Type']==3:
-            n1, p1,r1,e1 = func3(Materials[key]['Url'])
-        if Materials[key]['Type']==4:
-            n1, p1,r1,e1 = func4(Materials[key]['Url'])
-        if Materials[key]['Type']==5:
-            n1, p1,r1,e1 = func5(Materials[key]['Url'])
-
-        for n in range(len(list(n1))):
+        fits = parse_nist_page(pages[Materials[key]['Url']], Materials[key]['Type'])
+
+        for n, (page_name, parameters, fit_range, perc_err) in enumerate(fits):
             if key in special_names:
                 nappendval = f"{special_names[key][n]}"
-                para.append(p1[n][::-1])
-                data_range.append(r1[n][:])
             else:
                 nappendval= key
-                para.append(p1[::-1])
-                data_range.append(r1)
-            error.append(e1[n])
+            para.append(parameters[::-1])
+            data_range.append(fit_range)
+            error.append(perc_err)
             name.append(nappendval)
             eq_type_arr.append(eq_types[i])
 
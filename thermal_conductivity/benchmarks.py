@@ -0,0 +1,135 @@
+## Timing comparisons for the thermal conductivity tools
+## Author: Henry Nachman
+## Description: Run this file to time the optimized kernels against the implementations they
+## replaced. Each benchmark prints the time per call of both versions and checks they agree.
+
+import numpy as np
+import os, sys, timeit
+from scipy.special import erf
+from bs4 import BeautifulSoup
+
+abspath = os.path.abspath(__file__)
+sys.path.insert(0, os.path.dirname(abspath))
+
+from fit_types import loglog_func, Nppoly, polylog
+from tc_registry import MaterialRegistry
+
+
+def time_call(func, *args, repeat=5, number=None):
+    """
+    Returns: the best time per call (s) of func(*args) over repeat runs
+    """
+    timer = timeit.Timer(lambda: func(*args))
+    if number is None:
+        number, _ = timer.autorange()
+    return min(timer.repeat(repeat=repeat, number=number))/number
+
+def report(name, t_old, t_new):
+    print(f"{name:<40s} old {t_old*1e6:10.1f} us   new {t_new*1e6:10.1f} us   speedup {t_old/t_new:6.1f}x")
+
+###############################################################
+# comppoly - the loglog_func before it was fused into a single pass
+
+def loglog_func_unfused(T, param_dictionary, erf_multiplicity=15):
+    erf_param = param_dictionary["erf_param"]
+    low_fit = Nppoly(T, param_dictionary)
+    hi_fit = polylog(T, param_dictionary)
+    if erf_param==0:
+        erf_hi = 0
+        erf_low = 1
+    elif erf_param==-1:
+        erf_low = 0
+        erf_hi = 1
+    else:
+        erf_low = 0.5*(1-erf(erf_multiplicity*(np.log10((T)/erf_param))))
+        erf_hi = 0.5*(1+erf(erf_multiplicity*(np.log10(T/erf_param))))
+    return low_fit*erf_low+hi_fit*erf_hi
+
+def bench_comppoly(registry, sizes=(1, 100, 10000, 1000000)):
+    records = [registry[mat] for mat in registry if registry[mat].fit_type == "comppoly"]
+    print(f"comppoly (loglog_func) over {len(records)} materials")
+    for n_points in sizes:
+        T = np.logspace(-1, 3, n_points) if n_points > 1 else 4.2
+        t_old = t_new = 0
+        for record in records:
+            with np.errstate(all="ignore"):
+                old, new = loglog_func_unfused(T, record), loglog_func(T, record)
+                assert np.allclose(new, old, rtol=1e-12, equal_nan=True), record.name
+                t_old += time_call(loglog_func_unfused, T, record)
+                t_new += time_call(loglog_func, T, record)
+        report(f"  {n_points} temperatures", t_old, t_new)
+
+
+###############################################################
+# NIST page parsing - func1 of NIST_scrape before the table-driven parser (pages of type 1)
+
+def parse_nist_page_tdsindex(content):
+    soup = BeautifulSoup(content,'html.parser')
+    results = soup.find(id = 'content')
+    s = results.find('h1')
+    tds = []
+    b = []
+    c = []
+    x = []
+    divs = soup.findAll('table', {'class':'properties'})
+    for div in divs:
+        rows = div.findAll('tr')
+        for row in rows:
+            tds.append(row.text)
+
+    for i in tds:
+        w = i.find('curve fit')
+        if tds.index(i)<16:
+            if w!=-1:
+                r = tds.index(i)
+                x.append(r)
+
+    for i in range(1,14):
+            a = str.split(tds[i], sep='\n')
+            b.append(a[1])
+            c.append(a[2])
+
+    res = dict(zip(b, c))
+    key = list(res.keys())
+    val = list(res.values())
+    t = key.index('data range')
+    vals1 = [float(val[i]) for i in range(1,t)]
+    f = str.split(val[t], sep='-')
+    vals2 = (float(f[0]),float(f[1]))
+    vals3 = [float(val[i]) for i in range(t+2,len(res))]
+    return [str.split(s.text, ":")[1][1:]], vals1, vals2, vals3
+
+def parse_pages(parser, pages):
+    return [parser(*page) for page in pages]
+
+def bench_nist_parser(cache=None):
+    import NIST_scrape
+    from nist_fetch import PageCache
+    cache = PageCache() if cache is None else cache
+    pages = [(cache.get(url), page_type) for url, page_type in zip(NIST_scrape.Urls, NIST_scrape.Types) if url in cache]
+    if not pages:
+        print("NIST page parsing : no cached pages - run NIST_scrape.py once with network access")
+        return
+    type1 = [content for content, page_type in pages if page_type == 1]
+    backends = [("html.parser", None)] + ([("lxml", NIST_scrape.lxml)] if NIST_scrape.lxml is not None else [])
+    print(f"NIST page parsing over {len(type1)} cached pages of type 1 ({len(pages)} cached pages)")
+    t_old = time_call(parse_pages, parse_nist_page_tdsindex, [(content,) for content in type1], repeat=3)
+    for backend, module in backends:
+        NIST_scrape.lxml = module
+        for content in type1:
+            name, parameters, fit_range, perc_err = NIST_scrape.parse_nist_page(content, 1)[0]
+            old = parse_nist_page_tdsindex(content)
+            assert (old[0][0], old[1], old[2], old[3][0]) == (name, parameters, fit_range, perc_err), name
+        t_new = time_call(parse_pages, NIST_scrape.parse_nist_page, [(content, 1) for content in type1], repeat=3)
+        report(f"  func1 -> parse_nist_page ({backend})", t_old, t_new)
+        t_all = time_call(parse_pages, NIST_scrape.parse_nist_page, pages, repeat=3)
+        print(f"  every cached page ({backend}) : {len(pages)/t_all:.0f} pages/s")
+    NIST_scrape.lxml = backends[-1][1]
+
+
+if __name__ == "__main__":
+    path_to_tcFiles = f"{os.path.split(abspath)[0]}{os.sep}..{os.sep}"
+    tc_file = sorted([file for file in os.listdir(path_to_tcFiles) if file.startswith("tc_fullrepo") and file.endswith(".csv")])[-1]
+    registry = MaterialRegistry.from_csv(f"{path_to_tcFiles}{os.sep}{tc_file}")
+    bench_comppoly(registry)
+    bench_nist_parser()
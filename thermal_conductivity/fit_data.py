@@ -7,18 +7,278 @@ import numpy as np
 import matplotlib.pyplot as plt
 import matplotlib
 matplotlib.use('TKAgg')
-import os, json, shutil
-import argparse
+import os, sys, io, json, shutil, time, hashlib
+import argparse, contextlib, traceback
+from concurrent.futures import ProcessPoolExecutor
 
 # note : most functions needed for running this notebook can be found in tc_utils.
 from tc_utils import *
+from tc_rawdata import build_raw_store
+from tc_plotting import figure_file, figure_formats, read_manifest
+
+FIT_MANIFEST = "fit_manifest.json" # written to the fits folder of each material, records the inputs of its fit
+FIT_CODE = ["fit_data.py", "tc_utils.py", "fit_types.py", "tc_plotting.py", "tc_rawdata.py"] # files whose changes require a refit (and its plots)
+FIT_PLOTS = ["RAWDATA", "fullPlot", "subplots", "ResidualPlots"] # figures fit_material saves for each material, as {mat}_{plot}
+
+
+def fit_material(mat, raw_path, fits_path, plots_path, plots=True, n_splits=15, refine=False, preview=False):
+    """
+    Function: fits the raw data of a single material and writes its fit files (and plots).
+
+    Arguments:
+    - mat: str. Material name (the folder name in lib)
+    - raw_path, fits_path, plots_path: str. The RAW, fits and plots folders of the material
+    - plots: bool. If True, the fit plots are saved in plots_path
+    - n_splits: int. Number of candidate low-hi split locations tried for a combined fit
+    - refine: bool. If True, the best combined fit of the split search is refined (see refine_combined_fit)
+    - preview: bool. If True, png previews of the plots are saved next to the 300 dpi pdfs
+
+    Returns: fit_args - dictionary of the fit arguments
+    """
+    ## First, let's collect the raw data from their csv files
+    big_data, data_dict = parse_raw(mat, raw_path, plots=plots, weight_const=0.00, preview=preview)
+    T, k, koT, weights = [big_data[:,0], big_data[:,1], big_data[:,2], big_data[:,3]]
+    
+    gaps = len(find_gaps(T, 0.8)) > 0
+    # print(find_gaps(T, 100))
+    maxT, minT = [max(T), min(T)]
+    fit_orders = [3,3]
+    fit_types = ["Nppoly", "polylog"]
+
+    lenLow = len(T[T<=20])
+    lenHi = len(T[T>=20])
+
+    # lenHi = 10
+    # lenLow = 0
+
+
+    if lenHi==0:
+        print(f"{mat} : Using a low fit")
+        low_fit_xs, low_fit = koT_function(T, koT, fit_orders[0], weights)
+        hi_fit, hi_fit_xs, erf_loc = [[0], [0], 0]
+        fit_args = dict_combofit(low_fit, low_fit_xs, hi_fit, hi_fit_xs, fit_orders, fit_types, erf_loc, fit_catch = "low")
+        fit_args["combined_function_type"] = fit_types[0]
+        perc_diff_low, perc_diff_arr = get_percdiff(T[T<=max(low_fit_xs)],k[T<=max(low_fit_xs)], fit_args)
+        # print(perc_diff_low, perc_diff_arr)
+        fit_args["low_perc_err"] =  perc_diff_low
+        fit_args["hi_perc_err"] =  0
+        fit_args["combined_perc_err"] =  perc_diff_low
+        fit_args["combined_function_type"] = fit_types[0]
+        if perc_diff_low > 50:
+            print(f"{mat} : Using a hi fit")
+            hi_fit_xs, hi_fit = logk_function(np.log10(T), np.log10(k), fit_orders[1], weights)
+            low_fit, erf_loc = [[0], -1]
+            fit_args = dict_combofit(low_fit, low_fit_xs, hi_fit, hi_fit_xs, fit_orders, fit_types, erf_loc, fit_catch = "high")
+            fit_args["combined_function_type"] = fit_types[1]
+            perc_diff_hi, perc_diff_arr = get_percdiff(T[T>=min(hi_fit_xs)],k[T>=min(hi_fit_xs)], fit_args)
+            fit_args["hi_perc_err"] = perc_diff_hi
+            fit_args["low_perc_err"] =  0
+            fit_args["combined_perc_err"] =  perc_diff_hi
+            
+    elif lenLow==0:
+        print(f"{mat} : Using a hi fit")
+        hi_fit_xs, hi_fit = logk_function(np.log10(T), np.log10(k), fit_orders[1], weights)
+        low_fit, low_fit_xs, erf_loc = [[0], [0], -1]
+        fit_args = dict_combofit(low_fit, low_fit_xs, hi_fit, hi_fit_xs, fit_orders, fit_types, erf_loc)
+        perc_diff_hi, perc_diff_arr = get_percdiff(T[T>=min(hi_fit_xs)],k[T>=min(hi_fit_xs)], fit_args)
+        fit_args["hi_perc_err"] = perc_diff_hi
+        fit_args["low_perc_err"] =  0
+        fit_args["combined_perc_err"] =  perc_diff_hi
+        fit_args["combined_function_type"] = fit_types[1]
+    else:
+        print(f"{mat} : Using a combined fit")# - data exists on both sides of 20K")
+        erf_locList = np.linspace(np.sort(T)[0], np.sort(T)[-1], n_splits)
+        # fits either side of every candidate split, and the average percent difference of each combined fit
+        perc_diff_avgs, split_fits = split_search(big_data, erf_locList, fit_orders, fit_types)
+        low_fit_xs, low_fit, hi_fit_xs, hi_fit = split_fits[-1] # the fit ranges below use the last candidate's fits
+        # Now that we have found the residuals of the fits for many different split locations, let's choose the best one.    
+        erf_locdict = dict(zip(erf_locList, perc_diff_avgs))
+        bestRes = min(erf_locdict.values())
+        besterf_loc = [key for key in erf_locdict if erf_locdict[key] == bestRes]
+        
+        # We will repeat the above fit with this new 'optimized' split location
+        fit_args = dual_tc_fit(big_data, plots_path, erf_loc=min(besterf_loc), fit_orders=fit_orders, plots=False)
+        if refine:
+            # refine the split, the blend sharpness and both polynomials together, starting from the grid result
+            fit_args, nfev = refine_combined_fit(big_data, fit_args)
+            print(f"Refined in {nfev} evaluations - blend multiplicity: {fit_args.get('combined_fit_erfmult', ERF_MULTIPLICITY):.2f}")
+        perc_diff_avg, perc_diff_arr = get_percdiff(T, k, fit_args)
+        print(f"Low-Hi split centered at : {fit_args['combined_fit_erfloc']} ~~ with average percent difference value of: {perc_diff_avg:.2f}%")
+
+        perc_diff_low, perc_diff_arr = get_percdiff(T[T<=max(low_fit_xs)],k[T<=max(low_fit_xs)], fit_args)
+        perc_diff_hi, perc_diff_arr = get_percdiff(T[T>=min(hi_fit_xs)],k[T>=min(hi_fit_xs)], fit_args)
+        perc_diff_combo, perc_diff_arr = get_percdiff(T,k, fit_args)
+        fit_args["low_perc_err"] =  perc_diff_low
+        fit_args["hi_perc_err"] =  perc_diff_hi
+        fit_args["combined_perc_err"] =  perc_diff_combo
+
+    if gaps:
+        print(f"Gap found in data - splitting fit into low and high")
+        low_array = format_splitfit(fit_args, "low")
+        high_array = format_splitfit(fit_args, "hi")
+        if (fit_args["low_fit_range"][0] == fit_args["low_fit_range"][1]):
+            create_data_table(high_array, f"{fits_path}\\{mat}.txt")
+            create_tc_csv(high_array, f"{fits_path}\\{mat}.csv")
+        elif (fit_args["hi_fit_range"][0] == fit_args["hi_fit_range"][1]):
+            create_data_table(low_array, f"{fits_path}\\{mat}.txt")
+            create_tc_csv(low_array, f"{fits_path}\\{mat}.csv")
+        else:
+            create_data_table(low_array, f"{fits_path}\\{mat}_lo.txt")
+            create_tc_csv(low_array, f"{fits_path}\\{mat}_lo.csv")
+            create_data_table(high_array, f"{fits_path}\\{mat}_hi.txt")
+            create_tc_csv(high_array, f"{fits_path}\\{mat}_hi.csv")
+        make_fit_lh5(fit_args, fits_path)
 
+    else:
+        # print(fit_args)
+        output_array = format_combofit(fit_args)
+        # Finally, we will output the fit parameters as a csv, and lh5 file - and plot the data.
+        create_data_table(output_array, f"{fits_path}\\{mat}.txt")
+        create_tc_csv(output_array, f"{fits_path}\\{mat}.csv")
+        make_fit_lh5(fit_args, fits_path)
+        # PLOTTING CODE
+    if plots:
+        tk_plot(mat, {mat: raw_path}, data_dict, fit_args, fit_range = [100e-3, np.sort(T)[-1]], points=True, fits="combined", fill=True, preview=preview)
+    return fit_args
+
+
+def run_fit_task(task, capture=False):
+    """
+    Function: runs fit_material on one task (mat, raw_path, fits_path, plots_path, plots), timing it and
+    catching its errors so that one failed material does not stop the others.
+
+    Arguments:
+    - task: tuple of the fit_material arguments (mat, raw_path, fits_path, plots_path, plots, n_splits, refine, preview)
+    - capture: bool. If True, the printed output is returned instead of printed (for pool workers)
+
+    Returns: dictionary with the material, fit type, combined percent error, time (s), error and log
+    """
+    mat = task[0]
+    result = {"material": mat, "fit_type": None, "perc_err": None, "time": 0, "error": None, "log": ""}
+    log = io.StringIO()
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(log if capture else sys.stdout):
+        try:
+            fit_args = fit_material(*task)
+            result["fit_type"] = fit_args["combined_function_type"]
+            result["perc_err"] = fit_args["combined_perc_err"]
+        except Exception as error:
+            result["error"] = f"{type(error).__name__}: {error}"
+            traceback.print_exc(file=sys.stdout)
+    result["time"] = time.perf_counter() - start
+    result["log"] = log.getvalue()
+    return result
+
+def init_worker():
+    # pool workers only save figures, so they do not need (and should not open) a GUI backend
+    matplotlib.use("Agg")
+
+def run_fit_tasks(tasks, jobs=1):
+    """
+    Function: runs the fit tasks, in a pool of jobs processes if jobs > 1. Results (and the output
+    of each material) come back in the order of tasks whatever order the fits finish in.
+
+    Returns: list of run_fit_task results
+    """
+    if jobs <= 1:
+        return [run_fit_task(task) for task in tasks]
+    results = []
+    with ProcessPoolExecutor(max_workers=jobs, initializer=init_worker) as executor:
+        for result in executor.map(run_fit_task, tasks, [True]*len(tasks)):
+            print(result["log"], end="")
+            results.append(result)
+    return results
+
+def print_summary(results, total_time):
+    """
+    Function: prints one line per material with its fit type, percent error and time, then the failures.
+    """
+    print(f"\n{'Material':<30s}{'Fit Type':<12s}{'Perc Err':>10s}{'Time [s]':>10s}")
+    for result in results:
+        if result["error"] is None:
+            print(f"{result['material']:<30s}{result['fit_type']:<12s}{result['perc_err']:>10.2f}{result['time']:>10.2f}")
+        else:
+            print(f"{result['material']:<30s}{'FAILED':<12s}{'':>10s}{result['time']:>10.2f}")
+    failed = [result for result in results if result["error"] is not None]
+    print(f"Fit {len(results)-len(failed)} of {len(results)} materials in {total_time:.1f} s")
+    for result in failed:
+        print(f"  {result['material']} : {result['error']}")
+
+
+def raw_hash(raw_path):
+    """
+    Returns: sha1 hex digest of the names and contents of the RAW csv files of a material
+    """
+    sha = hashlib.sha1()
+    for file in sorted(get_datafiles(raw_path)):
+        sha.update(file.encode())
+        with open(f"{raw_path}{os.sep}{file}", "rb") as raw_file:
+            sha.update(raw_file.read())
+    return sha.hexdigest()
+
+def code_version():
+    """
+    Returns: sha1 hex digest of the fitting code (the FIT_CODE files - this file, tc_utils, fit_types, tc_plotting
+    and tc_rawdata)
+    """
+    sha = hashlib.sha1()
+    code_dir = os.path.dirname(os.path.abspath(__file__))
+    for file in FIT_CODE:
+        with open(f"{code_dir}{os.sep}{file}", "rb") as code_file:
+            sha.update(code_file.read())
+    return sha.hexdigest()
+
+def fit_inputs(task, code_hash):
+    """
+    Returns: dictionary of everything the fit parameters depend on - the RAW data hash, the fit settings and
+    the code version. The plot options are left out: they do not change the fit, and the plots are tracked by
+    the plot_manifest of their folder (see tc_plotting and plots_are_saved)
+    """
+    mat, raw_path, fits_path, plots_path, plots, n_splits, refine, preview = task
+    return {"raw": raw_hash(raw_path), "settings": {"n_splits": n_splits, "refine": refine}, "code": code_hash}
+
+def plots_are_saved(task):
+    """
+    Returns: True if every plot the task asks for (with its png preview if preview) is saved and recorded
+    in the plot_manifest of the plots folder - always True if plots are off
+    """
+    mat, raw_path, fits_path, plots_path, plots, n_splits, refine, preview = task
+    if not plots:
+        return True
+    manifest = read_manifest(plots_path)
+    files = [figure_file(f"{mat}_{plot}", fmt) for plot in FIT_PLOTS for fmt in figure_formats(preview)]
+    return all(file in manifest and os.path.exists(f"{plots_path}{os.sep}{file}") for file in files)
+
+def is_up_to_date(task, inputs):
+    """
+    Returns: True if the manifest in the fits folder of the task matches inputs, the fit files exist and the
+    plots the task asks for are saved (otherwise the material is fit again, which redraws only the missing
+    or stale plots)
+    """
+    fits_path = task[2]
+    try:
+        with open(f"{fits_path}{os.sep}{FIT_MANIFEST}", "r") as file:
+            manifest = json.load(file)
+    except (OSError, ValueError):
+        return False
+    has_fits = any(file.endswith(".csv") for file in os.listdir(fits_path))
+    return has_fits and manifest == inputs and plots_are_saved(task)
+
+def write_manifest(task, inputs):
+    with open(f"{task[2]}{os.sep}{FIT_MANIFEST}", "w") as file:
+        json.dump(inputs, file, indent=4)
 
 def main():
     # Define the Arg Parser
     parser = argparse.ArgumentParser(description="Run the thermal conductivity fitting program.")
     parser.add_argument('--matlist', help="List of materials to fit, add sequentially with space delimiters and no brackets (with quotes)", type=str, nargs="+", default=None)
     parser.add_argument('--plot', help="Boolean: make plots?", type=bool, default=True)
+    parser.add_argument('--splits', help="Number of candidate low-hi split locations tried for combined fits", type=int, default=15)
+    parser.add_argument('--refine', help="Refine combined fits (split, blend sharpness and coefficients) by nonlinear least squares", action="store_true")
+    parser.add_argument('--force', help="Refit every material, even those whose RAW data, settings and code are unchanged", action="store_true")
+    parser.add_argument('--preview', help="Also save quick png previews of the plots next to the 300 dpi pdfs", action="store_true")
+    parser.add_argument('--pack', help="Pack the RAW data of the library into the RAW store (raw_store.npz) before fitting", action="store_true")
+    parser.add_argument('--jobs', help="Number of materials to fit in parallel (processes)", type=int, default=1)
 
     args = parser.parse_args()
 
@@ -114,135 +374,29 @@ def main():
             path_to_plots[mat] = plots_str
 
 
-    # Now we can loop through each material and run our fitting algorithm
-    # You can also change the array that mat cycles through if you wish to only run the code for certain materials
-    for mat in path_to_RAW.keys(): #  ["Kapton"]: # 
-        perc_diff_avgs = np.array([])
-        ## First, let's collect the raw data from their csv files
-        big_data, data_dict = parse_raw(mat, path_to_RAW[mat], plots=True, weight_const=0.00)
-        T, k, koT, weights = [big_data[:,0], big_data[:,1], big_data[:,2], big_data[:,3]]
-        
-        gaps = len(find_gaps(T, 0.8)) > 0
-        # print(find_gaps(T, 100))
-        maxT, minT = [max(T), min(T)]
-        fit_orders = [3,3]
-        fit_types = ["Nppoly", "polylog"]
-
-        lenLow = len(T[T<=20])
-        lenHi = len(T[T>=20])
-
-        # lenHi = 10
-        # lenLow = 0
-
-
-        if lenHi==0:
-            print(f"{mat} : Using a low fit")
-            low_fit_xs, low_fit = koT_function(T, koT, fit_orders[0], weights)
-            hi_fit, hi_fit_xs, erf_loc = [[0], [0], 0]
-            fit_args = dict_combofit(low_fit, low_fit_xs, hi_fit, hi_fit_xs, fit_orders, fit_types, erf_loc, fit_catch = "low")
-            fit_args["combined_function_type"] = fit_types[0]
-            perc_diff_low, perc_diff_arr = get_percdiff(T[T<=max(low_fit_xs)],k[T<=max(low_fit_xs)], fit_args)
-            # print(perc_diff_low, perc_diff_arr)
-            fit_args["low_perc_err"] =  perc_diff_low
-            fit_args["hi_perc_err"] =  0
-            fit_args["combined_perc_err"] =  perc_diff_low
-            fit_args["combined_function_type"] = fit_types[0]
-            if perc_diff_low > 50:
-                print(f"{mat} : Using a hi fit")
-                hi_fit_xs, hi_fit = logk_function(np.log10(T), np.log10(k), fit_orders[1], weights)
-                low_fit, erf_loc = [[0], -1]
-                fit_args = dict_combofit(low_fit, low_fit_xs, hi_fit, hi_fit_xs, fit_orders, fit_types, erf_loc, fit_catch = "high")
-                fit_args["combined_function_type"] = fit_types[1]
-                perc_diff_hi, perc_diff_arr = get_percdiff(T[T>=min(hi_fit_xs)],k[T>=min(hi_fit_xs)], fit_args)
-                fit_args["hi_perc_err"] = perc_diff_hi
-                fit_args["low_perc_err"] =  0
-                fit_args["combined_perc_err"] =  perc_diff_hi
-                
-        elif lenLow==0:
-            print(f"{mat} : Using a hi fit")
-            hi_fit_xs, hi_fit = logk_function(np.log10(T), np.log10(k), fit_orders[1], weights)
-            low_fit, low_fit_xs, erf_loc = [[0], [0], -1]
-            fit_args = dict_combofit(low_fit, low_fit_xs, hi_fit, hi_fit_xs, fit_orders, fit_types, erf_loc)
-            perc_diff_hi, perc_diff_arr = get_percdiff(T[T>=min(hi_fit_xs)],k[T>=min(hi_fit_xs)], fit_args)
-            fit_args["hi_perc_err"] = perc_diff_hi
-            fit_args["low_perc_err"] =  0
-            fit_args["combined_perc_err"] =  perc_diff_hi
-            fit_args["combined_function_type"] = fit_types[1]
-        else:
-            print(f"{mat} : Using a combined fit")# - data exists on both sides of 20K")
-            erf_locList = np.linspace(np.sort(T)[0], np.sort(T)[-1], 15)
-            for erf_loc in erf_locList:
-                dsplit = split_data(big_data, erf_loc)
-                lowT, lowT_k, lowT_koT, low_ws, hiT, hiT_k, hiT_koT, hi_ws = dsplit
-                # Take a log10 of the high range
-                log_hi_T = np.log10(hiT)
-                log_hi_k = np.log10(hiT_k)
-                
-                if (len(lowT)==0):
-                    low_fit = [0]
-                    low_fit_xs = [0]
-                else:
-                    low_fit_xs, low_fit = koT_function(lowT, lowT_koT, fit_orders[0], low_ws)
-                if (len(hiT)==0):
-                    hi_fit = [0]
-                    hi_fit_xs = [0]
-                else:
-                    hi_fit_xs, hi_fit = logk_function(log_hi_T, log_hi_k, fit_orders[1], hi_ws)
-                fit_args = dict_combofit(low_fit, low_fit_xs, hi_fit, hi_fit_xs, fit_orders, fit_types, erf_loc)
-                ## With the fit complete, let's output a formatted dictionary with the fit parameters
-                # output_array = format_combofit(fit_args)
-                ## We want to figure out the best location for the split in data, so we will compute the residual of the combined fit
-                # low_param, hi_param, erf_param = fit_args["low_fit_param"], fit_args["hi_fit_param"], fit_args["combined_fit_erfloc"]
-                # kpred = loglog_func(T, low_param, hi_param, erf_param)
-                # and append it to the array resVal
-                # diff = kpred-k
-                # perc_diff_arr = 100*abs(diff/kpred)
-                perc_diff_avg, perc_diff_arr = get_percdiff(T, k, fit_args)
-                perc_diff_avgs = np.append(perc_diff_avgs, perc_diff_avg)
-            # Now that we have found the residuals of the fits for many different split locations, let's choose the best one.    
-            erf_locdict = dict(zip(erf_locList, perc_diff_avgs))
-            bestRes = min(erf_locdict.values())
-            besterf_loc = [key for key in erf_locdict if erf_locdict[key] == bestRes]
-            
-            # We will repeat the above fit with this new 'optimized' split location
-            fit_args = dual_tc_fit(big_data, path_to_plots[mat], erf_loc=min(besterf_loc), fit_orders=fit_orders, plots=False)
-            perc_diff_avg, perc_diff_arr = get_percdiff(T, k, fit_args)
-            print(f"Low-Hi split centered at : {min(besterf_loc)} ~~ with average percent difference value of: {perc_diff_avg:.2f}%")
-
-            perc_diff_low, perc_diff_arr = get_percdiff(T[T<=max(low_fit_xs)],k[T<=max(low_fit_xs)], fit_args)
-            perc_diff_hi, perc_diff_arr = get_percdiff(T[T>=min(hi_fit_xs)],k[T>=min(hi_fit_xs)], fit_args)
-            perc_diff_combo, perc_diff_arr = get_percdiff(T,k, fit_args)
-            fit_args["low_perc_err"] =  perc_diff_low
-            fit_args["hi_perc_err"] =  perc_diff_hi
-            fit_args["combined_perc_err"] =  perc_diff_combo
-
-        if gaps:
-            print(f"Gap found in data - splitting fit into low and high")
-            low_array = format_splitfit(fit_args, "low")
-            high_array = format_splitfit(fit_args, "hi")
-            if (fit_args["low_fit_range"][0] == fit_args["low_fit_range"][1]):
-                create_data_table(high_array, f"{path_to_fits[mat]}\\{mat}.txt")
-                create_tc_csv(high_array, f"{path_to_fits[mat]}\\{mat}.csv")
-            elif (fit_args["hi_fit_range"][0] == fit_args["hi_fit_range"][1]):
-                create_data_table(low_array, f"{path_to_fits[mat]}\\{mat}.txt")
-                create_tc_csv(low_array, f"{path_to_fits[mat]}\\{mat}.csv")
-            else:
-                create_data_table(low_array, f"{path_to_fits[mat]}\\{mat}_lo.txt")
-                create_tc_csv(low_array, f"{path_to_fits[mat]}\\{mat}_lo.csv")
-                create_data_table(high_array, f"{path_to_fits[mat]}\\{mat}_hi.txt")
-                create_tc_csv(high_array, f"{path_to_fits[mat]}\\{mat}_hi.csv")
-            make_fit_lh5(fit_args, path_to_fits[mat])
-
-        else:
-            # print(fit_args)
-            output_array = format_combofit(fit_args)
-            # Finally, we will output the fit parameters as a csv, and lh5 file - and plot the data.
-            create_data_table(output_array, f"{path_to_fits[mat]}\\{mat}.txt")
-            create_tc_csv(output_array, f"{path_to_fits[mat]}\\{mat}.csv")
-            make_fit_lh5(fit_args, path_to_fits[mat])
-            # PLOTTING CODE
-        if plots:
-            tk_plot(mat,path_to_RAW, data_dict, fit_args, fit_range = [100e-3, np.sort(T)[-1]], points=True, fits="combined", fill=True)
+    # Now we can fit each material - each fit (and its plots) only touches its own folder, so they can run in parallel
+    tasks = [(mat, path_to_RAW[mat], path_to_fits[mat], path_to_plots[mat], plots, args.splits, args.refine, args.preview) for mat in path_to_RAW.keys()]
+    start = time.perf_counter()
+
+    # Only refit materials whose RAW data, fit settings or fitting code changed since their last fit
+    code_hash = code_version()
+    with contextlib.redirect_stdout(io.StringIO()): # get_datafiles prints the number of files
+        inputs = {task[0]: fit_inputs(task, code_hash) for task in tasks}
+    if not args.force:
+        skipped = [task[0] for task in tasks if is_up_to_date(task, inputs[task[0]])]
+        tasks = [task for task in tasks if task[0] not in skipped]
+        if skipped:
+            print(f"Skipping {len(skipped)} unchanged materials (use --force to refit them)")
+
+    # parse_raw reads the RAW store for every material whose RAW folder is unchanged since it was packed
+    if args.pack:
+        build_raw_store(path_to_lib)
+
+    results = run_fit_tasks(tasks, args.jobs)
+    for task, result in zip(tasks, results):
+        if result["error"] is None:
+            write_manifest(task, inputs[task[0]])
+    print_summary(results, time.perf_counter() - start)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
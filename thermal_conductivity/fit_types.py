@@ -1,5 +1,6 @@
 ## Author: Henry Nachman
 import numpy as np
+import math
 from scipy.special import erf
 
 def get_func_type(key):
@@ -11,7 +12,14 @@ def get_func_type(key):
                      "NIST-copperfit":  NIST5a_2,
                      "lowTextrapolate": lowTextrapolate,
                      "NIST-experf":     NIST_experf,
-                     "powerlaw":       power_law}
+                     "powerlaw":       power_law,
+                     "NBS":             NBS,
+                     "NBS-Woodcraft":   NIST5a_6,
+                     "NIST-powerext":   NIST5a_7,
+                     "NIST-scext":      NIST5a_8,
+                     "RRadebaugh 1":    RRadebaugh1,
+                     "RRadebaugh 2":    RRadebaugh2,
+                     "RRadebaugh 3":    RRadebaugh3}
     return fit_type_dict[key]
 
 ######################################################################
@@ -40,37 +48,123 @@ def polylog(T, param_dictionary):
         param = param_dictionary["low_param"]
     return 10**np.polyval(param, np.log10(T))
 
-def loglog_func(T, param_dictionary, erf_multiplicity=15): #**kwargs
+ERF_SATURATION = 6 # erf(z) rounds to exactly +-1 for |z| > 6
+ERF_MULTIPLICITY = 15 # default sharpness of the comppoly blend between the low and high fits
+SMALL_ARRAY = 4096 # below this many temperatures loglog_func evaluates both sides everywhere
+
+def horner(coeffs, x):
+    """
+    Description : Evaluates a polynomial (coefficients highest order first) at the array x,
+    updating a single buffer in place.
+    """
+    y = np.zeros(np.shape(x))
+    for c in coeffs:
+        y *= x
+        y += c
+    return y
+
+def loglog_scalar(T, low_param, hi_param, erf_param, erf_multiplicity):
+    """
+    Returns: loglog_func for a single float temperature, in plain floats. Raises ValueError for T <= 0 and
+    OverflowError where the array kernel would give inf (loglog_func then uses the array kernel).
+    """
+    logT = math.log10(T)
+    if erf_param==0:
+        erf_low, erf_hi = 1.0, 0.0
+    elif erf_param==-1:
+        erf_low, erf_hi = 0.0, 1.0
+    else:
+        erf_val = math.erf(erf_multiplicity*(logT-math.log10(erf_param)))
+        erf_low, erf_hi = 0.5*(1-erf_val), 0.5*(1+erf_val)
+    k = 0.0
+    if erf_low != 0:
+        low_fit = 0.0
+        for c in low_param:
+            low_fit = low_fit*T + c
+        k += T*low_fit*erf_low
+    if erf_hi != 0:
+        hi_fit = 0.0
+        for c in hi_param:
+            hi_fit = hi_fit*logT + c
+        k += 10**hi_fit*erf_hi
+    return k
+
+def get_erf_multiplicity(param_dictionary):
+    """
+    Returns: the blend sharpness of a comppoly fit - its "erf_multiplicity" entry, or ERF_MULTIPLICITY
+    if it has none (or 0, as written for fits made before the blend was fitted).
+    """
+    try:
+        erf_multiplicity = param_dictionary["erf_multiplicity"]
+    except KeyError:
+        return ERF_MULTIPLICITY
+    return erf_multiplicity if erf_multiplicity else ERF_MULTIPLICITY
+
+def loglog_func(T, param_dictionary, erf_multiplicity=None): #**kwargs
     """
     Description : Takes a temperature (or temp array) and fit arguments returns the estimated k value.
 
+    k = T*P_low(T)*erf_low + 10**P_hi(log10(T))*erf_hi, evaluated in a single pass: log10(T) and the
+    erf blend are computed once, and on large arrays each polynomial is only evaluated where its
+    weight is non-zero. Scalars are evaluated in plain floats.
+
     Arguments : 
     - T - temperature at which to estimate the thermal conductivity.
     - low_param: in form a + bT + cT**2 ...
+    - erf_multiplicity - sharpness of the blend, by default that of the fit (see get_erf_multiplicity)
     
     Make sure to remove trailing zeros 
     """
+    if erf_multiplicity is None:
+        erf_multiplicity = get_erf_multiplicity(param_dictionary)
     low_param = param_dictionary["low_param"]
     hi_param  = param_dictionary["hi_param"]
     erf_param = param_dictionary["erf_param"]
-
-    low_param = low_param[::-1] ################################### 20240531
-    hi_param = hi_param[::-1] ################################### 20240531
-    low_fit = Nppoly(T, param_dictionary)
-    hi_fit = polylog(T, param_dictionary)
-    
+    if len(hi_param)==0:
+        hi_param = low_param # as in polylog
+
+    if np.ndim(T) == 0:
+        try:
+            return np.float64(loglog_scalar(float(T), low_param, hi_param, erf_param, erf_multiplicity))
+        except (ValueError, OverflowError):
+            # log10 of T <= 0 (or of a negative erf_param) and overflowing powers raise in plain floats,
+            # the array kernel gives the same nan/inf for a scalar as for an array
+            return loglog_func(np.array([T], dtype=float), param_dictionary, erf_multiplicity)[0]
+    T = np.asarray(T, dtype=float)
+    logT = np.log10(T)
     if erf_param==0:
-        erf_hi = 0
-        erf_low = 1
+        return T*horner(low_param, T)
     elif erf_param==-1:
-        erf_low = 0
-        erf_hi = 1
-    else:
-        erf_low = 0.5*(1-erf(erf_multiplicity*(np.log10((T)/erf_param))))
-        erf_hi = 0.5*(1+erf(erf_multiplicity*(np.log10(T/erf_param))))
-
-    k = low_fit*erf_low+hi_fit*erf_hi
-
+        return 10**horner(hi_param, logT)
+
+    z = logT - np.log10(erf_param)
+    z *= erf_multiplicity
+    use_low, use_hi = z < ERF_SATURATION, z > -ERF_SATURATION
+    if T.size <= SMALL_ARRAY or (use_low.all() and use_hi.all()):
+        # masking costs more than it saves here, unless a side with zero weight overflows (0*inf)
+        erf_val = erf(z)
+        with np.errstate(over="ignore", invalid="ignore"):
+            k = T*horner(low_param, T)
+            k *= 0.5*(1-erf_val)
+            k += 10**horner(hi_param, logT)*(0.5*(1+erf_val))
+        if np.isfinite(k).all():
+            return k
+
+    blend = use_low & use_hi
+    erf_blend = erf(z[blend])
+    k = np.zeros(T.shape)
+    if use_low.any():
+        T_low = T[use_low]
+        low_fit = horner(low_param, T_low)
+        low_fit *= T_low
+        low_fit[blend[use_low]] *= 0.5*(1-erf_blend)
+        k[use_low] = low_fit
+    if use_hi.any():
+        hi_fit = horner(hi_param, logT[use_hi])
+        np.power(10, hi_fit, out=hi_fit)
+        hi_fit[blend[use_hi]] *= 0.5*(1+erf_blend)
+        k[use_hi] += hi_fit
+    k[np.isnan(z)] = np.nan # T < 0 or nan, on neither side of the blend
     return k
 
 ######################################################################
@@ -99,62 +193,48 @@ def NIST_experf(T, param_dictionary):
     return k
 #################################################################
 # From Ray Radebaugh
-def RRadebaugh1(T, low_param, hi_param, erf_param):
-    low_param = np.flip(low_param)
-    hi_param = np.flip(hi_param)
-    k = loglog_func(T, low_param, hi_param, erf_param)
-    return k
-
-def RRadebaugh3(T, low_param, hi_param, erf_param):
-    low_param = np.flip(low_param)
-    hi_param = np.flip(hi_param)
+# The parameters are stored lowest order first (a + bT + cT**2 ...), so they are flipped before
+# being handed to the polynomial evaluation.
 
-    k = loglog_func(T, low_param, hi_param, erf_param, erf_multiplicity=10)
+def RRadebaugh_erf(T, erf_param, erf_multiplicity=1/7):
+    """
+    Returns: erf_low, erf_hi - the weights of the low and high fits, blended linearly in T around erf_param
+    """
+    if erf_param==0:
+        return 1, 0
+    elif erf_param==-1:
+        return 0, 1
+    erf_low = 0.5*(1-erf(erf_multiplicity*(T - erf_param)))
+    erf_hi = 0.5*(1+erf(erf_multiplicity*(T - erf_param)))
+    return erf_low, erf_hi
+
+def RRadebaugh1(T, param_dictionary, erf_multiplicity=15):
+    flipped = {"low_param": np.flip(param_dictionary["low_param"]),
+               "hi_param":  np.flip(param_dictionary["hi_param"]),
+               "erf_param": param_dictionary["erf_param"]}
+    k = loglog_func(T, flipped, erf_multiplicity=erf_multiplicity)
     return k
 
-def RRadebaugh2(T, low_param, hi_param, erf_param):
-    low_param = np.flip(low_param)
-    hi_param = np.flip(hi_param)
-
-    print(np.poly1d(low_param))
-    print(np.poly1d(hi_param))
+def RRadebaugh2(T, param_dictionary):
+    low_param = np.flip(param_dictionary["low_param"])
+    hi_param = np.flip(param_dictionary["hi_param"])
 
     low_fit = T*np.polyval(low_param, T)
     hi_fit = 10**np.polyval(hi_param, np.log10(T))
-    print(low_fit, hi_fit)
-    if erf_param==0:
-        erf_hi = 0
-        erf_low = 1
-    elif erf_param==-1:
-        erf_low = 0
-        erf_hi = 1
-    else:
-        erf_multiplicity = 1/7
-        erf_low = 0.5*(1-erf(erf_multiplicity*(T -erf_param)))
-        erf_hi = 0.5*(1+erf(erf_multiplicity*(T - erf_param)))
+    erf_low, erf_hi = RRadebaugh_erf(T, param_dictionary["erf_param"])
 
     k = low_fit*erf_low+hi_fit*erf_hi
     return k
 
-def RRadebaugh3(T, low_param, hi_param, erf_param):
-    h = hi_param[-1]
-    low_param = np.flip(low_param)
-    hi_param = np.flip(hi_param[:-1])
+def RRadebaugh3(T, param_dictionary):
+    h = param_dictionary["hi_param"][-1]
+    low_param = np.flip(param_dictionary["low_param"])
+    hi_param = np.flip(param_dictionary["hi_param"][:-1])
 
     low_fit = T*np.polyval(low_param, T)
     hi_fit = np.polyval(hi_param, np.log10(T)) + h*np.exp(np.log10(T))
     hi_fit = 10**hi_fit
-
-    if erf_param==0:
-        erf_hi = 0
-        erf_low = 1
-    elif erf_param==-1:
-        erf_low = 0
-        erf_hi = 1
-    else:
-        erf_multiplicity = 1/7
-        erf_low = 0.5*(1-erf(erf_multiplicity*(T -erf_param)))
-        erf_hi = 0.5*(1+erf(erf_multiplicity*(T - erf_param)))
+    erf_low, erf_hi = RRadebaugh_erf(T, param_dictionary["erf_param"])
 
     k = low_fit*erf_low+hi_fit*erf_hi
     return k
@@ -191,15 +271,37 @@ Case 2  'NIST formulation for OFHC Copper
 
 """
 
-def NIST5a_3(T, param_dictionary):
+def NIST5a_3(T, param_dictionary, out=None):
+    """
+    Description : Chebyshev series in x (ln(T) mapped onto [-1, 1]) giving ln(k), summed with the
+    Clenshaw recurrence. nan outside the fit range, where arccos(x) is undefined.
+
+    Arguments :
+    - T - float or array of temperatures
+    - out - (optional) float array of T's shape to write k into
+    """
     params = param_dictionary["low_param"]
-    lnT = np.log(T)
-    x = ((lnT - params[1]) - (params[2] - lnT)) / (params[2] - params[1])
-    k = 0
-    for i in range(3,3+int(params[0])):
-        k = k + params[i] * np.cos((i - 3) * np.arccos(x))
-    k = np.exp(k)
-    return k
+    coeffs = params[3:3+int(params[0])]
+    T = np.asarray(T, dtype=float)
+    k = np.empty(T.shape) if out is None else out
+
+    x = np.log(T)
+    x -= (params[1] + params[2])/2
+    x /= (params[2] - params[1])/2
+    b1, b2, tmp = k, np.zeros(T.shape), np.empty(T.shape)
+    b1.fill(0)
+    for c in coeffs[:0:-1]: # b_j = c_j + 2x b_(j+1) - b_(j+2)
+        np.multiply(x, b1, out=tmp)
+        tmp *= 2
+        tmp -= b2
+        tmp += c
+        b1, b2, tmp = tmp, b1, b2
+    np.multiply(x, b1, out=tmp)
+    np.subtract(tmp, b2, out=k)
+    k += coeffs[0] if len(coeffs) else 0
+    k[np.abs(x) > 1] = np.nan
+    np.exp(k, out=k)
+    return k if out is not None else k[()]
 """
 Case 3  'Tcheby polynomial in ln(T) giving ln(g), a=# parameters, b=low temp, c= high temp, d...=parameters
     x = Log(temp) / Log(2.71828)
@@ -210,37 +312,41 @@ Case 3  'Tcheby polynomial in ln(T) giving ln(g), a=# parameters, b=low temp, c=
     Conductivity = 2.71828 ^ Conductivity
     
 """
-def lowTextrapolate(T, param_dictionary):
+def lowTextrapolate(T, param_dictionary, out=None):
+    """
+    Description : Piecewise fit - polynomial in log(T) above params[0], power law params[3]*T**params[2]
+    down to params[1] and -T below that (flagging the extrapolation).
+
+    Arguments :
+    - T - float or array of temperatures
+    - out - (optional) float array of T's shape to write k into
+    """
     params = param_dictionary["low_param"]
-    k = []
-    
-    if np.size(T) == 1:
-        k_plus = 0
-        if T > params[0]:
-            logtemp = np.log10(T)
-            for n in range(1, len(params)):
-                k_plus += params[n - 1] * logtemp ** (n - 1)
-            k = np.append(k, 10 ** (k_plus))
-        elif T > params[1]:
-            k = np.append(k, params[3] * T ** params[2])
-        else:
-            # k = params[16] * T ** params[15]
-            k = np.append(k, -1*T)
-        k = float(k)
-    else:
-        for i in range(len(T)):
-            k_plus = 0
-            if T[i] > params[0]:
-                logtemp = np.log10(T[i])
-                for n in range(1, len(params)):
-                    k_plus += params[n - 1] * logtemp ** (n - 1)
-                k = np.append(k, 10 ** (k_plus))
-            elif T[i] > params[1]:
-                k = np.append(k, params[3] * T[i] ** params[2])
-            else:
-                # k = params[16] * T ** params[15]
-                k = np.append(k, -1*T[i])
-    return k
+    T = np.asarray(T, dtype=float)
+    k = np.empty(T.shape) if out is None else out
+
+    high = T > params[0]
+    power = ~high & (T > params[1])
+    np.negative(T, out=k)
+    np.power(T, params[2], out=k, where=power)
+    np.multiply(k, params[3], out=k, where=power)
+    if np.any(high):
+        # coefficients params[0] ... params[-2], lowest order first
+        k[high] = 10 ** np.polyval(params[-2::-1], np.log10(T[high]))
+    return k if out is not None else k[()]
+
+def NIST5a_4(T, IParameters):
+    """
+    Description : Case 4 of the spreadsheet, read with its own parameter numbering (unlike lowTextrapolate,
+    the catalog form of this fit) - polynomial in log(T) above IParameters(10), power law
+    IParameters(13)*T**IParameters(12) down to IParameters(11) and IParameters(16)*T**IParameters(15) below.
+    """
+    IParameters = NIST5a_params({"low_param": IParameters}, 17)
+    T = np.asarray(T, dtype=float)
+    k = IParameters[16] * T ** IParameters[15]
+    k = np.where(T > IParameters[11], IParameters[13] * T ** IParameters[12], k)
+    k = np.where(T > IParameters[10], 10 ** np.polyval(IParameters[9:0:-1], np.log10(T)), k)
+    return k[()]
 
 """
 Case 4 'Extrapolation to lower temp, either by using a*T^1.8, or better with data
@@ -268,8 +374,20 @@ Case 4 'Extrapolation to lower temp, either by using a*T^1.8, or better with dat
 """
 
 
-def NBS(temp, IParameters):
-    L_0 = 0.00000002443
+def NIST5a_params(param_dictionary, n_params):
+    """
+    Returns: a float copy of the low parameters zero padded to n_params (trailing zeros are stripped
+    from the compilation file), so the kernels never modify the caller's parameters.
+    """
+    params = np.asarray(param_dictionary["low_param"], dtype=float)
+    padded = np.zeros(max(n_params, len(params)))
+    padded[:len(params)] = params
+    return padded
+
+def NBS_resistivity(temp, IParameters, L_0):
+    """
+    Returns: the total electrical resistivity term 1/k of the NBS formulation (cases 5 and 6).
+    """
     beta = IParameters[1] / L_0 * 1 / IParameters[0]
     
     ln_temp_ratio_10 = np.log(temp / IParameters[10])
@@ -293,8 +411,36 @@ def NBS(temp, IParameters):
     
     rho_i0 = IParameters[8] * rho_i * rho_0 / (rho_i + rho_0)
     
-    Conductivity = 1 / (rho_0 + rho_i + rho_i0)
-    
+    return rho_0 + rho_i + rho_i0
+
+def NIST5a_reenter(formtype, T, IParameters, caller=None):
+    """
+    Description : The "GoTo Reenter" of the spreadsheet - evaluates formula number formtype with
+    the same parameter row. Cases 1-4 read their parameters from IParameters(1) on, cases 5-8
+    from IParameters(0). caller is the formula re-entering (7 or 8), so a row whose cases 7 and 8
+    re-enter each other or themselves raises a ValueError instead of recursing forever.
+    """
+    formtype = int(formtype)
+    if formtype == 1:
+        return NIST5a_1(T, IParameters[1:16])
+    if formtype == 4:
+        return NIST5a_4(T, IParameters)
+    formulas = {2: NIST5a_2, 3: NIST5a_3, 5: NBS, 6: NIST5a_6, 7: NIST5a_7, 8: NIST5a_8}
+    if formtype not in formulas:
+        raise ValueError(f"Unknown NIST5a formula type: {formtype}")
+    # follow the re-entries of cases 7 (IParameters(16)) and 8 (IParameters(29)) of the same row
+    padded, seen, following = NIST5a_params({"low_param": IParameters}, 30), {caller}, formtype
+    while following in (7, 8):
+        if following in seen:
+            raise ValueError(f"NIST5a formula type {following} re-enters itself through formula types 7 and 8 of the row")
+        seen.add(following)
+        following = int(padded[16 if following == 7 else 29])
+    offset = 1 if formtype <= 4 else 0
+    return formulas[formtype](T, {"low_param": IParameters[offset:]})
+
+def NBS(T, param_dictionary):
+    IParameters = NIST5a_params(param_dictionary, 24)
+    Conductivity = 1 / NBS_resistivity(T, IParameters, L_0=0.00000002443)
     return Conductivity
 
 """
@@ -317,44 +463,12 @@ Case 5 'Classic NBS (National Bureau of Standards) equations for Al, Cu, Fe, W u
 
 """
 
-def NIST5a_6(temp, IParameters, sc):
-    if sc == 1:
-        temp = 1.18
-
-    L_0 = 0.0000000245
-    beta = IParameters[1] / L_0 / IParameters[0]
-
+def NIST5a_6(T, param_dictionary):
+    IParameters = NIST5a_params(param_dictionary, 28)
     IParameters[2] = min(IParameters[24] * (IParameters[0] ** IParameters[25]), IParameters[2])
     IParameters[4] = max(IParameters[26] * (IParameters[0] ** IParameters[27]), IParameters[4])
-
-    ln_temp_ratio_10 = np.log(temp / IParameters[10])
-    ln_temp_ratio_11 = np.log(temp / IParameters[11])
-    ln_temp_ratio_14 = np.log(temp / IParameters[14])
-    ln_temp_ratio_15 = np.log(temp / IParameters[15])
-    ln_temp_ratio_18 = np.log(temp / IParameters[18])
-    ln_temp_ratio_19 = np.log(temp / IParameters[19])
-    ln_temp_ratio_22 = np.log(temp / IParameters[22])
-
-    rho_c = (IParameters[9] * ln_temp_ratio_10 * np.exp(-1 * (ln_temp_ratio_11 / IParameters[12]) ** 2) +
-             IParameters[13] * ln_temp_ratio_14 * np.exp(-1 * (ln_temp_ratio_15 / IParameters[16]) ** 2) +
-             IParameters[17] * ln_temp_ratio_18 * np.exp(-1 * (ln_temp_ratio_19 / IParameters[20]) ** 2) +
-             IParameters[21] * np.exp(-1 * (ln_temp_ratio_22 / IParameters[23]) ** 2))
-
-    rho_0 = beta / temp
-
-    rho_i = (IParameters[2] * temp ** IParameters[3] / 
-             (1 + IParameters[2] * IParameters[4] * temp ** (IParameters[3] + IParameters[5]) * 
-              np.exp(-1 * (IParameters[6] / temp) ** IParameters[7])) + rho_c)
-
-    rho_i0 = IParameters[8] * rho_i * rho_0 / (rho_i + rho_0)
-
-    if sc == 1:
-        normcond = 1 / (rho_0 + rho_i + rho_i0)
-        formtype = 8
-        return normcond, formtype  # Simulates the "GoTo Reenter"
-    else:
-        Conductivity = 1 / (rho_0 + rho_i + rho_i0)
-        return Conductivity
+    Conductivity = 1 / NBS_resistivity(T, IParameters, L_0=0.0000000245)
+    return Conductivity
 """
 Case 6 'Modified NBS approach by Adam Woodcraft: Cryogenics 45 (2005) 421–431
     
@@ -384,16 +498,14 @@ Case 6 'Modified NBS approach by Adam Woodcraft: Cryogenics 45 (2005) 421–431
     End If
 
 """
-def NIST5a_7(temp, IParameters):
-    if temp > IParameters[17]:
-        formtype = IParameters[16]
-        # Simulate the "GoTo Reenter" by returning formtype and a flag
-        return None, formtype
-    else:
-        Conductivity = IParameters[19] * temp ** IParameters[18]
-        return Conductivity, None
-
-
+def NIST5a_7(T, param_dictionary):
+    IParameters = NIST5a_params(param_dictionary, 20)
+    T = np.asarray(T, dtype=float)
+    Conductivity = np.asarray(IParameters[19] * T ** IParameters[18], dtype=float)
+    above = T > IParameters[17] # GoTo Reenter with formula IParameters(16)
+    if np.any(above):
+        Conductivity[above] = NIST5a_reenter(IParameters[16], T[above], IParameters, caller=7)
+    return Conductivity[()]
 """
 Case 7 'First do higher temp, the continue with power-series approximation.
     If (temp > IParameters(17)) Then
@@ -407,25 +519,20 @@ Case 7 'First do higher temp, the continue with power-series approximation.
 
 """
 
-def NIST5a_7(temp, IParameters, sc, normcond=None):
-    if temp > IParameters[30]:
-        formtype = IParameters[29]
-        # Simulate the "GoTo Reenter" by returning formtype and a flag
-        return None, formtype, sc, None
-    elif IParameters[29] == 6:
-        if sc == 0:
-            sc = 1
-            origtemp = temp
-            formtype = 6
-            # Simulate the "GoTo Reenter" by returning formtype and a flag
-            return None, formtype, sc, origtemp
-        else:
-            temp = origtemp
-            Conductivity = normcond * np.exp(IParameters[31] * (1 - 1.18 / temp))
-            return Conductivity, None, sc, None
+def NIST5a_8(T, param_dictionary):
+    IParameters = NIST5a_params(param_dictionary, 33)
+    T = np.asarray(T, dtype=float)
+    if IParameters[29] == 6:
+        # normal state conductivity at 1.18 K from the Woodcraft formula (the sc = 1 pass of case 6)
+        normcond = NIST5a_6(1.18, {"low_param": IParameters})
+        Conductivity = normcond * np.exp(IParameters[31] * (1 - 1.18 / T))
     else:
-        Conductivity = IParameters[32] * np.exp(IParameters[31] * (1 - IParameters[30] / temp))
-        return Conductivity, None, sc, None
+        Conductivity = IParameters[32] * np.exp(IParameters[31] * (1 - IParameters[30] / T))
+    Conductivity = np.asarray(Conductivity, dtype=float)
+    above = T > IParameters[30] # GoTo Reenter with formula IParameters(29)
+    if np.any(above):
+        Conductivity[above] = NIST5a_reenter(IParameters[29], T[above], IParameters, caller=8)
+    return Conductivity[()]
 
 """
 Case 8 'Superconducting extension
@@ -445,4 +552,88 @@ Case 8 'Superconducting extension
     Else
         Conductivity = IParameters(32) * Exp(IParameters(31) * (1 - IParameters(30) / temp))
     End If  
-"""
\ No newline at end of file
+"""
+###########################################################################
+# Stacked kernels - evaluate M materials of the same fit type over N temperatures in one pass.
+# Each kernel takes T and a list of param_dictionaries (or MaterialRecords) and returns an (M, N) array.
+# Parameters are stacked into (M, n) matrices: polynomial coefficients highest order first
+# and zero padded on the left, positional parameters zero padded on the right.
+
+def get_stacked_func_type(key):
+    """
+    Returns: the stacked kernel for the fit type, or None if it has no stacked kernel.
+    """
+    stacked_type_dict = {"polylog":         polylog_stack,
+                         "3 order polylog": polylog_stack,
+                         "Nppoly":          Nppoly_stack,
+                         "comppoly":        loglog_stack,
+                         "NIST-copperfit":  NIST5a_2_stack,
+                         "NIST-experf":     NIST_experf_stack,
+                         "powerlaw":        power_law_stack}
+    return stacked_type_dict.get(key)
+
+def stack_params(param_list, side="left", min_width=0):
+    """
+    Description : Zero pads a list of 1D parameter arrays into a single (M, n) matrix.
+    """
+    width = max([min_width] + [len(p) for p in param_list])
+    stacked = np.zeros((len(param_list), width))
+    for i, p in enumerate(param_list):
+        if len(p) == 0:
+            continue
+        if side == "left":
+            stacked[i, width-len(p):] = p
+        else:
+            stacked[i, :len(p)] = p
+    return stacked
+
+def horner_stack(coeffs, x):
+    """
+    Description : Evaluates M polynomials (rows of coeffs, highest order first) at every x.
+
+    Returns : (M, N) array
+    """
+    y = np.zeros((coeffs.shape[0], np.size(x)))
+    for c in coeffs.T:
+        y *= x
+        y += c[:, None]
+    return y
+
+def Nppoly_stack(T, records):
+    low = stack_params([r["low_param"] for r in records], "left")
+    return T*horner_stack(low, T)
+
+def polylog_stack(T, records):
+    params = [r["hi_param"] if len(r["hi_param"])!=0 else r["low_param"] for r in records]
+    return 10**horner_stack(stack_params(params, "left"), np.log10(T))
+
+def loglog_stack(T, records):
+    low_fit = Nppoly_stack(T, records)
+    hi_fit = polylog_stack(T, records)
+
+    erf_param = np.array([r["erf_param"] for r in records])[:, None]
+    erf_multiplicity = np.array([get_erf_multiplicity(r) for r in records])[:, None]
+    blend = (erf_param != 0) & (erf_param != -1)
+    erf_loc = np.where(blend, erf_param, 1) # placeholder location for rows that are not blended
+    erf_arg = erf(erf_multiplicity*(np.log10(T/erf_loc)))
+    erf_low = np.where(blend, 0.5*(1-erf_arg), np.where(erf_param==0, 1., 0.))
+    erf_hi = np.where(blend, 0.5*(1+erf_arg), np.where(erf_param==0, 0., 1.))
+    # a side weighted by exactly 0 is left out, as in loglog_func, so an overflowing fit there does not give inf*0
+    with np.errstate(invalid="ignore"):
+        return np.where(erf_low==0, 0., low_fit*erf_low) + np.where(erf_hi==0, 0., hi_fit*erf_hi)
+
+def NIST5a_2_stack(T, records):
+    p = stack_params([r["low_param"] for r in records], "right", min_width=9).T[:, :, None]
+    k = p[0] + p[2] * T ** (0.5) + p[4] * T + p[6] * T ** (1.5) + p[8] * T ** (2)
+    k = k / (1 + p[1] * T ** (0.5) + p[3] * T + p[5] * T ** (1.5) + p[7] * T ** (2))
+    return 10 ** k
+
+def NIST_experf_stack(T, records):
+    a, b, c, d, e, f = stack_params([r["low_param"] for r in records], "right", min_width=6).T[:6, :, None]
+    logT = np.log10(T)
+    k_val = (a + b*logT)*((1-erf(2*(logT-c)))/(2))+(d+e*(np.exp(-1*logT/f)))*((1+erf(2*(logT-c)))/(2))
+    return 10**k_val
+
+def power_law_stack(T, records):
+    A, B = stack_params([r["low_param"] for r in records], "right", min_width=2).T[:2, :, None]
+    return A*T**B
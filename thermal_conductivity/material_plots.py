@@ -6,55 +6,69 @@
 import numpy as np
 import matplotlib
 matplotlib.use("Agg")
-import matplotlib.pyplot as plt
 from scipy.special import erf
 from scipy.integrate import quad
-import sys, os
+import sys, os, argparse
 from fit_types import *
 from tc_tools  import *
+from tc_plotting import new_figure, draw_if_changed, run_plot_tasks
+import tc_tools
 
-def main():
-    # Get the absolute path of the current script
-    abspath = os.path.abspath(__file__)
-    print(os.path.split(abspath))
-    path_to_tcFiles = f"{os.path.split(abspath)[0]}{os.sep}.."
+PLOT_CODE = ("material_plots.py", "tc_plotting.py", "fit_types.py") # files whose changes require a redraw
 
+def plot_fit(mat, param_dictionary, plots_dir, preview=False, force=False):
+    """
+    Function: draws the fit of a material over its fit range into plots_dir (<mat>_fitPlot), unless its
+    fit parameters are unchanged since it was last drawn.
 
+    Returns: True if the plot was drawn, False if it was unchanged, None if its folder could not be made
+    """
+    def draw():
+        T = np.logspace(np.log10(param_dictionary["fit_range"][0]),np.log10(param_dictionary["fit_range"][1]),100)
+        func = get_func_type(param_dictionary["fit_type"])
+        y_pred = func(T, param_dictionary)
 
+        fig = new_figure()
+        ax = fig.subplots()
+        ax.plot(T, y_pred, label=f'{mat} fit')
+        ax.semilogx()
+        ax.semilogy()
+        ax.set_ylabel("k [W/m/K]")
+        ax.set_xlabel("T [K]")
+        ax.legend()
+        ax.grid(True)
+        ax.set_title(f"{mat} Thermal Conductivity Fit\nFit Type: {param_dictionary['fit_type']}")
+        return fig
+    try:
+        if not os.path.exists(plots_dir):
+            print(f"making path {plots_dir}")
+            os.mkdir(plots_dir)
+        return draw_if_changed(draw, plots_dir, f"{mat}_fitPlot", param_dictionary, preview, force, code=PLOT_CODE)
+    except FileNotFoundError:
+        return None
 
-    all_files = os.listdir(path_to_tcFiles)
-    exist_files = [file for file in all_files if file.startswith("tc_fullrepo")]
-    print(exist_files)
-    tc_file_date = exist_files[0][-12:-4]
+def main():
+    parser = argparse.ArgumentParser(description="Plot the fit of every material of the latest compilation.")
+    parser.add_argument('--jobs', help="Number of plots to draw in parallel (processes)", type=int, default=1)
+    parser.add_argument('--preview', help="Also save quick png previews next to the 300 dpi pdfs", action="store_true")
+    parser.add_argument('--force', help="Redraw every plot, even those whose fit is unchanged", action="store_true")
+    args = parser.parse_args()
 
-    TCdata = np.loadtxt(f"{path_to_tcFiles}{os.sep}tc_fullrepo_{tc_file_date}.csv", dtype=str, delimiter=',') # imports compilation file csv
+    # Get the absolute path of the current script
+    abspath = os.path.abspath(__file__)
+    print(os.path.split(abspath))
+    TCdata = tc_tools.TCdata # the most recent compilation file, see tc_tools.set_catalog
     mat_names = TCdata[:,0]
 
-
-    for mat in mat_names[1:]: # ["Graphite"]: # 
+    tasks = []
+    for mat in mat_names[1:]: # ["Graphite"]: #
         param_dictionary = get_parameters(TCdata, mat)
-        T = np.logspace(np.log10(param_dictionary["fit_range"][0]),np.log10(param_dictionary["fit_range"][1]),100)
         print(f"Plotting {mat} using fit type: {param_dictionary['fit_type']}")
+        plots_dir = f"{os.path.split(abspath)[0]}{os.sep}lib{os.sep}{mat}{os.sep}plots"
+        tasks.append((mat, param_dictionary, plots_dir, args.preview, args.force))
 
-        func = get_func_type(param_dictionary["fit_type"])
-        y_pred = func(T, param_dictionary)
+    drawn = run_plot_tasks(plot_fit, tasks, args.jobs)
+    print(f"Drew {drawn.count(True)} of {len(tasks)} plots ({drawn.count(False)} unchanged, {drawn.count(None)} without a plots folder)")
 
-        plt.plot(T, y_pred, label=f'{mat} fit')
-        plt.semilogx()
-        plt.semilogy()
-        plt.ylabel("k [W/m/K]")
-        plt.xlabel("T [K]")
-        plt.legend()
-        plt.grid(True)
-        plt.title(f"{mat} Thermal Conductivity Fit\nFit Type: {param_dictionary['fit_type']}")
-        plots_dir = f"{os.path.split(abspath)[0]}{os.sep}lib{os.sep}{mat}{os.sep}plots{os.sep}"
-        try:
-            if not os.path.exists(plots_dir):
-                print(f"making path {plots_dir}")
-                os.mkdir(plots_dir)
-            plt.savefig(f"{plots_dir}{mat}_fitPlot.pdf", dpi=300)
-        except FileNotFoundError:
-            pass
-        plt.clf()
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,170 @@
+## Fetching and caching of the NIST material property pages
+## Author: Henry Nachman
+## Description: Downloads the pages scraped by NIST_scrape concurrently into an on-disk cache. Pages are
+## stored by the sha1 of their content, with an index of the url, validators (ETag, Last-Modified) and
+## fetch time of each, so later runs only re-download pages that changed and can re-parse every page
+## without network access (offline replay).
+
+import requests
+import os, json, hashlib, time, threading
+from concurrent.futures import ThreadPoolExecutor
+
+abspath = os.path.abspath(__file__)
+cache_dir = f"{os.path.dirname(abspath)}{os.sep}.tc_cache{os.sep}nist"
+
+INDEX_FILE = "index.json" # url -> sha1, etag, last_modified and fetched time of the cached page
+TIMEOUT = 30 # seconds, for connecting and for each read
+RETRIES = 3 # attempts per page
+BACKOFF = 1.0 # seconds before the second attempt, doubled after each failed attempt
+
+
+class PageNotCachedError(LookupError):
+    pass
+
+
+class PageCache:
+    """
+    Description : Content-addressed cache of web pages.
+
+    The content of each page is stored once as <sha1>.html in the cache folder, and index.json maps every
+    url to the sha1 of its latest content and the validators the server sent with it. Safe to use from
+    several threads.
+
+    Arguments :
+    - directory - default=cache_dir - the cache folder, created if needed
+    """
+    def __init__(self, directory=cache_dir):
+        self.directory = directory
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        try:
+            with open(f"{directory}{os.sep}{INDEX_FILE}", "r") as file:
+                self.index = json.load(file)
+        except (OSError, ValueError):
+            self.index = dict()
+
+    def path(self, sha1):
+        return f"{self.directory}{os.sep}{sha1}.html"
+
+    def __contains__(self, url):
+        entry = self.index.get(url)
+        return entry is not None and os.path.exists(self.path(entry["sha1"]))
+
+    def get(self, url):
+        """
+        Returns: the cached content of a url (bytes), or None if it is not cached
+        """
+        if url not in self:
+            return None
+        with open(self.path(self.index[url]["sha1"]), "rb") as file:
+            return file.read()
+
+    def put(self, url, content, headers=None):
+        """
+        Function: stores the content of a url with the validators of its response headers.
+        """
+        headers = dict() if headers is None else headers
+        sha1 = hashlib.sha1(content).hexdigest()
+        if not os.path.exists(self.path(sha1)):
+            with open(self.path(sha1), "wb") as file:
+                file.write(content)
+        with self.lock:
+            self.index[url] = {"sha1": sha1, "etag": headers.get("ETag"),
+                               "last_modified": headers.get("Last-Modified"), "fetched": time.time()}
+
+    def touch(self, url):
+        # the server confirmed the cached page is still current
+        with self.lock:
+            self.index[url]["fetched"] = time.time()
+
+    def validators(self, url):
+        """
+        Returns: the conditional request headers of a cached url (empty if it is not cached)
+        """
+        if url not in self:
+            return dict()
+        entry, headers = self.index[url], dict()
+        if entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+        return headers
+
+    def age(self, url):
+        """
+        Returns: seconds since the cached page of a url was last fetched or confirmed (inf if it is not cached)
+        """
+        return time.time() - self.index[url]["fetched"] if url in self else float("inf")
+
+    def save(self):
+        with self.lock:
+            with open(f"{self.directory}{os.sep}{INDEX_FILE}", "w") as file:
+                json.dump(self.index, file, indent=4, sort_keys=True)
+
+
+sessions = threading.local() # one requests.Session (and its connection pool) per fetching thread
+
+def get_session():
+    if not hasattr(sessions, "session"):
+        sessions.session = requests.Session()
+    return sessions.session
+
+def fetch_page(url, cache, timeout=TIMEOUT, retries=RETRIES, max_age=0):
+    """
+    Function: fetches a page into the cache. A cached page is revalidated with a conditional request, so
+    an unchanged page is not downloaded again; failed requests are retried with exponential backoff.
+
+    Arguments:
+    - url: str. The page
+    - cache: PageCache
+    - timeout: float. Seconds for connecting and for each read
+    - retries: int. Attempts before giving up
+    - max_age: float. Cached pages fetched less than max_age seconds ago are used without a request
+
+    Returns: content - bytes of the page. If every attempt fails, the cached page if there is one.
+    """
+    if url in cache and cache.age(url) < max_age:
+        return cache.get(url)
+    for attempt in range(retries):
+        try:
+            response = get_session().get(url, headers=cache.validators(url), timeout=timeout)
+            if response.status_code == 304 and url in cache:
+                cache.touch(url)
+                return cache.get(url)
+            response.raise_for_status()
+            cache.put(url, response.content, response.headers)
+            return response.content
+        except requests.RequestException as error:
+            if attempt == retries-1:
+                if url in cache:
+                    print(f"Could not fetch {url} ({error}) - using the cached page")
+                    return cache.get(url)
+                raise
+            time.sleep(BACKOFF*2**attempt)
+
+def fetch_pages(urls, offline=False, jobs=8, cache=None, **fetch_kwargs):
+    """
+    Function: fetches many pages concurrently (see fetch_page), or reads them all from the cache if offline.
+
+    Arguments:
+    - urls: list of str. The pages
+    - offline: bool. If True, no request is made and every page must be cached (offline replay)
+    - jobs: int. Number of pages fetched at once (threads)
+    - cache: PageCache, default PageCache() in cache_dir
+    - fetch_kwargs: timeout, retries and max_age of fetch_page
+
+    Returns: dictionary of the content (bytes) of each url
+    """
+    cache = PageCache() if cache is None else cache
+    urls = list(dict.fromkeys(urls))
+    if offline:
+        missing = [url for url in urls if url not in cache]
+        if missing:
+            raise PageNotCachedError(f"{len(missing)} pages are not cached, fetch them once with network access: {missing}")
+        return {url: cache.get(url) for url in urls}
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, jobs)) as executor:
+            contents = list(executor.map(lambda url: fetch_page(url, cache, **fetch_kwargs), urls))
+    finally:
+        cache.save() # keep the pages fetched so far, even if one failed
+    return dict(zip(urls, contents))
@@ -0,0 +1,340 @@
+## Integration engine for the thermal conductivity fits
+## Author: Henry Nachman
+## Description: Computes the conductivity integral (int k dT) of a material fit, using the
+## closed form antiderivative where the fit type has one, and composite Gauss-Legendre
+## quadrature in log(T) otherwise. Every result comes with an error estimate.
+
+import numpy as np
+import os, sys
+from functools import lru_cache
+from scipy.interpolate import CubicHermiteSpline
+
+abspath = os.path.abspath(__file__)
+sys.path.insert(0, os.path.dirname(abspath))
+
+from fit_types import get_func_type
+
+trapezoid = getattr(np, "trapezoid", None) or np.trapz
+
+
+@lru_cache(maxsize=None)
+def gauss_legendre(order):
+    """
+    Returns: nodes, weights of the Gauss-Legendre rule of the given order on [-1, 1].
+    """
+    return np.polynomial.legendre.leggauss(order)
+
+def exact_integral(record, T_low, T_high):
+    """
+    Function: integrates fits with a closed form antiderivative.
+
+    Arguments:
+    - record: MaterialRecord (or param_dictionary) of the material
+    - T_low, T_high: float. Integration bounds in Kelvin
+
+    Returns: the integral in W/m, or None if the fit type has no closed form.
+    """
+    fit_type = record["fit_type"]
+    if fit_type == "comppoly" and record["erf_param"] == 0:
+        fit_type = "Nppoly" # the erf weight of the high fit is exactly 0
+    if fit_type == "Nppoly":
+        # k = T*poly(T), so the antiderivative is polyint of the coefficients shifted up one order
+        antiderivative = np.polyint(np.append(record["low_param"], 0))
+        return np.polyval(antiderivative, T_high) - np.polyval(antiderivative, T_low)
+    if fit_type == "powerlaw":
+        A, B = np.append(record["low_param"], [0, 0])[:2]
+        if B == -1:
+            return A*np.log(T_high/T_low)
+        return A/(B+1)*(T_high**(B+1) - T_low**(B+1))
+    return None
+
+def fit_breakpoints(record):
+    """
+    Returns: temperatures (K) at which the fit changes form, used as quadrature panel edges.
+    """
+    fit_type, params = record["fit_type"], record["low_param"]
+    if fit_type == "comppoly" and record["erf_param"] > 0:
+        return [record["erf_param"]]
+    if fit_type == "NIST-experf" and len(params) > 2:
+        return [10**params[2]]
+    if fit_type == "lowTextrapolate" and len(params) > 1:
+        return [params[0], params[1]]
+    if fit_type == "NIST-powerext" and len(params) > 17:
+        return [params[17]]
+    if fit_type == "NIST-scext" and len(params) > 30:
+        return [params[30]]
+    return []
+
+def gauss_integral(record, T_low, T_high, order=16, panel_decades=1.0, rtol=1e-6, max_refine=6):
+    """
+    Function: integrates a fit by composite Gauss-Legendre quadrature in ln(T).
+
+    The range is split into panels of at most panel_decades decades, with extra panel edges at
+    the fit breakpoints. Each panel is integrated with order and order/2 points, the difference
+    of the two being the error estimate. While the estimate exceeds rtol the panels are halved,
+    at most max_refine times. Falls back to linear panels in T if T_low <= 0.
+
+    Arguments:
+    - record: MaterialRecord (or param_dictionary) of the material
+    - T_low, T_high: float. Integration bounds in Kelvin, T_low < T_high
+    - order: int. Number of quadrature points per panel
+    - panel_decades: float. Maximum panel width in decades of temperature
+    - rtol: float. Relative error at which to stop refining
+    - max_refine: int. Maximum number of panel halvings
+
+    Returns: ConInt, err - the integral in W/m and its estimated absolute error
+    """
+    x_hi, w_hi = gauss_legendre(order)
+    x_lo, w_lo = gauss_legendre(max(order//2, 1))
+    x = np.concatenate((x_hi, x_lo))
+
+    log_space = T_low > 0
+    if log_space:
+        u_low, u_high = np.log(T_low), np.log(T_high)
+        n_panels = max(1, int(np.ceil((u_high-u_low)/(panel_decades*np.log(10)))))
+        breaks = [np.log(T) for T in fit_breakpoints(record) if T_low < T < T_high]
+    else:
+        u_low, u_high = T_low, T_high
+        n_panels = 1
+        breaks = [T for T in fit_breakpoints(record) if T_low < T < T_high]
+
+    for refine in range(max_refine+1):
+        edges = np.unique(np.concatenate((np.linspace(u_low, u_high, n_panels+1), breaks)))
+        half_width = np.diff(edges)[:, None]/2
+        mid = (edges[:-1, None] + edges[1:, None])/2
+        u_nodes = mid + half_width*x # (panels, nodes)
+        if log_space:
+            T_nodes = np.exp(u_nodes)
+            k_vals = evaluate(record, T_nodes.ravel()).reshape(T_nodes.shape)*T_nodes*half_width # dT = T du
+        else:
+            k_vals = evaluate(record, u_nodes.ravel()).reshape(u_nodes.shape)*half_width
+        Q_hi = np.sum(k_vals[:, :order]*w_hi)
+        Q_lo = np.sum(k_vals[:, order:]*w_lo)
+        err = abs(Q_hi-Q_lo)
+        if not err > rtol*abs(Q_hi): # also stops on nan
+            break
+        n_panels *= 2
+    return Q_hi, err
+
+def evaluate(record, T):
+    """
+    Returns: the thermal conductivity of the record at T (accepts records and param_dictionaries).
+    """
+    if hasattr(record, "evaluate"):
+        return record.evaluate(T)
+    return get_func_type(record["fit_type"])(T, record)
+
+def conductivity_integral(record, T_low, T_high, method="auto", tables=None, table_rtol=1e-4):
+    """
+    Function: Finds the integrated thermal conductivity of a fit over a temperature range.
+
+    Arguments:
+    - record: MaterialRecord (or param_dictionary) of the material
+    - T_low: float. lower bound temperature in Kelvin
+    - T_high: float. upper bound temperature in Kelvin
+    - method: str. "auto"  - closed form if available, then the cumulative tables, Gauss-Legendre in ln(T) otherwise
+                   "gauss" - always use Gauss-Legendre in ln(T)
+                   "trapz" - 1000 point linear trapezoid rule (legacy, no error estimate)
+    - tables: (optional) CumulativeTables. Used by "auto" when both bounds are tabulated
+    - table_rtol: float. Table results with a larger relative error estimate fall back to Gauss-Legendre
+
+    Returns: ConInt, err - the integral in W/m and its estimated absolute error
+    """
+    T_low, T_high = float(T_low), float(T_high)
+    if T_low == T_high:
+        return 0.0, 0.0
+    if T_low > T_high:
+        ConInt, err = conductivity_integral(record, T_high, T_low, method, tables, table_rtol)
+        return -ConInt, err
+
+    if method == "trapz":
+        T_values = np.linspace(T_low, T_high, 1000)
+        return trapezoid(evaluate(record, T_values), T_values), np.nan
+    if method == "auto":
+        ConInt = exact_integral(record, T_low, T_high)
+        if ConInt is not None:
+            return ConInt, 0.0
+        name = getattr(record, "name", None)
+        if tables is not None and name in tables:
+            table_low, table_high = tables.table_range(name)
+            if table_low <= T_low and T_high <= table_high:
+                ConInt, err = tables.integral(name, T_low, T_high)
+                if err <= table_rtol*abs(ConInt):
+                    return float(ConInt), err
+    elif method != "gauss":
+        raise ValueError(f"Unknown integration method: {method}")
+    return gauss_integral(record, T_low, T_high)
+
+def conductivity_integrals(record, T_lows, T_highs, method="auto", tables=None, table_rtol=1e-4):
+    """
+    Function: conductivity_integral of one fit over many temperature intervals. Closed forms and
+    table lookups are evaluated for all intervals at once, the remaining intervals one by one.
+
+    Arguments:
+    - record: MaterialRecord (or param_dictionary) of the material
+    - T_lows, T_highs: arrays of integration bounds in Kelvin
+    - method, tables, table_rtol: as in conductivity_integral
+
+    Returns: ConInt, err - arrays of the integrals in W/m and their estimated absolute errors
+    """
+    T_lows, T_highs = np.broadcast_arrays(np.asarray(T_lows, dtype=float), np.asarray(T_highs, dtype=float))
+    ConInt, err = np.full(T_lows.shape, np.nan), np.full(T_lows.shape, np.nan)
+    remaining = np.ones(T_lows.shape, dtype=bool)
+    if method == "auto":
+        exact = exact_integral(record, T_lows, T_highs)
+        if exact is not None:
+            return np.asarray(exact, dtype=float), np.zeros(T_lows.shape)
+        name = getattr(record, "name", None)
+        if tables is not None and name in tables:
+            table_low, table_high = tables.table_range(name)
+            tabulated = (np.minimum(T_lows, T_highs) >= table_low) & (np.maximum(T_lows, T_highs) <= table_high)
+            table_int, table_err = tables.integral(name, T_lows[tabulated], T_highs[tabulated])
+            accepted = np.zeros(T_lows.shape, dtype=bool)
+            accepted[tabulated] = table_err <= table_rtol*np.abs(table_int)
+            ConInt[accepted] = table_int[accepted[tabulated]]
+            err[accepted] = table_err
+            remaining &= ~accepted
+    for i in zip(*np.nonzero(remaining)):
+        ConInt[i], err[i] = conductivity_integral(record, T_lows[i], T_highs[i], method=method)
+    return ConInt, err
+
+###############################################################
+# Cumulative integral tables - F(T) = int_{T0}^{T} k dT tabulated over each fit range, so that
+# int_{T1}^{T2} k dT = F(T2) - F(T1) costs two interpolations.
+
+def cumulative_integral(record, points_per_decade=64, T_min=1e-3, order=8):
+    """
+    Function: tabulates the cumulative conductivity integral of a fit on a log spaced grid.
+
+    Arguments:
+    - record: MaterialRecord (or param_dictionary) of the material
+    - points_per_decade: int. Grid density
+    - T_min: float. Lowest tabulated temperature, for fits whose range starts at 0 K
+    - order: int. Gauss-Legendre order used between neighbouring grid points
+
+    Returns: T_grid, F, k - the grid (K), cumulative integral (W/m, F[0] = 0) and k = dF/dT (W/m/K)
+    """
+    T_low, T_high = max(record["fit_range"][0], T_min), record["fit_range"][1]
+    n_points = max(2, int(np.ceil(np.log10(T_high/T_low)*points_per_decade))+1)
+    T_grid = np.logspace(np.log10(T_low), np.log10(T_high), n_points)
+    F = np.zeros(n_points)
+    F[1:] = np.cumsum(interval_integrals(record, T_grid[:-1], T_grid[1:], order))
+    return T_grid, F, evaluate(record, T_grid)
+
+def interval_integrals(record, T_lows, T_highs, order=8):
+    """
+    Returns: int k dT over each [T_lows[i], T_highs[i]] (all > 0 K) by one Gauss-Legendre panel in ln(T).
+    """
+    x, w = gauss_legendre(order)
+    u_low, u_high = np.log(T_lows)[:, None], np.log(T_highs)[:, None]
+    half_width = (u_high-u_low)/2
+    T_nodes = np.exp((u_low+u_high)/2 + half_width*x)
+    k_vals = evaluate(record, T_nodes.ravel()).reshape(T_nodes.shape)
+    return np.sum(k_vals*T_nodes*half_width*w, axis=1)
+
+def monotone_hermite(u, F, dFdu):
+    """
+    Description : Cubic Hermite interpolant of F(u) using the exact slopes, limited with the
+    Fritsch-Carlson condition so that it stays monotone wherever F is.
+    """
+    slopes = np.array(dFdu, dtype=float)
+    secant = np.diff(F)/np.diff(u)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        alpha, beta = slopes[:-1]/secant, slopes[1:]/secant
+        tau = np.where(alpha**2 + beta**2 > 9, 3/np.sqrt(alpha**2 + beta**2), 1)
+    tau[~np.isfinite(tau)] = 1
+    slopes[:-1] *= tau
+    slopes[1:] *= tau
+    slopes[:-1][secant == 0] = 0
+    slopes[1:][secant == 0] = 0
+    return CubicHermiteSpline(u, F, slopes, extrapolate=False)
+
+class CumulativeTables:
+    """
+    Description : Cumulative conductivity integrals of every material of a compilation file.
+
+    Built by compile_TC.py and saved as tc_cumint_<date>.npz next to the compilation files.
+    Each material's F(T) is interpolated in ln(T) with a monotone cubic Hermite interpolant
+    (slopes k*T), created the first time the material is used.
+
+    Arguments :
+    - names       - material names
+    - offsets     - start index of each material in T, F and k (len(names)+1 entries)
+    - T, F, k     - concatenated grids (K), cumulative integrals (W/m) and conductivities (W/m/K)
+    - err         - estimated maximum interpolation error of each material (W/m)
+    - source_hash - file_hash of the compilation file the tables were built from
+    """
+    def __init__(self, names, offsets, T, F, k, err, source_hash=""):
+        self.names = [str(name) for name in names]
+        self.index = {name: i for i, name in enumerate(self.names)}
+        self.offsets, self.T, self.F, self.k, self.err = offsets, T, F, k, err
+        self.source_hash = str(source_hash)
+        self.interpolants = dict()
+
+    @classmethod
+    def build(cls, registry, source_hash="", points_per_decade=64):
+        """
+        Returns: CumulativeTables for every material of the registry whose integral is finite.
+        """
+        names, offsets, T_all, F_all, k_all, err_all = [], [0], [], [], [], []
+        for mat in registry:
+            record = registry[mat]
+            with np.errstate(all="ignore"):
+                try:
+                    T_grid, F, k = cumulative_integral(record, points_per_decade)
+                except (KeyError, IndexError, ValueError, TypeError, OverflowError): # e.g. empty fit ranges
+                    continue
+                if not (np.all(np.isfinite(F)) and np.all(np.isfinite(k))):
+                    continue
+                # interpolation error, checked at the midpoint of every grid interval
+                T_mid = np.sqrt(T_grid[:-1]*T_grid[1:])
+                F_mid = F[:-1] + interval_integrals(record, T_grid[:-1], T_mid)
+                F_interp = monotone_hermite(np.log(T_grid), F, k*T_grid)(np.log(T_mid))
+            names.append(mat)
+            offsets.append(offsets[-1]+len(T_grid))
+            T_all.append(T_grid)
+            F_all.append(F)
+            k_all.append(k)
+            err_all.append(np.max(np.abs(F_interp-F_mid)))
+        return cls(names, np.array(offsets), np.concatenate(T_all), np.concatenate(F_all),
+                   np.concatenate(k_all), np.array(err_all), source_hash)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as tables:
+            return cls(tables["names"], tables["offsets"], tables["T"], tables["F"], tables["k"],
+                       tables["err"], tables["source_hash"])
+
+    def save(self, path):
+        with open(path, "wb") as file: # a file object keeps numpy from appending .npz to the name
+            np.savez_compressed(file, names=np.array(self.names), offsets=self.offsets, T=self.T, F=self.F,
+                                k=self.k, err=self.err, source_hash=np.array(self.source_hash))
+
+    def __contains__(self, mat):
+        return mat in self.index
+
+    def table_range(self, mat):
+        """
+        Returns: lowest and highest tabulated temperature (K) of the material
+        """
+        i = self.index[mat]
+        return self.T[self.offsets[i]], self.T[self.offsets[i+1]-1]
+
+    def interpolant(self, mat):
+        if mat not in self.interpolants:
+            i = self.index[mat]
+            start, stop = self.offsets[i], self.offsets[i+1]
+            T_grid = self.T[start:stop]
+            self.interpolants[mat] = monotone_hermite(np.log(T_grid), self.F[start:stop], self.k[start:stop]*T_grid)
+        return self.interpolants[mat]
+
+    def integral(self, mat, T_low, T_high):
+        """
+        Function: F(T_high) - F(T_low) for one material (T_low and T_high may be arrays).
+
+        Returns: ConInt, err - ConInt is nan where a bound is outside the tabulated range
+        """
+        F = self.interpolant(mat)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            ConInt = F(np.log(T_high)) - F(np.log(T_low))
+        return ConInt, 2*self.err[self.index[mat]]
@@ -0,0 +1,138 @@
+## Figure rendering for the fit and material plots
+## Author: Henry Nachman
+## Description: Figures are drawn with the object-oriented matplotlib API on an Agg canvas (no pyplot
+## state, so they can be drawn in worker processes), saved as 300 dpi pdfs (with quick png previews next
+## to them if asked), and only redrawn when the data, fit parameters or plotting code they are drawn from
+## have changed.
+
+import numpy as np
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+import os, json, hashlib
+from functools import lru_cache
+from concurrent.futures import ProcessPoolExecutor
+
+code_dir = os.path.dirname(os.path.abspath(__file__))
+
+PLOT_MANIFEST = "plot_manifest.json" # written to each plots folder, the digest of every figure saved there
+PLOT_CODE = ("tc_plotting.py", "tc_utils.py", "fit_types.py") # files whose changes require a redraw
+PDF_DPI = 300
+PREVIEW_DPI = 72
+
+
+def new_figure(figsize=None):
+    """
+    Returns: an empty Figure on its own Agg canvas
+    """
+    figure = Figure(figsize=figsize)
+    FigureCanvasAgg(figure)
+    return figure
+
+def figure_file(name, preview=False):
+    """
+    Returns: the file name of a figure - a pdf, or a png preview
+    """
+    return f"{name}.png" if preview else f"{name}.pdf"
+
+def figure_formats(preview=False):
+    """
+    Returns: the preview flag of every file a figure is saved as - the pdf, and the png preview if preview
+    """
+    return [False, True] if preview else [False]
+
+def save_figure(figure, plots_dir, name, preview=False):
+    """
+    Function: saves a figure in plots_dir as a 300 dpi pdf, or as a low resolution png if preview.
+
+    Returns: path of the saved file
+    """
+    path = f"{plots_dir}{os.sep}{figure_file(name, preview)}"
+    if preview:
+        figure.savefig(path, dpi=PREVIEW_DPI, format="png", bbox_inches='tight')
+    else:
+        figure.savefig(path, dpi=PDF_DPI, format="pdf", bbox_inches='tight')
+    return path
+
+@lru_cache(maxsize=None)
+def code_version(files=PLOT_CODE):
+    """
+    Returns: sha1 hex digest of the plotting code (read once per process)
+    """
+    sha = hashlib.sha1()
+    for file in files:
+        with open(f"{code_dir}{os.sep}{file}", "rb") as code_file:
+            sha.update(code_file.read())
+    return sha.hexdigest()
+
+def digest_default(obj):
+    # arrays are hashed rather than written out, so large data sets digest quickly
+    if isinstance(obj, np.ndarray):
+        return [str(obj.dtype), list(obj.shape), hashlib.sha1(np.ascontiguousarray(obj).tobytes()).hexdigest()]
+    if isinstance(obj, np.generic):
+        return obj.item()
+    return str(obj)
+
+def figure_digest(inputs, code=PLOT_CODE):
+    """
+    Returns: sha1 hex digest of everything a figure is drawn from - its inputs and the plotting code
+    """
+    return hashlib.sha1((code_version(tuple(code)) + json.dumps(inputs, default=digest_default)).encode()).hexdigest()
+
+def read_manifest(plots_dir):
+    try:
+        with open(f"{plots_dir}{os.sep}{PLOT_MANIFEST}", "r") as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return dict()
+
+def is_current(plots_dir, name, digest, preview=False):
+    """
+    Returns: True if the figure exists and was drawn from inputs with this digest
+    """
+    file = figure_file(name, preview)
+    return os.path.exists(f"{plots_dir}{os.sep}{file}") and read_manifest(plots_dir).get(file) == digest
+
+def record(plots_dir, name, digest, formats=(False,)):
+    manifest = read_manifest(plots_dir)
+    for fmt in formats:
+        manifest[figure_file(name, fmt)] = digest
+    with open(f"{plots_dir}{os.sep}{PLOT_MANIFEST}", "w") as file:
+        json.dump(manifest, file, indent=4, sort_keys=True)
+
+def draw_if_changed(draw, plots_dir, name, inputs, preview=False, force=False, code=PLOT_CODE):
+    """
+    Function: draws and saves a figure, unless it was already saved from the same inputs and code. Each
+    file (the pdf, and the png preview) has its own manifest entry, and only the stale files are written.
+
+    Arguments:
+    - draw: function returning the Figure, only called if the figure has to be redrawn
+    - plots_dir: str. Folder the figure is saved in
+    - name: str. File name of the figure, without extension
+    - inputs: everything the figure is drawn from (json-able, arrays allowed)
+    - preview: bool. If True, a png preview is saved next to the pdf
+    - force: bool. If True, the figure is redrawn whatever its manifest says
+    - code: files of the code drawing the figure
+
+    Returns: True if the figure was drawn
+    """
+    digest = figure_digest([name, inputs], code)
+    stale = [fmt for fmt in figure_formats(preview) if force or not is_current(plots_dir, name, digest, fmt)]
+    if not stale:
+        return False
+    figure = draw()
+    for fmt in stale:
+        save_figure(figure, plots_dir, name, fmt)
+    record(plots_dir, name, digest, stale)
+    return True
+
+def run_plot_tasks(plot_func, tasks, jobs=1):
+    """
+    Function: calls plot_func on the arguments of every task, in a pool of jobs processes if jobs > 1.
+    Tasks writing to the same plots folder must not run in parallel (they share its manifest).
+
+    Returns: list of the results, in the order of tasks
+    """
+    if jobs <= 1 or len(tasks) <= 1:
+        return [plot_func(*task) for task in tasks]
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        return list(executor.map(plot_func, *zip(*tasks)))
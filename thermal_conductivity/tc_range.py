@@ -0,0 +1,236 @@
+## Out-of-range policies for the thermal conductivity fits
+## Author: Henry Nachman
+## Description: Decides what happens when a conductivity or conductivity integral is requested
+## outside the temperature range of a material's fit. Policies are applied with masks over whole
+## arrays, and out-of-range requests are reported as a single summary per call.
+
+import numpy as np
+import os, sys, warnings
+
+abspath = os.path.abspath(__file__)
+sys.path.insert(0, os.path.dirname(abspath))
+
+from tc_integrals import conductivity_integral, conductivity_integrals
+
+# ignore      - evaluate the fit as is, silently
+# warn        - evaluate the fit as is, with one RangeWarning per call
+# warn-once   - as warn, but only the first time for each material
+# nan         - nan outside the fit range
+# clip        - the value at the nearest end of the fit range
+# raise       - raise an OutOfRangeError
+# extrapolate - continue the fit with a power law matched to the fit at the end of its range
+RANGE_POLICIES = ["ignore", "warn", "warn-once", "nan", "clip", "raise", "extrapolate"]
+
+warned_materials = set() # materials already reported by the warn-once policy
+
+
+class RangeWarning(UserWarning):
+    pass
+
+class OutOfRangeError(ValueError):
+    pass
+
+
+def check_policy(policy):
+    if policy not in RANGE_POLICIES:
+        raise ValueError(f"Unknown range policy '{policy}', choose from {RANGE_POLICIES}")
+
+def range_masks(T, fit_range):
+    """
+    Returns: below, above - boolean masks of the temperatures outside the fit range
+    """
+    return T < fit_range[0], T > fit_range[1]
+
+def range_summary(material, T, fit_range, below, above):
+    """
+    Returns: one line describing every out-of-range temperature of a call
+    """
+    n_out = int(np.sum(below) + np.sum(above))
+    T_out = T[below | above]
+    return (f"{n_out} of {T.size} requested temperatures ({np.min(T_out):.4g} to {np.max(T_out):.4g} K) are outside "
+            f"the {material} fit range [{fit_range[0]:.4g}, {fit_range[1]:.4g}] K - estimation success not guaranteed")
+
+def report(policy, material, T, fit_range, below, above, stacklevel=4):
+    """
+    Function: reports out-of-range temperatures according to the policy (nothing if all are in range).
+    """
+    if not (np.any(below) or np.any(above)):
+        return
+    if policy == "raise":
+        raise OutOfRangeError(range_summary(material, T, fit_range, below, above))
+    if policy == "warn" or (policy == "warn-once" and material not in warned_materials):
+        if policy == "warn-once":
+            warned_materials.add(material)
+        warnings.warn(range_summary(material, T, fit_range, below, above), RangeWarning, stacklevel=stacklevel)
+
+def check_bounds(record, T, policy, material=None):
+    """
+    Function: reports the temperatures outside the fit range of a material according to the policy.
+    """
+    T = np.asarray(T, dtype=float)
+    below, above = range_masks(T, record.fit_range)
+    report(policy, record.name if material is None else material, T, record.fit_range, below, above)
+
+def power_law_tail(record, T_bound, side, decades=0.1, n_points=8):
+    """
+    Function: fits the power law k = k(T_bound)*(T/T_bound)**n to the last decades of the fit,
+    anchored at the end of the fit range so the extrapolation is continuous.
+
+    Arguments:
+    - record: MaterialRecord of the material
+    - T_bound: float. The end of the fit range in Kelvin (> 0)
+    - side: str. "low" or "high" end of the fit range
+
+    Returns: k_bound, n
+    """
+    sign = 1 if side == "low" else -1
+    T_fit = T_bound*np.logspace(0, sign*decades, n_points)
+    with np.errstate(all="ignore"):
+        k_fit = np.asarray(record.evaluate(T_fit), dtype=float)
+    k_bound = k_fit[0]
+    valid = np.isfinite(k_fit) & (k_fit > 0)
+    if np.sum(valid) < 2 or not valid[0]:
+        return k_bound, np.nan
+    n = np.polyfit(np.log(T_fit[valid]/T_bound), np.log(k_fit[valid]/k_bound), 1)[0]
+    return k_bound, n
+
+def evaluate(record, T, policy="warn", material=None):
+    """
+    Function: evaluates the fit of a material, applying the range policy to out-of-range temperatures.
+
+    Arguments:
+    - record: MaterialRecord of the material
+    - T: float or array. Temperatures in Kelvin
+    - policy: str. One of RANGE_POLICIES
+    - material: (optional) str. Name used in reports, record.name by default
+
+    Returns: k, thermal conductivity in W/m/K (same shape as T)
+    """
+    check_policy(policy)
+    material = record.name if material is None else material
+    if policy == "ignore":
+        return record.evaluate(T)
+    T_arr = np.asarray(T, dtype=float)
+    fit_range = record.fit_range
+    below, above = range_masks(T_arr, fit_range)
+    report(policy, material, T_arr, fit_range, below, above)
+    if policy in ("warn", "warn-once", "raise") or not (np.any(below) or np.any(above)):
+        return record.evaluate(T)
+
+    k = np.array(record.evaluate(np.clip(T_arr, fit_range[0], fit_range[1])), dtype=float)
+    if policy == "nan":
+        k[below | above] = np.nan
+    elif policy == "extrapolate":
+        for side, mask, T_bound in (("low", below, fit_range[0]), ("high", above, fit_range[1])):
+            if np.any(mask):
+                k_bound, n = power_law_tail(record, T_bound, side)
+                k[mask] = k_bound*(T_arr[mask]/T_bound)**n
+    return k[()]
+
+def tail_integral(k_bound, n, T_bound, T_1, T_2):
+    """
+    Returns: the integral of k_bound*(T/T_bound)**n from T_1 to T_2
+    """
+    if n == -1:
+        return k_bound*T_bound*np.log(T_2/T_1)
+    return k_bound*T_bound/(n+1)*((T_2/T_bound)**(n+1) - (T_1/T_bound)**(n+1))
+
+def integral(record, T_low, T_high, policy="warn", method="auto", tables=None, material=None):
+    """
+    Function: integrates the fit of a material from T_low to T_high, applying the range policy to the
+    parts of the interval outside the fit range (clip integrates the end values, extrapolate the power
+    law tails).
+
+    Returns: ConInt, err - the integral in W/m and its estimated absolute error
+    """
+    check_policy(policy)
+    material = record.name if material is None else material
+    if policy == "ignore":
+        return conductivity_integral(record, T_low, T_high, method=method, tables=tables)
+    T_low, T_high = float(T_low), float(T_high)
+    if T_low > T_high:
+        ConInt, err = integral(record, T_high, T_low, policy, method, tables, material)
+        return -ConInt, err
+
+    T_bounds = np.array([T_low, T_high])
+    fit_range = record.fit_range
+    below, above = range_masks(T_bounds, fit_range)
+    report(policy, material, T_bounds, fit_range, below, above)
+    if policy in ("warn", "warn-once", "raise") or not (np.any(below) or np.any(above)):
+        return conductivity_integral(record, T_low, T_high, method=method, tables=tables)
+    if policy == "nan":
+        return np.nan, np.nan
+
+    T_in_low, T_in_high = np.clip(T_bounds, fit_range[0], fit_range[1])
+    ConInt, err = conductivity_integral(record, T_in_low, T_in_high, method=method, tables=tables)
+    for side, T_bound, T_1, T_2 in (("low", fit_range[0], T_low, T_in_low), ("high", fit_range[1], T_in_high, T_high)):
+        if T_1 == T_2:
+            continue
+        if policy == "clip":
+            ConInt += float(record.evaluate(T_bound))*(T_2 - T_1)
+        else:
+            k_bound, n = power_law_tail(record, T_bound, side)
+            ConInt += tail_integral(k_bound, n, T_bound, T_1, T_2)
+    return ConInt, err
+
+def integrals(record, T_lows, T_highs, policy="warn", method="auto", tables=None, material=None):
+    """
+    Function: integral over many temperature intervals of one material. Intervals inside the fit
+    range are integrated together (tc_integrals.conductivity_integrals), out-of-range bounds are
+    reported in one summary.
+
+    Returns: ConInt, err - arrays of the integrals in W/m and their estimated absolute errors
+    """
+    check_policy(policy)
+    material = record.name if material is None else material
+    T_lows, T_highs = np.broadcast_arrays(np.asarray(T_lows, dtype=float), np.asarray(T_highs, dtype=float))
+    if policy == "ignore":
+        return conductivity_integrals(record, T_lows, T_highs, method=method, tables=tables)
+    T_bounds = np.concatenate((T_lows.ravel(), T_highs.ravel()))
+    below, above = range_masks(T_bounds, record.fit_range)
+    report(policy, material, T_bounds, record.fit_range, below, above)
+    if policy in ("warn", "warn-once", "raise"):
+        return conductivity_integrals(record, T_lows, T_highs, method=method, tables=tables)
+
+    outside = (below | above).reshape(2, -1).any(axis=0).reshape(T_lows.shape)
+    ConInt, err = np.empty(T_lows.shape), np.empty(T_lows.shape)
+    ConInt[~outside], err[~outside] = conductivity_integrals(record, T_lows[~outside], T_highs[~outside], method=method, tables=tables)
+    for i in zip(*np.nonzero(outside)):
+        ConInt[i], err[i] = integral(record, T_lows[i], T_highs[i], policy, method, tables, material)
+    return ConInt, err
+
+def evaluate_many(registry, materials, T, policy="ignore"):
+    """
+    Function: registry.evaluate_many with the range policy applied to every material.
+    Out-of-range temperatures of all materials are reported in one summary.
+
+    Returns: (M, N) array of thermal conductivities in W/m/K ((M,) if T is a float)
+    """
+    check_policy(policy)
+    k_vals = registry.evaluate_many(materials, T)
+    if policy == "ignore":
+        return k_vals
+    T_arr = np.asarray(T, dtype=float)
+    fit_ranges = np.array([registry[mat].fit_range for mat in materials]).reshape((-1, 2) + (1,)*T_arr.ndim)
+    below, above = T_arr < fit_ranges[:, 0], T_arr > fit_ranges[:, 1]
+    out_rows = np.flatnonzero(np.any((below | above).reshape(len(materials), -1), axis=1))
+    if len(out_rows) == 0:
+        return k_vals
+
+    if policy == "raise" or policy.startswith("warn"):
+        reported = [materials[i] for i in out_rows if policy != "warn-once" or materials[i] not in warned_materials]
+        if reported:
+            n_out = int(np.sum(below | above))
+            message = (f"{n_out} requested values are outside the fit ranges of {', '.join(reported)}"
+                       " - estimation success not guaranteed")
+            if policy == "raise":
+                raise OutOfRangeError(message)
+            if policy == "warn-once":
+                warned_materials.update(reported)
+            warnings.warn(message, RangeWarning, stacklevel=3)
+    elif policy == "nan":
+        k_vals[below | above] = np.nan
+    else:
+        for i in out_rows:
+            k_vals[i] = evaluate(registry[materials[i]], T_arr, policy)
+    return k_vals
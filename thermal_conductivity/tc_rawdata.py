@@ -0,0 +1,313 @@
+## Columnar loading of the RAW thermal conductivity measurements
+## Author: Henry Nachman
+## Description: Reads the RAW csv files of a material (a reference row, a column header row and
+## a numeric block of T, k, k/T) into one contiguous array with a per-row reference index.
+## Run this file to pack the RAW data of the whole library into a single store (raw_store.npz),
+## which parse_raw reads instead of the csv files of every material whose RAW folder is unchanged.
+
+import numpy as np
+import os, re, json
+
+abspath = os.path.abspath(__file__)
+path_to_lib = f"{os.path.dirname(abspath)}{os.sep}lib"
+raw_store_path = f"{os.path.dirname(abspath)}{os.sep}raw_store.npz"
+
+# Columns of RawData.data
+RAW_COLUMNS = ["T", "k", "koT", "weight"]
+
+
+class RawData:
+    """
+    Description : The RAW measurements of a material, stored as one (N, 4) array of T, k, k/T and weight
+    with the rows of each reference contiguous.
+
+    Behaves like the dictionary of measurements parse_raw used to return: iterating gives the reference
+    names and raw[ref_name] is the (n, 4) block of that reference - a view, not a copy.
+
+    Arguments :
+    - data       - (N, 4) array of T, k, k/T and weight
+    - ref_index  - (N,) index into references of the reference of each row
+    - references - reference names (the csv file names without extension)
+    - headers    - reference row of each csv file (array of strings)
+    - source     - "csv" or "store", where the measurements were read from
+    """
+    def __init__(self, data, ref_index, references, headers, source="csv"):
+        self.source = source
+        self.data = data
+        self.ref_index = ref_index
+        self.references = list(references)
+        self.headers = list(headers)
+        self.offsets = np.searchsorted(ref_index, np.arange(len(self.references)+1))
+        self.index = {ref_name: i for i, ref_name in enumerate(self.references)}
+
+    @property
+    def T(self):
+        return self.data[:, 0]
+
+    @property
+    def k(self):
+        return self.data[:, 1]
+
+    @property
+    def koT(self):
+        return self.data[:, 2]
+
+    @property
+    def weights(self):
+        return self.data[:, 3]
+
+    def __getitem__(self, ref_name):
+        i = self.index[ref_name]
+        return self.data[self.offsets[i]:self.offsets[i+1]]
+
+    def __contains__(self, ref_name):
+        return ref_name in self.index
+
+    def __iter__(self):
+        return iter(self.references)
+
+    def __len__(self):
+        return len(self.references)
+
+    def keys(self):
+        return list(self.references)
+
+    def items(self):
+        return [(ref_name, self[ref_name]) for ref_name in self.references]
+
+    def references_text(self, raw_files):
+        """
+        Returns: the contents of the references.txt file listing each csv file and its reference row
+        """
+        return "".join(f"{file}\n{header}\n \n" for file, header in zip(raw_files, self.headers))
+
+
+def read_raw_file(path):
+    """
+    Function: reads one RAW csv file - its reference row as strings and its numeric block as floats
+    (the second row holds the column names and is skipped).
+
+    Returns: header, values - array of strings and (n, m) float array
+    """
+    header = np.loadtxt(path, dtype=str, delimiter=',', max_rows=1)
+    values = np.loadtxt(path, dtype=float, delimiter=',', skiprows=2, ndmin=2)
+    if values.size == 0:
+        values = values.reshape(0, np.size(header))
+    return header, values
+
+def year_weights(ref_name, n_rows, weight_const=0):
+    """
+    Returns: the weight of each measurement of a reference, reduced by weight_const per year of age
+    (the year is the last 4 characters of the reference name), and never negative
+    """
+    if weight_const == 0:
+        return np.ones(n_rows)
+    weight = 1-(weight_const*(2024-int(ref_name[-4:])))
+    return np.full(n_rows, max(weight, 0))
+
+def load_raw(raw_directory, weight_const=0, material_name=None, use_store=True):
+    """
+    Function: loads every RAW csv file of a material folder, concatenating the measurements once.
+    If the material is in the RAW store and its folder is unchanged since, it is read from the store instead.
+
+    Arguments :
+    - raw_directory - path of the RAW folder
+    - weight_const  - default=0 - loss of weight per year of age of the measurement (see year_weights)
+    - material_name - default=None - name of the material in the RAW store (the store is not used if None)
+    - use_store     - default=True - Boolean argument, if false, the csv files are always read
+
+    Returns : raw, raw_files - RawData of the measurements and the names of the csv files read
+    """
+    if use_store and material_name is not None:
+        store = get_raw_store()
+        if store is not None and store.is_fresh(material_name, raw_directory):
+            return store.material(material_name, weight_const)
+
+    raw_files, headers, blocks = [], [], []
+    for f in [file for file in os.listdir(raw_directory) if file.endswith(".csv")]:
+        f_path = raw_directory + os.sep + f
+        try:
+            header, values = read_raw_file(f_path)
+        except ValueError:
+            print(f_path)
+            continue
+        weights = year_weights(f[:-4], len(values), weight_const)
+        raw_files.append(f)
+        headers.append(header)
+        blocks.append(np.column_stack((values, weights)))
+
+    data = np.concatenate(blocks) if blocks else np.empty((0, 4), float)
+    ref_index = np.repeat(np.arange(len(blocks)), [len(block) for block in blocks])
+    return RawData(data, ref_index, [f[:-4] for f in raw_files], headers), raw_files
+
+def update_references(raw_directory, raw, raw_files):
+    """
+    Function: rewrites references.txt in the RAW folder, only if it is missing or no longer matches the csv files.
+
+    Returns: True if the file was written
+    """
+    text = raw.references_text(raw_files)
+    path = f"{raw_directory}{os.sep}references.txt"
+    try:
+        with open(path, "r") as file:
+            if file.read() == text:
+                return False
+    except (OSError, UnicodeDecodeError):
+        pass
+    with open(path, "w") as file:
+        file.write(text)
+    return True
+
+
+def reference_year(ref_name):
+    """
+    Returns: the first 4 digit number of a reference name (its year), or -1
+    """
+    match = re.search(r"\d{4}", ref_name)
+    return int(match.group()) if match else -1
+
+def folder_fingerprint(raw_directory):
+    """
+    Returns: string of the name, size and modification time of every csv file of a RAW folder (no file is opened)
+    """
+    entries = sorted((entry.name, entry.stat().st_size, entry.stat().st_mtime_ns)
+                     for entry in os.scandir(raw_directory) if entry.name.endswith(".csv"))
+    return json.dumps(entries)
+
+
+class RawStore:
+    """
+    Description : The RAW measurements of every material of the library in one set of columns.
+
+    Rows are grouped by material, and by reference within each material, so a material or a reference
+    is a slice given by the offsets.
+
+    Arguments :
+    - arrays - dictionary of the arrays below (as written by save)
+      - materials, fingerprints        - material names and the folder_fingerprint of their RAW folder (M)
+      - material_offsets               - first reference of each material (M+1)
+      - references, raw_files, headers - reference names, csv file names and json reference rows (R)
+      - years                          - year of each reference (R)
+      - reference_offsets              - first row of each reference (R+1)
+      - data                           - T, k and k/T of every measurement (N, 3)
+      - material, reference, year      - material index, reference index and year of every measurement (N)
+    """
+    def __init__(self, arrays):
+        self.arrays = arrays
+        self.materials = [str(mat) for mat in arrays["materials"]]
+        self.index = {mat: i for i, mat in enumerate(self.materials)}
+
+    @classmethod
+    def build(cls, path_to_lib=path_to_lib):
+        """
+        Function: reads the RAW csv files of every material of the library (and refreshes their references.txt).
+
+        Returns: RawStore
+        """
+        materials, fingerprints, material_offsets = [], [], [0]
+        references, raw_files, headers, reference_offsets, blocks = [], [], [], [0], []
+        for mat in os.listdir(path_to_lib):
+            raw_directory = f"{path_to_lib}{os.sep}{mat}{os.sep}RAW"
+            if not os.path.isdir(raw_directory):
+                continue
+            raw, files = load_raw(raw_directory, use_store=False)
+            update_references(raw_directory, raw, files)
+            materials.append(mat)
+            fingerprints.append(folder_fingerprint(raw_directory))
+            material_offsets.append(material_offsets[-1]+len(raw))
+            for ref_name, file, header in zip(raw.references, files, raw.headers):
+                references.append(ref_name)
+                raw_files.append(file)
+                headers.append(json.dumps(np.atleast_1d(header).tolist()))
+                reference_offsets.append(reference_offsets[-1]+len(raw[ref_name]))
+            blocks.append(raw.data[:, :3])
+
+        reference_offsets = np.array(reference_offsets)
+        years = np.array([reference_year(ref_name) for ref_name in references], dtype=int)
+        ref_lengths = np.diff(reference_offsets)
+        ref_material = np.repeat(np.arange(len(materials)), np.diff(material_offsets))
+        return cls({"materials":         np.array(materials, dtype=str),
+                    "fingerprints":      np.array(fingerprints, dtype=str),
+                    "material_offsets":  np.array(material_offsets),
+                    "references":        np.array(references, dtype=str),
+                    "raw_files":         np.array(raw_files, dtype=str),
+                    "headers":           np.array(headers, dtype=str),
+                    "years":             years,
+                    "reference_offsets": reference_offsets,
+                    "data":              np.concatenate(blocks) if blocks else np.empty((0, 3)),
+                    "material":          np.repeat(ref_material, ref_lengths).astype(np.int32),
+                    "reference":         np.repeat(np.arange(len(references)), ref_lengths).astype(np.int32),
+                    "year":              np.repeat(years, ref_lengths).astype(np.int32)})
+
+    def save(self, path=raw_store_path):
+        np.savez(path, **self.arrays)
+
+    @classmethod
+    def load(cls, path=raw_store_path):
+        with np.load(path) as arrays:
+            return cls({key: arrays[key] for key in arrays.files})
+
+    def __contains__(self, mat):
+        return mat in self.index
+
+    def rows(self, mat):
+        """
+        Returns: the slice of the rows of a material
+        """
+        i = self.index[mat]
+        ref_offsets = self.arrays["reference_offsets"]
+        material_offsets = self.arrays["material_offsets"]
+        return slice(ref_offsets[material_offsets[i]], ref_offsets[material_offsets[i+1]])
+
+    def is_fresh(self, mat, raw_directory):
+        """
+        Returns: True if the material is in the store and its RAW folder is unchanged since the store was built
+        """
+        return mat in self.index and self.arrays["fingerprints"][self.index[mat]] == folder_fingerprint(raw_directory)
+
+    def material(self, mat, weight_const=0):
+        """
+        Returns: raw, raw_files - RawData of the measurements of a material and the names of its csv files (as load_raw)
+        """
+        i = self.index[mat]
+        refs = slice(self.arrays["material_offsets"][i], self.arrays["material_offsets"][i+1])
+        rows = self.rows(mat)
+        references = [str(ref_name) for ref_name in self.arrays["references"][refs]]
+        ref_index = self.arrays["reference"][rows] - refs.start
+        weights = np.concatenate([year_weights(ref_name, n_rows, weight_const) for ref_name, n_rows
+                                  in zip(references, np.diff(self.arrays["reference_offsets"][refs.start:refs.stop+1]))] + [np.zeros(0)])
+        data = np.column_stack((self.arrays["data"][rows], weights))
+        headers = [np.array(json.loads(header), dtype=str) for header in self.arrays["headers"][refs]]
+        raw_files = [str(file) for file in self.arrays["raw_files"][refs]]
+        return RawData(data, ref_index, references, headers, source="store"), raw_files
+
+
+raw_store = None # RawStore loaded by get_raw_store
+raw_store_stat = None
+
+def get_raw_store(path=raw_store_path):
+    """
+    Returns: the RawStore at path (loaded once, and again if the file changes), or None if there is none
+    """
+    global raw_store, raw_store_stat
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    if raw_store is None or raw_store_stat != (stat.st_mtime_ns, stat.st_size):
+        raw_store = RawStore.load(path)
+        raw_store_stat = (stat.st_mtime_ns, stat.st_size)
+    return raw_store
+
+def build_raw_store(path_to_lib=path_to_lib, path=raw_store_path):
+    """
+    Function: packs the RAW data of every material of the library into the store at path.
+    """
+    store = RawStore.build(path_to_lib)
+    store.save(path)
+    print(f"Packed {len(store.arrays['data'])} measurements of {len(store.materials)} materials into {path}")
+    return store
+
+
+if __name__ == "__main__":
+    build_raw_store()
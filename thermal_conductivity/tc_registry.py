@@ -0,0 +1,314 @@
+## In-memory registry of the compiled thermal conductivity fits
+## Author: Henry Nachman
+## Description: Parses a compilation file (tc_fullrepo_<date>.csv) once and stores
+## one compact record per material, so repeated lookups skip the string parsing.
+
+import numpy as np
+import os, sys, hashlib, json
+
+abspath = os.path.abspath(__file__)
+sys.path.insert(0, os.path.dirname(abspath))
+
+from fit_types import get_func_type, get_stacked_func_type
+
+# Fit types whose parameters are stored highest order first (ready for np.polyval)
+POLY_FIT_TYPES = ["Nppoly", "polylog", "comppoly"]
+
+
+def file_hash(path):
+    """
+    Returns: the sha1 hex digest of the file contents, used to tie derived files to a compilation file.
+    """
+    with open(path, "rb") as file:
+        return hashlib.sha1(file.read()).hexdigest()
+
+
+def param_columns(headers):
+    """
+    Function: finds which compilation file columns hold the low, high and erf parameters.
+
+    Arguments:
+    - headers: (array) the header row of the compilation file
+
+    Returns: low_cols, hi_cols, erf_col, mult_col - column indices (erf_col and mult_col are None if absent)
+    """
+    low_cols, hi_cols, erf_col, mult_col = [], [], None, None
+    for i in range(5, len(headers)):
+        key = headers[i]
+        if key == "erf param":
+            erf_col = i
+        elif key == "erf multiplicity":
+            mult_col = i
+        elif key.islower():
+            low_cols.append(i)
+        elif key.isupper():
+            hi_cols.append(i)
+    return low_cols, hi_cols, erf_col, mult_col
+
+
+def parse_row(mat_row, low_cols, hi_cols, erf_col, mult_col=None):
+    """
+    Function: converts a single row of the compilation file into fit parameters.
+
+    Arguments:
+    - mat_row: (array) row of strings from the compilation file
+    - low_cols, hi_cols, erf_col, mult_col: column indices from param_columns()
+
+    Returns: fit_type, fit_range, low_param, hi_param, erf_param, erf_multiplicity (0 for the default blend)
+    """
+    fit_type = str(mat_row[1])
+    fit_params = np.char.replace(np.asarray(mat_row, dtype=str), "^", "0")
+    fit_range = np.array(mat_row[2:4], dtype=float)
+    low_param = np.array(fit_params[low_cols], dtype=float)
+    hi_param = np.array(fit_params[hi_cols], dtype=float)
+    erf_param = float(fit_params[erf_col]) if erf_col is not None else 0.0
+    erf_multiplicity = float(fit_params[mult_col]) if mult_col is not None else 0.0
+
+    # materials with fewer parameters than the widest fit are padded with trailing 0s, so we remove those
+    low_param = np.trim_zeros(low_param, "b")
+    hi_param = np.trim_zeros(hi_param, "b")
+    if fit_type in POLY_FIT_TYPES:
+        low_param = low_param[::-1].copy()
+        hi_param = hi_param[::-1].copy()
+    return fit_type, fit_range, low_param, hi_param, erf_param, erf_multiplicity
+
+
+class MaterialRecord:
+    """
+    Description : The fit of a single material, stored as float arrays.
+
+    Can be passed directly to the functions in fit_types in place of a param_dictionary.
+    """
+    __slots__ = ("name", "fit_type", "fit_range", "low_param", "hi_param", "erf_param", "erf_multiplicity", "func")
+
+    def __init__(self, name, fit_type, fit_range, low_param, hi_param, erf_param, erf_multiplicity=0.0):
+        self.name = name
+        self.fit_type = fit_type
+        self.fit_range = fit_range
+        self.low_param = low_param
+        self.hi_param = hi_param
+        self.erf_param = erf_param
+        self.erf_multiplicity = erf_multiplicity # 0 for the default comppoly blend
+        try:
+            self.func = get_func_type(fit_type)
+        except KeyError:
+            self.func = None # unknown fit types only fail when evaluated
+
+    def __getitem__(self, key):
+        if key not in self.__slots__:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __repr__(self):
+        return f"MaterialRecord({self.name!r}, {self.fit_type!r}, fit_range={self.fit_range.tolist()})"
+
+    def as_dict(self):
+        """
+        Returns: the record in the param_dictionary format produced by tc_tools.get_parameters
+        """
+        return {"fit_type":  self.fit_type,
+                "fit_range": self.fit_range,
+                "low_param": self.low_param.tolist(),
+                "hi_param":  self.hi_param.tolist(),
+                "erf_param": self.erf_param,
+                "erf_multiplicity": self.erf_multiplicity}
+
+    def evaluate(self, T):
+        """
+        Returns: the thermal conductivity (W/m/K) of the material at T (K).
+        """
+        func = self.func if self.func is not None else get_func_type(self.fit_type)
+        return func(T, self)
+
+
+class MaterialRegistry:
+    """
+    Description : Dictionary-like collection of MaterialRecords built once from a compilation file.
+
+    Arguments :
+    - TCdata - array of strings of the imported compilation file (header row included)
+    - source - (optional) path of the file the array was loaded from
+    """
+    def __init__(self, TCdata, source=None):
+        self.source = source
+        self.records = dict()
+        headers = TCdata[0]
+        columns = param_columns(headers)
+        for mat_row in TCdata[1:]:
+            mat = str(mat_row[0])
+            if mat in self.records:
+                continue # keep the first occurrence, as get_parameters does
+            try:
+                fit_type, fit_range, low_param, hi_param, erf_param, erf_multiplicity = parse_row(mat_row, *columns)
+            except ValueError:
+                continue # separator rows (e.g. the flagged materials header of tc_generic)
+            self.records[mat] = MaterialRecord(mat, fit_type, fit_range, low_param, hi_param, erf_param, erf_multiplicity)
+
+    @classmethod
+    def from_csv(cls, path):
+        """
+        Returns: a MaterialRegistry of the compilation csv at path.
+        """
+        TCdata = np.loadtxt(path, dtype=str, delimiter=',')
+        return cls(TCdata, source=path)
+
+    @classmethod
+    def from_records(cls, records, source=None):
+        """
+        Returns: a MaterialRegistry holding the given MaterialRecords (in order).
+        """
+        registry = cls.__new__(cls)
+        registry.source = source
+        registry.records = {record.name: record for record in records}
+        return registry
+
+    def to_arrays(self):
+        """
+        Returns: dictionary of flat arrays describing every record (the inverse of from_arrays),
+        with the low and high parameters concatenated and indexed by offsets.
+        """
+        records = list(self.records.values())
+        low_lengths = [len(r.low_param) for r in records]
+        hi_lengths = [len(r.hi_param) for r in records]
+        return {"names":       np.array([r.name for r in records], dtype=str),
+                "fit_types":   np.array([r.fit_type for r in records], dtype=str),
+                "fit_ranges":  np.array([r.fit_range for r in records], dtype=float).reshape(-1, 2),
+                "erf_params":  np.array([r.erf_param for r in records], dtype=float),
+                "erf_multiplicities": np.array([r.erf_multiplicity for r in records], dtype=float),
+                "low_params":  np.concatenate([r.low_param for r in records] + [np.zeros(0)]),
+                "low_offsets": np.cumsum([0] + low_lengths),
+                "hi_params":   np.concatenate([r.hi_param for r in records] + [np.zeros(0)]),
+                "hi_offsets":  np.cumsum([0] + hi_lengths)}
+
+    @classmethod
+    def from_arrays(cls, arrays, source=None):
+        """
+        Returns: a MaterialRegistry rebuilt from the output of to_arrays, without any text parsing.
+        """
+        low, low_offsets = arrays["low_params"], arrays["low_offsets"]
+        hi, hi_offsets = arrays["hi_params"], arrays["hi_offsets"]
+        # arrays written before the blend sharpness was stored have the default blend
+        erf_multiplicities = arrays["erf_multiplicities"] if "erf_multiplicities" in arrays else np.zeros(len(arrays["names"]))
+        records = [MaterialRecord(str(name), str(fit_type), np.array(fit_range),
+                                  low[low_offsets[i]:low_offsets[i+1]].copy(), hi[hi_offsets[i]:hi_offsets[i+1]].copy(),
+                                  float(erf_param), float(erf_multiplicity))
+                   for i, (name, fit_type, fit_range, erf_param, erf_multiplicity)
+                   in enumerate(zip(arrays["names"], arrays["fit_types"], arrays["fit_ranges"], arrays["erf_params"], erf_multiplicities))]
+        return cls.from_records(records, source)
+
+    def __getitem__(self, mat):
+        try:
+            return self.records[mat]
+        except KeyError:
+            raise KeyError(f"Material '{mat}' not found in the compilation file") from None
+
+    def __contains__(self, mat):
+        return mat in self.records
+
+    def __iter__(self):
+        return iter(self.records)
+
+    def __len__(self):
+        return len(self.records)
+
+    def names(self):
+        return list(self.records)
+
+    def to_structured(self):
+        """
+        Function: packs every record into one fixed-width row of a structured array.
+
+        Returns: catalog, names, fit_types
+        - catalog: structured array with fields fit_code (index into fit_types), fit_range, erf_param,
+          erf_multiplicity, n_low, n_hi and the low_param / hi_param blocks, zero padded to the widest fit
+        - names: material name of each row
+        - fit_types: fit type names, indexed by fit_code
+        """
+        records = list(self.records.values())
+        fit_types = sorted(set(r.fit_type for r in records))
+        n_low = max([len(r.low_param) for r in records] + [1])
+        n_hi = max([len(r.hi_param) for r in records] + [1])
+        dtype = np.dtype([("fit_code", "<i4"), ("fit_range", "<f8", (2,)), ("erf_param", "<f8"), ("erf_multiplicity", "<f8"),
+                          ("n_low", "<i4"), ("n_hi", "<i4"), ("low_param", "<f8", (n_low,)), ("hi_param", "<f8", (n_hi,))])
+        catalog = np.zeros(len(records), dtype=dtype)
+        for row, r in zip(catalog, records):
+            row["fit_code"] = fit_types.index(r.fit_type)
+            row["fit_range"] = r.fit_range
+            row["erf_param"] = r.erf_param
+            row["erf_multiplicity"] = r.erf_multiplicity
+            row["n_low"], row["n_hi"] = len(r.low_param), len(r.hi_param)
+            row["low_param"][:len(r.low_param)] = r.low_param
+            row["hi_param"][:len(r.hi_param)] = r.hi_param
+        return catalog, [r.name for r in records], fit_types
+
+    def save_binary(self, path, source_hash=""):
+        """
+        Function: writes the registry as a memory-mappable .npy structured array (see to_structured)
+        plus a sidecar .json index holding the material names, fit type names and source hash.
+        """
+        catalog, names, fit_types = self.to_structured()
+        np.save(path, catalog)
+        with open(binary_index_path(path), "w") as file:
+            json.dump({"names": names, "fit_types": fit_types, "source_hash": source_hash}, file, indent=1)
+
+    @classmethod
+    def from_binary(cls, path, mmap_mode="r", source=None):
+        """
+        Function: opens a catalog written by save_binary. With mmap_mode="r" the parameters of every
+        record are read-only views into the memory-mapped file, so processes share its pages.
+
+        Returns: MaterialRegistry
+        """
+        catalog = np.load(path, mmap_mode=mmap_mode)
+        index = read_binary_index(path)
+        fit_types = index["fit_types"]
+        has_multiplicity = "erf_multiplicity" in catalog.dtype.names # not in catalogs written before it was stored
+        records = [MaterialRecord(name, fit_types[row["fit_code"]], row["fit_range"],
+                                  row["low_param"][:row["n_low"]], row["hi_param"][:row["n_hi"]], float(row["erf_param"]),
+                                  float(row["erf_multiplicity"]) if has_multiplicity else 0.0)
+                   for name, row in zip(index["names"], catalog)]
+        return cls.from_records(records, source)
+
+    def evaluate_many(self, materials, T):
+        """
+        Function: Finds the thermal conductivity of many materials at many temperatures in one call.
+
+        Materials are grouped by fit type and each group is evaluated with its stacked kernel
+        (see fit_types.get_stacked_func_type); fit types without one are evaluated per material.
+
+        Arguments:
+        - materials: list of material name strings (M)
+        - T: float or array of temperatures in Kelvin (N)
+
+        Returns: (M, N) array of thermal conductivities in W/m/K ((M,) if T is a float)
+        """
+        T = np.asarray(T, dtype=float)
+        T_flat = T.ravel()
+        records = [self[mat] for mat in materials]
+        k_vals = np.empty((len(records), T_flat.size))
+
+        groups = dict()
+        for i, record in enumerate(records):
+            groups.setdefault(record.fit_type, []).append(i)
+        for fit_type, rows in groups.items():
+            kernel = get_stacked_func_type(fit_type)
+            if kernel is None:
+                for i in rows:
+                    k_vals[i] = records[i].evaluate(T_flat)
+            else:
+                k_vals[rows] = kernel(T_flat, [records[i] for i in rows])
+        return k_vals.reshape((len(records),) + T.shape)
+
+
+def binary_index_path(path):
+    """
+    Returns: the sidecar index (.json) path of a binary catalog (.npy)
+    """
+    return f"{os.path.splitext(path)[0]}.json"
+
+def read_binary_index(path):
+    """
+    Returns: the sidecar index of a binary catalog - dict with names, fit_types and source_hash
+    """
+    with open(binary_index_path(path)) as file:
+        return json.load(file)
@@ -5,20 +5,338 @@
 
 import numpy as np
 import os, sys
+from collections import OrderedDict
 
 abspath = os.path.abspath(__file__)
 sys.path.insert(0, os.path.dirname(abspath))
 
 
-from itertools import dropwhile
 from fit_types import get_func_type
+from tc_registry import MaterialRegistry, param_columns, parse_row, file_hash, read_binary_index
+from tc_integrals import conductivity_integral, CumulativeTables
+import tc_range
 
-path_to_tcFiles = f"{os.path.split(abspath)[0]}{os.sep}..{os.sep}"
-all_files = os.listdir(path_to_tcFiles)
-exist_files = [file for file in all_files if file.startswith("tc_fullrepo")]
-tc_file_date = exist_files[0][-12:-4]
+path_to_tcFiles = os.path.normpath(f"{os.path.split(abspath)[0]}{os.sep}..")
+snapshot_folder = ".tc_cache" # binary snapshots of the compilation files, next to the csv files
+range_policy = "warn" # what to do outside a fit's range, see set_range_policy
 
-TCdata = np.loadtxt(f"{path_to_tcFiles}{os.sep}tc_fullrepo_{tc_file_date}.csv", dtype=str, delimiter=',') # imports compilation file csv
+
+def find_catalog(date=None, folder=path_to_tcFiles):
+    """
+    Function: finds a compilation file (tc_fullrepo_<date>.csv).
+
+    Arguments:
+    - date: (optional) str or int, e.g. "20240904". The most recent file is used if None
+    - folder: directory holding the compilation files
+
+    Returns: path to the compilation csv
+    """
+    if date is not None:
+        path = os.path.join(folder, f"tc_fullrepo_{date}.csv")
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"No compilation file tc_fullrepo_{date}.csv in {folder}")
+        return path
+    exist_files = sorted([file for file in os.listdir(folder) if file.startswith("tc_fullrepo") and file.endswith(".csv")])
+    if len(exist_files) == 0:
+        raise FileNotFoundError(f"No tc_fullrepo_<date>.csv compilation file in {folder}")
+    return os.path.join(folder, exist_files[-1])
+
+
+class Catalog:
+    """
+    Description : A compilation file, loaded the first time one of its contents is used.
+
+    The registry is opened from the memory-mapped binary catalog (tc_catalog_<date>.npy) written
+    by compile_TC.py when it matches the csv, so processes share one copy of the parameters.
+    Otherwise the csv is parsed and cached as a binary snapshot (.tc_cache/<file name>.npz),
+    tagged with the modification time, size and sha1 hash of the csv. Later loads read the
+    snapshot instead of parsing the csv, as long as the csv is unchanged.
+
+    Arguments :
+    - path - (optional) path of the compilation csv, the most recent tc_fullrepo file if None
+    - use_snapshot - whether to read and write the binary snapshot
+    - use_binary - whether to memory-map the binary catalog when there is a matching one
+    """
+    def __init__(self, path=None, use_snapshot=True, use_binary=True):
+        self.path = path
+        self.use_snapshot = use_snapshot
+        self.use_binary = use_binary
+        self._TCdata, self._registry, self._source_hash = None, None, None
+        self.tables = None
+        self.stat = None # (mtime, size) of the csv when it was loaded
+
+    @property
+    def date(self):
+        return os.path.basename(self.csv_path)[-12:-4]
+
+    @property
+    def csv_path(self):
+        if self.path is None:
+            self.path = find_catalog()
+        return self.path
+
+    @property
+    def snapshot_path(self):
+        folder, file = os.path.split(self.csv_path)
+        return f"{folder}{os.sep}{snapshot_folder}{os.sep}{file[:-4]}.npz"
+
+    @property
+    def binary_path(self):
+        return f"{os.path.dirname(self.csv_path)}{os.sep}tc_catalog_{self.date}.npy"
+
+    @property
+    def TCdata(self):
+        if self._TCdata is None:
+            self.load()
+        return self._TCdata
+
+    @property
+    def registry(self):
+        if self._registry is None and self.use_binary:
+            self._registry = self.read_binary()
+        if self._registry is None:
+            self.load()
+        return self._registry
+
+    @property
+    def source_hash(self):
+        if self._source_hash is None:
+            stat = os.stat(self.csv_path)
+            self.stat = (stat.st_mtime_ns, stat.st_size)
+            self._source_hash = file_hash(self.csv_path)
+        return self._source_hash
+
+    @property
+    def version(self):
+        """
+        The sha1 of the csv contents, checked against the file on every access (see reload_if_changed).
+        """
+        self.reload_if_changed()
+        return self.source_hash
+
+    def reload_if_changed(self):
+        """
+        Function: forgets everything loaded from the csv if the file changed on disk since, so that it
+        is loaded again on next use.
+
+        Returns: True if the catalog was reset
+        """
+        if self.stat is None:
+            return False
+        stat = os.stat(self.csv_path)
+        if (stat.st_mtime_ns, stat.st_size) == self.stat:
+            return False
+        self._TCdata, self._registry, self._source_hash = None, None, None
+        self.tables = None
+        self.stat = None
+        return True
+
+    def load(self):
+        """
+        Function: loads the compilation file, from its snapshot when the snapshot is up to date.
+        """
+        stat = os.stat(self.csv_path)
+        self.stat = (stat.st_mtime_ns, stat.st_size)
+        if not (self.use_snapshot and self.read_snapshot(stat)):
+            self._TCdata = np.loadtxt(self.csv_path, dtype=str, delimiter=',') # imports compilation file csv
+            if self._registry is None:
+                self._registry = MaterialRegistry(self._TCdata, source=self.csv_path) # parses every material once
+            self._source_hash = file_hash(self.csv_path)
+            if self.use_snapshot:
+                self.write_snapshot(stat)
+
+    def read_binary(self):
+        """
+        Returns: the registry memory-mapped from the binary catalog, or None if it is missing or stale
+        """
+        if not os.path.exists(self.binary_path):
+            return None
+        if read_binary_index(self.binary_path).get("source_hash") != self.source_hash:
+            return None
+        return MaterialRegistry.from_binary(self.binary_path, mmap_mode="r", source=self.csv_path)
+
+    def read_snapshot(self, stat):
+        """
+        Returns: True if the snapshot matches the csv (same mtime and size, or same hash) and was loaded
+        """
+        if not os.path.exists(self.snapshot_path):
+            return False
+        try:
+            with np.load(self.snapshot_path) as snapshot:
+                arrays = {key: snapshot[key] for key in snapshot.files}
+        except (OSError, ValueError, KeyError):
+            return False
+        unchanged = int(arrays["mtime_ns"]) == stat.st_mtime_ns and int(arrays["size"]) == stat.st_size
+        if not unchanged:
+            if str(arrays["source_hash"]) != file_hash(self.csv_path):
+                return False
+            arrays["mtime_ns"] = np.array(stat.st_mtime_ns) # same contents, e.g. after a fresh checkout
+            self.save_arrays(arrays)
+        self._TCdata = arrays["TCdata"]
+        if self._registry is None:
+            self._registry = MaterialRegistry.from_arrays(arrays, source=self.csv_path)
+        self._source_hash = str(arrays["source_hash"])
+        return True
+
+    def write_snapshot(self, stat):
+        arrays = self._registry.to_arrays()
+        arrays.update(TCdata=self._TCdata, source_hash=np.array(self._source_hash),
+                      mtime_ns=np.array(stat.st_mtime_ns), size=np.array(stat.st_size))
+        self.save_arrays(arrays)
+
+    def save_arrays(self, arrays):
+        try:
+            os.makedirs(os.path.dirname(self.snapshot_path), exist_ok=True)
+            with open(self.snapshot_path, "wb") as file:
+                np.savez(file, **arrays)
+        except OSError:
+            pass # read-only checkouts simply parse the csv every time
+
+    def cumulative_tables(self):
+        """
+        Returns: the CumulativeTables (tc_cumint_<date>.npz) written by compile_TC.py for this
+        compilation file, or None if there are none matching its contents.
+        """
+        if self.tables is None:
+            self.tables = False
+            table_path = f"{os.path.dirname(self.csv_path)}{os.sep}tc_cumint_{self.date}.npz"
+            if os.path.exists(table_path):
+                tables = CumulativeTables.load(table_path)
+                if tables.source_hash == self.source_hash:
+                    self.tables = tables
+        return self.tables or None
+
+
+catalog = Catalog()
+
+
+class IntegralCache:
+    """
+    Description : Bounded least-recently-used memo of conductivity integrals.
+
+    Keys are (catalog version, material, T_low, T_high, method, range policy), and the whole cache
+    is cleared when the catalog version changes.
+
+    Arguments :
+    - maxsize - the number of integrals kept (0 disables the cache)
+    """
+    def __init__(self, maxsize=4096):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.version = None
+        self.hits, self.misses = 0, 0
+
+    def get(self, key):
+        """
+        Returns: the cached (ConInt, err) of key, or None
+        """
+        if key[0] != self.version:
+            self.entries.clear()
+            self.version = key[0]
+        value = self.entries.get(key)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self.entries.move_to_end(key)
+        return value
+
+    def put(self, key, value):
+        if self.maxsize <= 0:
+            return
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+    def resize(self, maxsize):
+        self.maxsize = maxsize
+        while len(self.entries) > max(maxsize, 0):
+            self.entries.popitem(last=False)
+
+    def clear(self):
+        self.entries.clear()
+        self.hits, self.misses = 0, 0
+
+    def info(self):
+        return {"hits": self.hits, "misses": self.misses, "size": len(self.entries), "maxsize": self.maxsize}
+
+
+integral_cache = IntegralCache()
+
+
+def set_catalog(date=None, path=None, use_snapshot=True, use_binary=True):
+    """
+    Function: selects the compilation file used by tc_tools, by date or by path.
+    By default the most recent tc_fullrepo_<date>.csv is used. The file is loaded on first use.
+
+    Arguments:
+    - date: (optional) str, e.g. "20240904"
+    - path: (optional) path to a compilation csv, takes priority over date
+    - use_snapshot: bool. Whether to cache the parsed file as a binary snapshot
+    - use_binary: bool. Whether to memory-map the binary catalog (tc_catalog_<date>.npy) if it matches
+
+    Returns: the new Catalog
+    """
+    global catalog
+    if path is None and date is not None:
+        path = find_catalog(date)
+    catalog = Catalog(path, use_snapshot, use_binary)
+    return catalog
+
+def set_range_policy(policy):
+    """
+    Function: sets the default out-of-range policy of get_thermal_conductivity, get_conductivity_integral
+    and evaluate_many. One of tc_range.RANGE_POLICIES:
+    "ignore", "warn" (default), "warn-once", "nan", "clip", "raise" or "extrapolate" (power law tails)
+    """
+    global range_policy
+    tc_range.check_policy(policy)
+    range_policy = policy
+
+def resolve_range_policy(policy, verbose=True):
+    """
+    Returns: the policy to apply - the default if policy is None, and no warnings if not verbose
+    """
+    policy = range_policy if policy is None else policy
+    if not verbose and policy in ("warn", "warn-once"):
+        return "ignore"
+    return policy
+
+def set_integral_cache_size(maxsize):
+    """
+    Function: sets how many conductivity integrals are memoized (0 disables the memo).
+    """
+    integral_cache.resize(maxsize)
+
+def integral_cache_info():
+    """
+    Returns: dictionary of the integral memo's hits, misses, size and maxsize
+    """
+    return integral_cache.info()
+
+def clear_integral_cache():
+    integral_cache.clear()
+
+def get_registry():
+    """
+    Returns: the MaterialRegistry of the selected compilation file
+    """
+    return catalog.registry
+
+def get_cumulative_tables():
+    """
+    Returns: CumulativeTables of the selected compilation file, or None if no matching tables exist
+    """
+    return catalog.cumulative_tables()
+
+def __getattr__(name):
+    # TCdata, registry and tc_file_date used to be loaded at import, they are now loaded on first access
+    if name in ("TCdata", "registry"):
+        return getattr(catalog, name)
+    if name == "tc_file_date":
+        return catalog.date
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 def get_parameters(TCdata, mat):
@@ -34,62 +352,32 @@ def get_parameters(TCdata, mat):
     headers = TCdata[0] # pulls the headers from the file
     mat_names = TCdata[:,0] # makes an array of material names
     mat_row = TCdata[int(np.argwhere(mat_names == mat)[0][0])] # searches material name array for mat specified above and return relevant row
-    param_headers = headers[5:]
-    fit_type = mat_row[1]
-    num_hi = sum(1 for c in param_headers if c.isupper()) # searches for the number of low parameters (by lower case letter)
-    num_low = sum(1 for c in param_headers if c.islower()) # searches for number of high parameters
-    fit_params = mat_row 
-    fit_params = np.char.replace(fit_params, "^", "0")
-    # fit_range, low_param, hi_param, erf_param = np.array(mat_row[2:4], dtype=float), np.array(fit_params[:num_low], dtype=float), np.array(fit_params[num_low:-1], dtype=float), float(fit_params[-1])
-
-    fit_range = np.array(mat_row[2:4], dtype=float) # pulls the fit range
-    # loop through headers and if lower case add to low_param vice versa
-    low_param = []
-    hi_param = []
-    for key in headers[5:]:
-        if key.islower() and key != "erf param":
-            low_param.append(float(fit_params[int(np.argwhere(headers == key)[0][0])]))
-        elif key.isupper():
-            hi_param.append(float(fit_params[int(np.argwhere(headers == key)[0][0])]))
-        elif key == "erf param":
-            erf_param = float(fit_params[int(np.argwhere(headers == key)[0][0])])
-
-    # now we have a list of lower and upper parameters but, they might have trailing 0s if they have fewer parameters than other materials
-    # so now we remove those trailing 0s
-    def remove_trailing_zeros(arr):
-        return list(dropwhile(lambda x: x == 0, arr[::-1]))
-    low_param = remove_trailing_zeros(low_param)
-    hi_param = remove_trailing_zeros(hi_param)
-    if fit_type not in ["Nppoly", "polylog", "comppoly"]:
-        low_param = low_param[::-1]
-        hi_param = hi_param[::-1]
-    # print(low_param, hi_param, erf_param)
+    fit_type, fit_range, low_param, hi_param, erf_param, erf_multiplicity = parse_row(mat_row, *param_columns(headers))
     param_dictionary = {"fit_type":  fit_type,
                         "fit_range": fit_range,
-                        "low_param": low_param,
-                        "hi_param":  hi_param,
-                        "erf_param": erf_param}
+                        "low_param": low_param.tolist(),
+                        "hi_param":  hi_param.tolist(),
+                        "erf_param": erf_param,
+                        "erf_multiplicity": erf_multiplicity}
     return param_dictionary
 
-def get_thermal_conductivity(T, material, verbose=True):
+def get_thermal_conductivity(T, material, verbose=True, range_policy=None):
     """
     Function: Finds the thermal conductivity of a given material at a particular temperature.
 
     Arguments:
-    - T: float. Temperature in Kelvin 
+    - T: float or array. Temperature in Kelvin 
     - material: str. Material name string.
+    - verbose: bool. If False, out-of-range temperatures are not reported
+    - range_policy: str. Out-of-range policy (see set_range_policy), the default policy if None
 
     Returns: k_val, thermal conductivity in W/m/K
     """
-    param_dictionary = get_parameters(TCdata, material)
-    if verbose:
-        if T<param_dictionary["fit_range"][0] or T>param_dictionary["fit_range"][1]:
-            print(f"**Requested value out of range of {material} fit - estimation success not guaranteed")
-    func = get_func_type(param_dictionary["fit_type"])
-    k_val = func(T, param_dictionary)
+    record = catalog.registry[material]
+    k_val = tc_range.evaluate(record, T, resolve_range_policy(range_policy, verbose), material)
     return k_val
 
-def get_conductivity_integral(T_low, T_high, material, verbose=True):
+def get_conductivity_integral(T_low, T_high, material, verbose=True, method="auto", return_error=False, range_policy=None):
     """
     Function: Finds the integrated thermal conductivity of a given material over a temperature range.
 
@@ -97,44 +385,116 @@ def get_conductivity_integral(T_low, T_high, material, verbose=True):
     - T_low: float. lower bound temperature in Kelvin
     - T_high: float. upper bound temperature in Kelvin
     - material: str. Material name string.
+    - method: str. "auto" (closed form where the fit type allows, then the precomputed cumulative
+              tables, Gauss-Legendre in log(T) otherwise),
+              "gauss" or "trapz" (the legacy 1000 point trapezoid). See tc_integrals.conductivity_integral
+    - return_error: bool. If True, also return the estimated absolute error of the integral
+    - verbose: bool. If False, out-of-range bounds are not reported
+    - range_policy: str. Out-of-range policy (see set_range_policy), the default policy if None
 
-    Returns: ConInt, thermal conductivity in W/m
+    Returns: ConInt, thermal conductivity in W/m (and its estimated error if return_error)
     """
-    T_values = np.linspace(T_low, T_high, 1000) # defines the temperature array over which to calculate integral
-    param_dictionary = get_parameters(TCdata, material) # gets the material fit parameters
-    func = get_func_type(param_dictionary["fit_type"]) # finds the material fit type
-    if verbose:
-        if min(T_values)<param_dictionary["fit_range"][0] or max(T_values)>param_dictionary["fit_range"][1]:
-            print(f"**Requested value out of range of {material} fit - estimation success not guaranteed")
-    k_values = func(T_values, param_dictionary) # determines the thermal conductivity at each T point
-
-    ConInt = np.trapz(k_values, T_values) # integrates over the function
+    policy = resolve_range_policy(range_policy, verbose)
+    key = (catalog.version, material, float(T_low), float(T_high), method, policy)
+    record = catalog.registry[material] # gets the material fit parameters
+    cached = integral_cache.get(key)
+    if cached is None:
+        tables = get_cumulative_tables() if method == "auto" else None
+        cached = tc_range.integral(record, T_low, T_high, policy, method=method, tables=tables, material=material) # integrates over the function
+        integral_cache.put(key, cached)
+    else:
+        tc_range.check_bounds(record, [T_low, T_high], policy, material) # repeats the out-of-range report
+    ConInt, err = cached
+    if return_error:
+        return ConInt, err
     return ConInt
 
 
-def make_a_table(TCdata, materials):
+def get_conductivity_integrals(T_lows, T_highs, materials, verbose=True, method="auto", return_error=False, range_policy=None):
+    """
+    Function: Finds many conductivity integrals in one call - the batched get_conductivity_integral.
+    Duplicate requests are computed once, and each material's intervals are integrated together.
+
+    Arguments:
+    - T_lows, T_highs: lists or arrays. Lower and upper bound temperatures in Kelvin
+    - materials: list of material name strings (or a single name for every interval)
+    - verbose, method, return_error, range_policy: as in get_conductivity_integral
+
+    Returns: ConInts, array of thermal conductivity integrals in W/m (and their estimated errors if return_error)
+    """
+    T_lows, T_highs = np.asarray(T_lows, dtype=float).ravel(), np.asarray(T_highs, dtype=float).ravel()
+    if isinstance(materials, str):
+        materials = [materials]*len(T_lows)
+    policy = resolve_range_policy(range_policy, verbose)
+    tables = get_cumulative_tables() if method == "auto" else None
+    version = catalog.version
+
+    results = dict() # (material, T_low, T_high) -> (ConInt, err)
+    by_material = dict() # material -> requests missing from the integral memo
+    for mat, T_low, T_high in zip(materials, T_lows, T_highs):
+        key = (mat, T_low, T_high)
+        if key in results:
+            continue
+        cached = integral_cache.get((version, mat, T_low, T_high, method, policy))
+        results[key] = cached
+        if cached is None:
+            by_material.setdefault(mat, []).append(key)
+        else:
+            tc_range.check_bounds(catalog.registry[mat], [T_low, T_high], policy, mat)
+
+    for mat, keys in by_material.items():
+        bounds = np.array([key[1:] for key in keys])
+        ConInt, err = tc_range.integrals(catalog.registry[mat], bounds[:, 0], bounds[:, 1], policy,
+                                         method=method, tables=tables, material=mat)
+        for key, value in zip(keys, zip(ConInt, err)):
+            results[key] = value
+            integral_cache.put((version,) + key + (method, policy), value)
+    ConInts = np.array([results[key][0] for key in zip(materials, T_lows, T_highs)])
+    if return_error:
+        errs = np.array([results[key][1] for key in zip(materials, T_lows, T_highs)])
+        return ConInts, errs
+    return ConInts
+
+
+def evaluate_many(materials, T, range_policy="ignore"):
+    """
+    Function: Finds the thermal conductivity of several materials over a temperature array in one call.
+
+    Arguments:
+    - materials: list of material name strings (or a single name)
+    - T: float or array. Temperatures in Kelvin
+    - range_policy: str. Out-of-range policy (see set_range_policy), "ignore" by default - the default policy if None
+
+    Returns: k_vals, (materials x temperatures) array of thermal conductivities in W/m/K
+    """
+    if isinstance(materials, str):
+        materials = [materials]
+    return tc_range.evaluate_many(catalog.registry, materials, T, resolve_range_policy(range_policy))
+
+
+def make_a_table(TCdata, materials, range_policy="nan", fill_value=0):
+    """
+    Function: writes data_table.csv, the conductivity of each material at a fixed set of temperatures.
+
+    Arguments:
+    - TCdata: (array) the array of the imported compilation file
+    - materials: list of material name strings
+    - range_policy: str. Out-of-range policy (see set_range_policy)
+    - fill_value: written in place of nan (out of range with the "nan" policy), negative and
+                  unphysically large (> 1e6 W/m/K) values
+    """
     T_one = np.round(np.arange(0.01, .1, 0.005), 3)
     T_full = []
     for i in range(4):
         T_full.extend(T_one*10**(i+1))
     T_full = np.round(T_full, 2)
 
-    tc_datatable = T_full
-    for mat in materials:
-        params = get_parameters(TCdata, mat)
-        func_type = get_func_type(params["fit_type"])
-        # print(mat, func_type)
-        y_data = []
-        for n in range(len(T_full)):
-            if (T_full[n] < params["fit_range"][0]) or (T_full[n] > params["fit_range"][1]):
-                y_data.append(0)
-            else:
-                y_append = func_type(T_full[n], params)
-                if (y_append > 1e6) or (y_append < 0):
-                    y_data.append(0)
-                else:
-                    y_data.append(y_append)
-        tc_datatable = np.vstack((tc_datatable, np.round(y_data,3)))
+    table_registry = MaterialRegistry(TCdata)
+    with np.errstate(all="ignore"):
+        y_data = tc_range.evaluate_many(table_registry, list(materials), T_full, range_policy)
+        y_data[~np.isfinite(y_data) | (y_data > 1e6) | (y_data < 0)] = fill_value
+
+    tc_datatable = np.vstack((T_full, np.round(y_data,3)))
     headers = np.insert(materials, 0, ["Temperature [K]"], axis=0)
     tc_datatable = np.insert(np.array(tc_datatable, dtype=object), 0, headers, axis = 1)
 
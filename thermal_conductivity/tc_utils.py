@@ -10,12 +10,15 @@ import matplotlib.cm as cm
 import string, yaml, csv, h5py
 import sys,os
 from datetime import datetime
+from scipy.optimize import least_squares
 
 abspath = os.path.abspath(__file__)
 sys.path.insert(0, os.path.dirname(abspath))
 
 
 from fit_types import * # Imports the different fit types from the associated file
+from tc_rawdata import RawData, load_raw, update_references
+from tc_plotting import new_figure, draw_if_changed
 
 cmap = cm.get_cmap('Dark2')
 
@@ -41,61 +44,26 @@ def get_datafiles(raw_path):
     print(f"Found {len(raw_files)} measurements.")
     return raw_files
 
-def parse_raw(material_name, raw_directory, plots=False, weight_const=0):
+def parse_raw(material_name, raw_directory, plots=False, weight_const=0, preview=False):
     """
     Arguments : 
     - material_name - a pointer for the material name, this much match the folder name.
-    - path_dict     - a dictionary object linking the material name to the path address of the raw files.
+    - raw_directory - path of the folder of raw csv files of the material.
+    - plots         - default=False - Boolean argument, if true, the raw data is plotted and saved to the plots folder.
+    - weight_const  - default=0     - loss of weight per year of age of the measurements.
+    - preview       - default=False - Boolean argument, if true, a png preview of the plot is saved next to the pdf.
 
     Returns : 
     - big_data  - Array of all measurements concatenated (no reference information).
-    - data_dict - A dictionary of data with references as the keys.
+    - data_dict - RawData of the measurements, indexed by reference like a dictionary (see tc_rawdata).
     """
-    all_files = os.listdir(raw_directory)
-    extension = ".csv"
-    raw_files = [file for file in all_files if file.endswith(extension)]
-    
-    big_data = np.empty((0,4), float)
-    data_dict = dict()
-    with open(f"{raw_directory}{os.sep}references.txt", 'w') as file:
-        for f in raw_files:
-            f_path = raw_directory + os.sep + f
-            try:
-                file1 = np.loadtxt(f_path, dtype=str, delimiter=',')
-            except ValueError:
-                print(f_path)
-            file.write(f)
-            file.write("\n")
-            file.write(str(file1[0]))
-            file.write("\n \n")
-            ref_name = f[:-4]
-            raw_data = np.array(file1[2:,:], dtype=float)           
-            
-            if weight_const != 0:
-                # year weights
-                year = ref_name[-4:]
-                weights = np.ones((len(raw_data),1))*(1-(weight_const*(2024-int(year))))
-                weights[weights<0]=0 # replaces all negative weights with 0
-            else:
-                weights = np.ones((len(raw_data),1))
-            raw_data = np.append(raw_data, weights, axis = 1)
-
-            big_data = np.append(big_data, raw_data, axis=0)
-
-            data_dict[ref_name] = raw_data
-            T, k, koT, weights = raw_data.T
-            
-            if plots:
-                plt.plot(T, k, '.', label=ref_name)
+    data_dict, raw_files = load_raw(raw_directory, weight_const, material_name) # from the RAW store if it is fresh
+    if data_dict.source == "csv":
+        update_references(raw_directory, data_dict, raw_files) # only rewritten when stale
+    big_data = data_dict.data
+
     if plots:
-        plt.legend()
-        plt.xlabel("Temperature")
-        plt.ylabel("k")
-        plt.semilogx()
-        plt.semilogy()
-        plt.savefig(f"{os.path.split(raw_directory)[0]}{os.sep}plots{os.sep}{material_name}_RAWDATA.pdf", dpi=300, format="pdf", bbox_inches='tight')
-        # plt.show()
-        plt.close()
+        plot_rawdata(material_name, raw_directory, data_dict, preview)
 
     if len(big_data[:,3][big_data[:,3]!=0]) == 0:
                 print(f"Weight set to loss of {weight_const*100}% per year - No remaining data to fit")
@@ -152,6 +120,8 @@ def format_combofit(fit_args):
         dict_vals = np.append(dict_vals, param_str_arr)
     
         mat_dict = dict(zip(keys, dict_vals))
+        if i == "combined" and "combined_fit_erfmult" in fit_args: # blend sharpness of a refined fit (see refine_combined_fit)
+            mat_dict["erf multiplicity"] = np.char.mod('%0.' + str(5) + 'e', float(fit_args["combined_fit_erfmult"]))
         output_array.append(mat_dict)
     return output_array
 
@@ -337,30 +307,47 @@ def make_fit_lh5(fit_args, save_path):
             f.create_dataset(f"{key}", data=fit_args[key])
     return comp_file
 
-def compile_csv(path_to_fits):
+def read_fit_rows(fit_dir, mat):
+    """
+    Description : Reads the combined fit (last row) of a material's fit files - <mat>.csv, or <mat>_lo.csv and <mat>_hi.csv.
+
+    Returns : list of dictionaries of the fit columns, with the material name under "Material Name".
+    """
+    rows = []
+    if not os.path.exists(f"{fit_dir}{os.sep}{mat}.csv"):
+        for i in ["lo", "hi"]:
+            material_file = np.loadtxt(f"{fit_dir}{os.sep}{mat}_{i}.csv", dtype=str, delimiter=',')
+            headers = material_file[0]
+            headers = np.append([f"Material Name"], headers)
+            comb_fit = material_file[-1]
+            comb_fit = np.append([f"{mat}_{i}"], comb_fit)
+            rows.append(dict(zip(headers, comb_fit)))
+    else:
+        material_file = np.loadtxt(f"{fit_dir}{os.sep}{mat}.csv", dtype=str, delimiter=',')
+        headers = material_file[0]
+        headers = np.append(["Material Name"], headers)
+        comb_fit = material_file[-1]
+        comb_fit = np.append([f"{mat}"], comb_fit)
+        rows.append(dict(zip(headers, comb_fit)))
+    return rows
+
+def compile_csv(path_to_fits, fit_rows=None):
     """
     Description : Compiles the fit data of every material and outputs to a single array.
+
+    Arguments :
+    - path_to_fits - dictionary of the fit folder of each material
+    - fit_rows     - (optional) dictionary of the rows already read, keyed by (fit folder, material) -
+                     shared between calls so that each fit file is only read once
     """
+    if fit_rows is None:
+        fit_rows = dict()
     output_array = []
     for mat in path_to_fits.keys():
-        file = path_to_fits[mat]
-        if not os.path.exists(f"{file}{os.sep}{mat}.csv"):
-            for i in ["lo", "hi"]:
-                material_file = np.loadtxt(f"{file}{os.sep}{mat}_{i}.csv", dtype=str, delimiter=',')
-                headers = material_file[0]
-                headers = np.append([f"Material Name"], headers)
-                comb_fit = material_file[-1]
-                comb_fit = np.append([f"{mat}_{i}"], comb_fit)
-                mat_dict = dict(zip(headers, comb_fit))
-                output_array.append(mat_dict)
-        else:
-            material_file = np.loadtxt(f"{file}{os.sep}{mat}.csv", dtype=str, delimiter=',')
-            headers = material_file[0]
-            headers = np.append(["Material Name"], headers)
-            comb_fit = material_file[-1]
-            comb_fit = np.append([f"{mat}"], comb_fit)
-            mat_dict = dict(zip(headers, comb_fit))
-            output_array.append(mat_dict)
+        key = (path_to_fits[mat], mat)
+        if key not in fit_rows:
+            fit_rows[key] = read_fit_rows(*key)
+        output_array.extend(fit_rows[key])
 
     return output_array
 
@@ -456,13 +443,39 @@ def create_tc_csv(data, output_file):
 ######################## PLOTTING #############################
 ###############################################################
 ###############################################################
+# Figures are drawn on their own Agg canvas (see tc_plotting) and only redrawn when their inputs change.
+
+def plots_directory(raw_directory):
+    return f"{os.path.split(raw_directory)[0]}{os.sep}plots"
+
+def plot_rawdata(material_name, raw_directory, data_dict, preview=False, force=False):
+    def draw():
+        fig = new_figure()
+        ax = fig.subplots()
+        for ref_name, raw_data in data_dict.items():
+            T, k, koT, weights = raw_data.T
+            ax.plot(T, k, '.', label=ref_name)
+        ax.legend()
+        ax.set_xlabel("Temperature")
+        ax.set_ylabel("k")
+        ax.semilogx()
+        ax.semilogy()
+        return fig
+    return draw_if_changed(draw, plots_directory(raw_directory), f"{material_name}_RAWDATA", plot_inputs(data_dict), preview, force)
+
+def plot_inputs(data_dict, *args):
+    """
+    Returns: the data (by reference) and the arguments a plot is drawn from, for tc_plotting.draw_if_changed
+    """
+    return [[[ref_name, np.asarray(data_dict[ref_name])] for ref_name in data_dict], list(args)]
 
-def plot_datapoints(data_dict):
+def plot_datapoints(data_dict, ax=None):
+    ax = plt.gca() if ax is None else ax
     i = 0
     m = 1
     for ref_name in data_dict.keys():
         T, k, koT, ws = data_dict[ref_name].T
-        plt.plot(T, k, marker=markers[i], ms=7, mfc='none', ls='none', label=ref_name, c=cmap((i%6)/6), alpha=np.mean(ws))
+        ax.plot(T, k, marker=markers[i], ms=7, mfc='none', ls='none', label=ref_name, c=cmap((i%6)/6), alpha=np.mean(ws))
         # Adjustments for CFRP
         # print(ref_name) #, contains_word = bool(re.search(r'\b{}\b'.format(re.escape(word_to_check)), phrase)))
         # if m == 1:
@@ -523,7 +536,8 @@ def get_plotting_data(material_name, path_dict, data_dict, fit_args, fit_range):
                         "fit_range": [lower_bound, upper_bound],
                         "low_param": low_param,
                         "hi_param":  hi_param,
-                        "erf_param": erf_param}
+                        "erf_param": erf_param,
+                        "erf_multiplicity": fit_args.get("combined_fit_erfmult", 0)}
     
     low_t_range = np.linspace(fit_range[0],upper_bound,100)
     low_fit_k = loglog_func(low_t_range, param_dictionary)
@@ -541,12 +555,18 @@ def get_plotting_data(material_name, path_dict, data_dict, fit_args, fit_range):
     return Tdata, kdata, low_t_range, hi_t_range, low_fit_k, hi_fit_k, full_T_range, raw_directory
 
 
-def plot_full(material_name: str, path_dict, data_dict, fit_args, fit_range=[100e-4,25e2], points=True, fits="combined", fill=False):
+def plot_full(material_name: str, path_dict, data_dict, fit_args, fit_range=[100e-4,25e2], points=True, fits="combined", fill=False, preview=False, force=False):
     Tdata, kdata, low_t_range, hi_t_range, low_fit_k, hi_fit_k, full_T_range, raw_directory = get_plotting_data(material_name, path_dict, data_dict, fit_args, fit_range)
+    inputs = plot_inputs(data_dict, fit_args, fit_range, points, fits, fill)
+    return draw_if_changed(lambda: draw_full(material_name, data_dict, fit_args, Tdata, kdata, low_t_range, hi_t_range, low_fit_k, hi_fit_k, full_T_range, points, fits, fill),
+                           plots_directory(raw_directory), f"{material_name}_fullPlot", inputs, preview, force)
+
+def draw_full(material_name, data_dict, fit_args, Tdata, kdata, low_t_range, hi_t_range, low_fit_k, hi_fit_k, full_T_range, points, fits, fill):
     # Plots the data points
-    plt.figure(figsize=(13, 11))
+    fig = new_figure(figsize=(13, 11))
+    ax = fig.subplots()
     if points:
-        plot_datapoints(data_dict)
+        plot_datapoints(data_dict, ax)
 
     low_param, hi_param, erf_param, fit_type = fit_args["low_fit_param"], fit_args["hi_fit_param"], fit_args["combined_fit_erfloc"], fit_args["combined_function_type"] ################################### 20240605
     # low_param = low_param[::-1] ################################### 20240531
@@ -558,13 +578,14 @@ def plot_full(material_name: str, path_dict, data_dict, fit_args, fit_range=[100
                         "fit_range": [min(Tdata), max(Tdata)],
                         "low_param": low_param,
                         "hi_param":  hi_param,
-                        "erf_param": erf_param}
+                        "erf_param": erf_param,
+                        "erf_multiplicity": fit_args.get("combined_fit_erfmult", 0)}
     # low_param = low_param[::-1] ################################### 20240531
     # hi_param = hi_param[::-1] ################################### 20240531
 
     k_fit_combined = loglog_func(full_T_range, param_dictionary)
     if fits=="combined":
-        plt.plot(full_T_range, k_fit_combined, linewidth=3, label='fit', c="c")
+        ax.plot(full_T_range, k_fit_combined, linewidth=3, label='fit', c="c")
         if fill:
             avg_perc_diff, perc_diff_arr = get_percdiff(Tdata, kdata, fit_args)
             low_avg_perc_diff, hi_avg_perc_diff = [0,0]
@@ -572,30 +593,25 @@ def plot_full(material_name: str, path_dict, data_dict, fit_args, fit_range=[100
                 low_avg_perc_diff, low_perc_diff_arr = get_percdiff(Tdata[Tdata<30], kdata[Tdata<30], fit_args)
             if len(Tdata[Tdata>30])>0:
                 hi_avg_perc_diff, hi_perc_diff_arr = get_percdiff(Tdata[Tdata>30], kdata[Tdata>30], fit_args)
-            plt.fill_between(full_T_range, k_fit_combined*(1+avg_perc_diff/100), (k_fit_combined*(1-avg_perc_diff/100)),
+            ax.fill_between(full_T_range, k_fit_combined*(1+avg_perc_diff/100), (k_fit_combined*(1-avg_perc_diff/100)),
                              alpha=0.25, color="c",
                              label=f"{np.char.mod('%0.' + str(2) + 'f', avg_perc_diff)}%")
                             #  label=f"{np.char.mod('%0.' + str(2) + 'f', avg_perc_diff)}, low: {np.char.mod('%0.' + str(2) + 'f', low_avg_perc_diff)}, hi: {np.char.mod('%0.' + str(2) + 'f', hi_avg_perc_diff)}%")
     # Plots the fits as they are seperately (rather then the combined fit)
     if fits=="split":
-        plt.plot(low_t_range, low_fit_k, c='b')
-        plt.plot(hi_t_range, hi_fit_k, c='b')        
+        ax.plot(low_t_range, low_fit_k, c='b')
+        ax.plot(hi_t_range, hi_fit_k, c='b')
     # plt.legend(loc='center right', bbox_to_anchor=(1.5, 0.5), fontsize=20)
     fs = 26
-    plt.legend(loc='center right', bbox_to_anchor=(1.7, 0.5), fontsize=fs)    
-    plt.xlabel("Temperature [K]", fontsize=fs)
-    plt.xticks(fontsize=fs)
-    plt.yticks(fontsize=fs)
-    plt.ylabel("k [W/m/K]", fontsize=fs)
-    plt.title(f"{material_name}", fontsize=32)
-    plt.semilogx()
-    plt.semilogy()
-    plt.savefig(f"{os.path.split(raw_directory)[0]}{os.sep}plots{os.sep}{material_name}_fullPlot.pdf", dpi=300, format="pdf", bbox_inches='tight')
-    plt.grid(True, which="both", ls="-", color='0.65', alpha=0.35)
-    # plt.show()
-    plt.close()
-    
-    return
+    ax.legend(loc='center right', bbox_to_anchor=(1.7, 0.5), fontsize=fs)
+    ax.set_xlabel("Temperature [K]", fontsize=fs)
+    ax.tick_params(which="major", labelsize=fs)
+    ax.set_ylabel("k [W/m/K]", fontsize=fs)
+    ax.set_title(f"{material_name}", fontsize=32)
+    ax.semilogx()
+    ax.semilogy()
+    return fig
+
 
 def get_percdiff(Tdata, kdata, fit_args):
     low_param, hi_param, erf_param, fit_type = fit_args["low_fit_param"], fit_args["hi_fit_param"], fit_args["combined_fit_erfloc"], fit_args["combined_function_type"] ################################### 20240605
@@ -608,7 +624,8 @@ def get_percdiff(Tdata, kdata, fit_args):
                         "fit_range": [min(Tdata), max(Tdata)],
                         "low_param": low_param,
                         "hi_param":  hi_param,
-                        "erf_param": erf_param}
+                        "erf_param": erf_param,
+                        "erf_multiplicity": fit_args.get("combined_fit_erfmult", 0)}
     
     # Calculates the predicted k value for the measured T values (rather than a continuous range)
     func = get_func_type(param_dictionary["fit_type"])
@@ -619,8 +636,13 @@ def get_percdiff(Tdata, kdata, fit_args):
     avg_perc_diff = np.mean(abs(perc_diff_arr)) # finds the average of that percent difference
     return avg_perc_diff, perc_diff_arr
 
-def plot_splitfits(material_name: str, path_dict, data_dict, fit_args, fit_range=[100e-4,25e2], fill=True):
+def plot_splitfits(material_name: str, path_dict, data_dict, fit_args, fit_range=[100e-4,25e2], fill=True, preview=False, force=False):
     Tdata, kdata, low_t_range, hi_t_range, low_fit_k, hi_fit_k, full_T_range, raw_directory = get_plotting_data(material_name, path_dict, data_dict, fit_args, fit_range)
+    inputs = plot_inputs(data_dict, fit_args, fit_range, fill)
+    return draw_if_changed(lambda: draw_splitfits(material_name, data_dict, fit_args, Tdata, kdata, low_t_range, hi_t_range, low_fit_k, hi_fit_k, full_T_range, fill),
+                           plots_directory(raw_directory), f"{material_name}_subplots", inputs, preview, force)
+
+def draw_splitfits(material_name, data_dict, fit_args, Tdata, kdata, low_t_range, hi_t_range, low_fit_k, hi_fit_k, full_T_range, fill):
 
     low_param, hi_param, erf_param, fit_type = fit_args["low_fit_param"], fit_args["hi_fit_param"], fit_args["combined_fit_erfloc"], fit_args["combined_function_type"] ################################### 20240605
     # low_param = low_param[::-1] ################################### 20240531
@@ -632,13 +654,15 @@ def plot_splitfits(material_name: str, path_dict, data_dict, fit_args, fit_range
                         "fit_range": [min(Tdata), max(Tdata)],
                         "low_param": low_param,
                         "hi_param":  hi_param,
-                        "erf_param": erf_param}
+                        "erf_param": erf_param,
+                        "erf_multiplicity": fit_args.get("combined_fit_erfmult", 0)}
     
     # low_param = low_param[::-1] ################################### 20240531
     # hi_param = hi_param[::-1] ################################### 20240531
     
     # Now let's get to plotting
-    fig, axs = plt.subplots(2, figsize=(8, 6))
+    fig = new_figure(figsize=(8, 6))
+    axs = fig.subplots(2)
     i = 0
     for ref_name in data_dict.keys():
         T, k, koT, ws = data_dict[ref_name].T
@@ -679,17 +703,17 @@ def plot_splitfits(material_name: str, path_dict, data_dict, fit_args, fit_range
     if fill:
         axs[1].fill_between(hi_t_range, hi_fit_k*(1+avg_perc_diff/100), (hi_fit_k*(1-avg_perc_diff/100)), alpha=0.25, color="c",
                             label=f"{np.char.mod('%0.' + str(2) + 'f', avg_perc_diff)}, low: {np.char.mod('%0.' + str(2) + 'f', low_avg_perc_diff)}, hi: {np.char.mod('%0.' + str(2) + 'f', hi_avg_perc_diff)}%")
-    plt.legend(loc='center right', bbox_to_anchor=(1.5, 1.2))
-    plt.subplots_adjust(wspace=0.4, hspace=0.4)
-    plt.savefig(f"{os.path.split(raw_directory)[0]}{os.sep}plots{os.sep}{material_name}_subplots.pdf", dpi=300, format="pdf", bbox_inches='tight')
-    # if show:
-    # plt.show()
-    plt.close()
-
-    return
+    axs[1].legend(loc='center right', bbox_to_anchor=(1.5, 1.2))
+    fig.subplots_adjust(wspace=0.4, hspace=0.4)
+    return fig
 
-def plot_residuals(material_name: str, path_dict, data_dict, fit_args, fit_range=[100e-4,25e2]):
+def plot_residuals(material_name: str, path_dict, data_dict, fit_args, fit_range=[100e-4,25e2], preview=False, force=False):
     Tdata, kdata, low_t_range, hi_t_range, low_fit_k, hi_fit_k, full_T_range, raw_directory = get_plotting_data(material_name, path_dict, data_dict, fit_args, fit_range)
+    inputs = plot_inputs(data_dict, fit_args, fit_range)
+    return draw_if_changed(lambda: draw_residuals(material_name, fit_args, Tdata, kdata, low_t_range, hi_t_range),
+                           plots_directory(raw_directory), f"{material_name}_ResidualPlots", inputs, preview, force)
+
+def draw_residuals(material_name, fit_args, Tdata, kdata, low_t_range, hi_t_range):
     avg_perc_diff, perc_diff_arr = get_percdiff(Tdata, kdata, fit_args)
 
     low_param, hi_param, erf_param, fit_type = fit_args["low_fit_param"], fit_args["hi_fit_param"], fit_args["combined_fit_erfloc"], fit_args["combined_function_type"] ################################### 20240605
@@ -702,7 +726,8 @@ def plot_residuals(material_name: str, path_dict, data_dict, fit_args, fit_range
                         "fit_range": [min(Tdata), max(Tdata)],
                         "low_param": low_param,
                         "hi_param":  hi_param,
-                        "erf_param": erf_param}
+                        "erf_param": erf_param,
+                        "erf_multiplicity": fit_args.get("combined_fit_erfmult", 0)}
     # low_param = low_param[::-1] ################################### 20240531
     # hi_param = hi_param[::-1] ################################### 20240531
     
@@ -710,7 +735,8 @@ def plot_residuals(material_name: str, path_dict, data_dict, fit_args, fit_range
     # Residual Plots
     koT_pred = (1/Tdata)*loglog_func(Tdata, param_dictionary)
     koT_data = (1/Tdata)*kdata
-    fig, axs = plt.subplots(2, figsize=(8, 6))
+    fig = new_figure(figsize=(8, 6))
+    axs = fig.subplots(2)
     # axs[0].plot(Tdata, koT_data-koT_pred, '.')
     axs[0].plot(Tdata, perc_diff_arr, '.', c=cmap(np.pi/10))
     # axs[0].plot(Tdata, 100*(koT_data-koT_pred)/koT_data, '.')
@@ -731,14 +757,10 @@ def plot_residuals(material_name: str, path_dict, data_dict, fit_args, fit_range
     axs[1].set_xlim(0.9*min(hi_t_range), 1.1*max(hi_t_range))
     axs[1].set_ylim(0.9*min(perc_diff_arr), 1.1*max(perc_diff_arr))
     axs[1].semilogx()
-    plt.subplots_adjust(wspace=0.4, hspace=0.4)
-    plt.savefig(f"{os.path.split(raw_directory)[0]}{os.sep}plots{os.sep}{material_name}_ResidualPlots.pdf", dpi=300, format="pdf", bbox_inches='tight')
-    # plt.show()
-    plt.close()
-
-    return
+    fig.subplots_adjust(wspace=0.4, hspace=0.4)
+    return fig
 
-def tk_plot(material_name: str, path_dict, data_dict, fit_args, fit_range=[100e-4,25e2], points=True, fits="combined", fill=False):
+def tk_plot(material_name: str, path_dict, data_dict, fit_args, fit_range=[100e-4,25e2], points=True, fits="combined", fill=False, preview=False, force=False):
     """
     Description : Produces a beautiful plot of the raw data with the fit.
 
@@ -751,16 +773,17 @@ def tk_plot(material_name: str, path_dict, data_dict, fit_args, fit_range=[100e-
     - points        - default=True          - Boolean argument, if true, data points are added to the plot.
     - fits          - options: 'combined', 'low', 'hi', other - defines which fits to plot.
     - fill          - default=False         - Boolean argument, if true, 15% confidence interval is shaded around plot.
-    - show          - default=True          - Boolean argument, if true, plot is shown in notebook.
+    - preview       - default=False         - Boolean argument, if true, png previews are saved next to the 300 dpi pdfs.
+    - force         - default=False         - Boolean argument, if true, plots are redrawn even if their data and fit are unchanged.
 
     Returns : 
     - null
     """    
-    plot_full(material_name, path_dict, data_dict, fit_args, fit_range, points, fits, fill)
+    plot_full(material_name, path_dict, data_dict, fit_args, fit_range, points, fits, fill, preview, force)
 
-    plot_splitfits(material_name, path_dict, data_dict, fit_args, fit_range, fill)
+    plot_splitfits(material_name, path_dict, data_dict, fit_args, fit_range, fill, preview, force)
 
-    plot_residuals(material_name, path_dict, data_dict, fit_args, fit_range)
+    plot_residuals(material_name, path_dict, data_dict, fit_args, fit_range, preview, force)
 
     return
 
@@ -838,6 +861,149 @@ def dual_tc_fit(big_data, save_path, erf_loc = 20, fit_orders = (3,3), fit_types
     return arg_dict
 
 
+def normal_sums(x, y, weights, order):
+    """
+    Description : Cumulative sums of the weighted normal equations of a polynomial fit (as np.polyfit,
+    the weights multiply the residuals). Row i holds the sums over the first i points.
+
+    Returns :
+    - moments - array of shape [N+1, 2*order+1], sums of weights**2 * x**p
+    - rhs     - array of shape [N+1, order+1], sums of weights**2 * x**p * y
+    """
+    powers = x[:, None]**np.arange(2*order+1)
+    w2 = weights**2
+    moments = np.cumsum(np.vstack([np.zeros((1, 2*order+1)), w2[:, None]*powers]), axis=0)
+    rhs = np.cumsum(np.vstack([np.zeros((1, order+1)), (w2*y)[:, None]*powers[:, :order+1]]), axis=0)
+    return moments, rhs
+
+def solve_normal_sums(moments, rhs, scales, order, max_cond=1e8):
+    """
+    Description : Solves many small normal equation systems at once, each rescaled by its largest |x|.
+
+    Arguments :
+    - moments, rhs - rows of normal_sums, one per system
+    - scales       - largest |x| of the points of each system
+    - max_cond     - systems with a larger condition number are flagged as not solved
+
+    Returns :
+    - fits   - array of polynomial coefficients (highest order first, as np.polyfit), one row per system
+    - solved - boolean array, False where the system was singular or ill conditioned
+    """
+    p = np.arange(order+1)
+    D = np.where(scales > 0, scales, 1)[:, None]**(-p.astype(float))
+    H = moments[:, p[:, None]+p[None, :]]*D[:, :, None]*D[:, None, :]
+    r = rhs*D
+    solved = np.all(np.isfinite(H), axis=(1, 2)) & np.all(np.isfinite(r), axis=1)
+    solved[solved] = np.linalg.cond(H[solved]) < max_cond
+    fits = np.zeros((len(H), order+1))
+    if np.any(solved):
+        fits[solved] = np.linalg.solve(H[solved], r[solved][:, :, None])[:, :, 0]*D[solved]
+    return fits[:, ::-1], solved
+
+def split_search(big_data, erf_locs, fit_orders=(3,3), fit_types=("Nppoly", "polylog")):
+    """
+    Description : Fits the low (k/T polynomial) and high (log-log polynomial) data on either side of every
+    candidate split location, as the split loop of fit_data did with split_data and np.polyfit, and finds the
+    average percent difference of each combined fit. The data is sorted once and the cumulative normal equation
+    sums are computed once, so each candidate only costs a small solve (candidates whose system is too small or
+    ill conditioned fall back to np.polyfit).
+
+    Arguments :
+    - big_data   - Array of measurement data concatenated (should be of shape: [N, 4])
+    - erf_locs   - array of candidate split temperatures
+    - fit_orders - default=(3,3) - Polynomial fit order (low, high).
+    - fit_types  - default=("Nppoly", "polylog") - fit type of each regime (low, high).
+
+    Returns :
+    - perc_diff_avgs - array of the average percent difference of the combined fit at each split
+    - fits           - list of (low_fit_xs, low_fit, hi_fit_xs, hi_fit) at each split
+    """
+    T, k, koT, weights = [big_data[:,0], big_data[:,1], big_data[:,2], big_data[:,3]]
+    sort = np.argsort(T, kind="stable")
+    T_s, koT_s, w_s = T[sort], koT[sort], weights[sort]
+    logT_r, logk_r, w_r = np.log10(T_s[::-1]), np.log10(k[sort][::-1]), w_s[::-1] # high data, from the top down
+    erf_locs = np.asarray(erf_locs, dtype=float)
+    n_low = np.searchsorted(T_s, erf_locs, "left") # T < erf_loc
+    n_hi = len(T) - np.searchsorted(T_s, erf_locs, "right") # T > erf_loc
+
+    with np.errstate(all="ignore"):
+        moments, rhs = normal_sums(T_s, koT_s, w_s, fit_orders[0])
+        low_scales = T_s[np.maximum(n_low-1, 0)]
+        low_fits, low_solved = solve_normal_sums(moments[n_low], rhs[n_low], low_scales, fit_orders[0])
+        moments, rhs = normal_sums(logT_r, logk_r, w_r, fit_orders[1])
+        hi_scales = np.maximum(abs(logT_r[0]), abs(logT_r[np.maximum(n_hi-1, 0)]))
+        hi_fits, hi_solved = solve_normal_sums(moments[n_hi], rhs[n_hi], hi_scales, fit_orders[1])
+
+    fits = []
+    for i, erf_loc in enumerate(erf_locs):
+        if n_low[i] == 0:
+            low_fit, low_fit_xs = [0], [0]
+        elif low_solved[i] and n_low[i] > fit_orders[0]:
+            low_fit, low_fit_xs = low_fits[i], np.linspace(T_s[0], T_s[n_low[i]-1], 100)
+        else:
+            low_fit_xs, low_fit = koT_function(T_s[:n_low[i]], koT_s[:n_low[i]], fit_orders[0], w_s[:n_low[i]])
+        if n_hi[i] == 0:
+            hi_fit, hi_fit_xs = [0], [0]
+        elif hi_solved[i] and n_hi[i] > fit_orders[1]:
+            hi_fit, hi_fit_xs = hi_fits[i], np.linspace(logT_r[n_hi[i]-1], logT_r[0], 100)
+        else:
+            hi_fit_xs, hi_fit = logk_function(logT_r[:n_hi[i]], logk_r[:n_hi[i]], fit_orders[1], w_r[:n_hi[i]])
+        fits.append((low_fit_xs, low_fit, hi_fit_xs, hi_fit))
+
+    # the combined (comppoly) fits of every split, evaluated together as get_percdiff does one at a time
+    records = [{"low_param": low_fit, "hi_param": hi_fit, "erf_param": erf_loc}
+               for (low_fit_xs, low_fit, hi_fit_xs, hi_fit), erf_loc in zip(fits, erf_locs)]
+    kpred = loglog_stack(T, records)
+    perc_diff_avgs = np.mean(abs(100*(kpred-k)/kpred), axis=1)
+    return perc_diff_avgs, fits
+
+
+def refine_combined_fit(big_data, fit_args, erf_multiplicity=ERF_MULTIPLICITY, multiplicity_bounds=(1, 100), max_nfev=None):
+    """
+    Description : Refines a combined (comppoly) fit - the split location, the blend sharpness and the coefficients of
+    both polynomials together - by bounded nonlinear least squares on the weighted relative residuals, warm-started
+    from fit_args (the fit at the best split of the grid search). The split location is bounded by the data range
+    and the blend sharpness by multiplicity_bounds.
+
+    Arguments :
+    - big_data            - Array of measurement data concatenated (should be of shape: [N, 4])
+    - fit_args            - combined fit arguments to start from (see dual_tc_fit)
+    - erf_multiplicity    - default=15 - starting blend sharpness
+    - multiplicity_bounds - default=(1, 100) - bounds of the blend sharpness
+    - max_nfev            - default=None - maximum number of residual evaluations (scipy's default if None)
+
+    Returns :
+    - refined_args - copy of fit_args with the refined parameters and "combined_fit_erfmult", or fit_args itself if
+      the refinement did not lower the average percent difference
+    - nfev         - number of residual evaluations used
+    """
+    T, k, koT, weights = [big_data[:,0], big_data[:,1], big_data[:,2], big_data[:,3]]
+    low0 = np.array(fit_args["low_fit_param"], dtype=float)[::-1] # highest order first
+    hi0 = np.array(fit_args["hi_fit_param"], dtype=float)[::-1]
+    n_low = len(low0)
+    lower = np.concatenate([np.full(n_low+len(hi0), -np.inf), [np.min(T), multiplicity_bounds[0]]])
+    upper = np.concatenate([np.full(n_low+len(hi0), np.inf), [np.max(T), multiplicity_bounds[1]]])
+    x0 = np.clip(np.concatenate([low0, hi0, [fit_args["combined_fit_erfloc"], erf_multiplicity]]), lower, upper)
+
+    def residuals(x):
+        param_dictionary = {"low_param": x[:n_low], "hi_param": x[n_low:-2], "erf_param": x[-2], "erf_multiplicity": x[-1]}
+        with np.errstate(all="ignore"):
+            res = weights*(loglog_func(T, param_dictionary)-k)/k
+        return np.where(np.isfinite(res), res, 1e3)
+
+    result = least_squares(residuals, x0, bounds=(lower, upper), loss="soft_l1", x_scale="jac", max_nfev=max_nfev)
+    x = result.x
+    refined_args = dict(fit_args)
+    refined_args["low_fit_param"] = x[:n_low][::-1].tolist()
+    refined_args["hi_fit_param"] = x[n_low:-2][::-1].tolist()
+    refined_args["combined_fit_param"] = np.append(x[-2], np.append(x[:n_low][::-1], x[n_low:-2][::-1])).tolist()
+    refined_args["combined_fit_erfloc"] = float(x[-2])
+    refined_args["combined_fit_erfmult"] = float(x[-1])
+    if get_percdiff(T, k, refined_args)[0] < get_percdiff(T, k, fit_args)[0]:
+        return refined_args, result.nfev
+    return fit_args, result.nfev
+
+
 def find_gaps(data_array, threshold=0.5):
     """
     threshold - in log space